@@ -1,58 +1,621 @@
-import cv2
-import numpy as np
-import RPi.GPIO as GPIO
-
-# Set up GPIO for switch control
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(17, GPIO.OUT)
-
-# Initialize the camera
-cap = cv2.VideoCapture(0)
-
-while True:
-
-
-    
-    # Read frame from camera
-    ret, frame = cap.read()
-    if not ret:
-        break
-
-    # Convert to HSV color space
-    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-
-    # Define yellow color range in HSV
-    lower_yellow = np.array([15, 50, 50])
-    upper_yellow = np.array([30, 255, 255])
-
-    # Create a mask for yellow objects
-    mask = cv2.inRange(hsv, lower_yellow, upper_yellow)
-
-    # Find contours of yellow regions
-    cnts, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-    # Check if any contour is found
-    max_area = 0
-    if len(cnts) > 0:
-        for c in cnts:
-            area = cv2.contourArea(c)
-            if area > max_area:
-                max_area = area
-
-    # Trigger switch when a significant yellow object (flame) is detected
-    if max_area > 100:  # Adjust threshold based on testing
-        print("Flame detected!")
-        GPIO.output(17, GPIO.HIGH)
-        cv2.waitKey(500)  # Wait for half a second to prevent repeated triggers
-
-    # Display the frame
-    cv2.imshow('Frame', frame)
-
-    # Exit if ESC pressed
-    if cv2.waitKey(1) == ord('q'):
-        break
-
-# Release resources
-cap.release()
-GPIO.cleanup()
-cv2.destroyAllWindows()
+import argparse
+import collections
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import tracemalloc
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+import numpy as np
+
+try:
+    import RPi.GPIO as GPIO
+except ImportError:  # Not on a Pi (headless testing on a normal Linux box)
+    GPIO = None
+
+SWITCH_PIN = 17
+CAMERA_INDEX = 0
+
+# Yellow color range in HSV, built once instead of on every frame
+LOWER_YELLOW = np.array([15, 50, 50], dtype=np.uint8)
+UPPER_YELLOW = np.array([30, 255, 255], dtype=np.uint8)
+
+AREA_THRESHOLD = 100  # Adjust threshold based on testing
+
+
+class FramePool:
+    """Fixed ring of preallocated BGR frames that capture reads into.
+
+    With shm_name set the ring lives in a multiprocessing.shared_memory
+    block so another process can attach to it and read frames without a copy.
+    An existing block of that name is reused if it is big enough, but only a
+    block this pool created is unlinked on close (or, through
+    resource_tracker, when this process exits).
+    """
+
+    def __init__(self, width, height, slots=4, shm_name=None):
+        self.shape = (slots, height, width, 3)
+        nbytes = int(np.prod(self.shape))
+        self.shm = None
+        self.owner = False
+        if shm_name:
+            try:
+                self.shm = shared_memory.SharedMemory(name=shm_name, create=True, size=nbytes)
+                self.owner = True
+            except FileExistsError:
+                self.shm = attach_shared_memory(shm_name)
+                if self.shm.size < nbytes:
+                    size = self.shm.size
+                    self.shm.close()
+                    raise ValueError(f"Shared memory '{shm_name}' already exists with {size} bytes; "
+                                     f"{nbytes} are needed for {slots} {width}x{height} frames")
+            self.frames = np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf)
+        else:
+            self.frames = np.empty(self.shape, dtype=np.uint8)
+        self.index = 0
+
+    def next(self):
+        """Return the next slot; it is overwritten after `slots` more calls."""
+        frame = self.frames[self.index]
+        self.index = (self.index + 1) % self.shape[0]
+        return frame
+
+    def close(self, unlink=False):
+        """Release the shared block; callers must drop their frame views first."""
+        if self.shm is not None:
+            self.frames = None
+            try:
+                self.shm.close()
+            except BufferError:
+                # A frame view is still alive; the mapping goes away with the process
+                print('Shared frame memory still in use; leaving it mapped')
+            if unlink and self.owner:
+                self.shm.unlink()
+            self.shm = None
+
+
+def attach_shared_memory(name):
+    """Attach to an existing block without making this process responsible for unlinking it."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    if os.name == 'posix':
+        # bpo-39959: attaching registers the block with resource_tracker, which
+        # would unlink it (under its creator's feet) when this process exits
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class DetectBuffers:
+    """Reused outputs for the colour conversion and mask of one frame size."""
+
+    def __init__(self, width, height):
+        self.hsv = np.empty((height, width, 3), dtype=np.uint8)
+        self.mask = np.empty((height, width), dtype=np.uint8)
+
+
+def frame_size(cap):
+    """(width, height, first frame or None) of a capture.
+
+    Some backends only know the size after the first frame; that frame is
+    returned so the caller can still process it (see PushbackCapture).
+    """
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    if width and height:
+        return width, height, None
+    ret, frame = cap.read()
+    if not ret:
+        return 0, 0, None
+    return frame.shape[1], frame.shape[0], frame
+
+
+class PushbackCapture:
+    """A capture whose next read() returns a frame that was already read from it."""
+
+    def __init__(self, cap, frame):
+        self.cap = cap
+        self.frame = frame
+
+    def read(self, image=None):
+        if self.frame is None:
+            return self.cap.read() if image is None else self.cap.read(image=image)
+        frame, self.frame = self.frame, None
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            return True, image
+        return True, frame
+
+    def __getattr__(self, name):
+        return getattr(self.cap, name)
+
+
+def open_sized(cap):
+    """(capture, width, height) with the frame used to learn the size put back in front."""
+    width, height, first = frame_size(cap)
+    return (cap if first is None else PushbackCapture(cap, first)), width, height
+
+
+class LutClassifier:
+    """BGR -> flame mask with a single table gather per pixel, no HSV conversion.
+
+    The table has one entry per 24-bit BGR colour (16 MiB) and is compiled
+    offline by flame_calibrate.py. Pixel indices are read straight out of the
+    frame through an overlapping uint32 view, so there is no per-channel work.
+    """
+
+    SIZE = 1 << 24
+
+    def __init__(self, lut, area_threshold=None):
+        lut = np.ascontiguousarray(lut, dtype=np.uint8).ravel()
+        if lut.size != self.SIZE:
+            raise ValueError(f"lookup table has {lut.size} entries, expected {self.SIZE}")
+        self.lut = lut
+        self.area_threshold = area_threshold
+        self.idx = None
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        area = float(data['area_threshold']) if 'area_threshold' in data else None
+        return cls(data['lut'], area)
+
+    def save(self, path):
+        extra = {} if self.area_threshold is None else {'area_threshold': self.area_threshold}
+        np.savez_compressed(path, lut=self.lut, **extra)
+
+    def index(self, frame):
+        """B | G << 8 | R << 16 for every pixel, in a reused buffer."""
+        frame = np.ascontiguousarray(frame)
+        n = frame.shape[0] * frame.shape[1]
+        if self.idx is None or self.idx.size != n:
+            self.idx = np.empty(n, dtype=np.uint32)
+        # A little-endian uint32 every 3 bytes holds B, G, R and the next pixel's B
+        packed = np.ndarray((n - 1,), dtype='<u4', buffer=frame, strides=(3,))
+        np.bitwise_and(packed, 0xFFFFFF, out=self.idx[:n - 1])
+        b, g, r = frame[-1, -1]
+        self.idx[n - 1] = int(b) | int(g) << 8 | int(r) << 16
+        return self.idx.reshape(frame.shape[:2])
+
+    def classify(self, frame, mask):
+        np.take(self.lut, self.index(frame), out=mask, mode='clip')
+        return mask
+
+
+def _clock(timings):
+    return time.perf_counter() if timings is not None else 0.0
+
+
+def flame_mask(frame, bufs, classifier=None, timings=None):
+    """Write the flame/yellow mask for frame into bufs.mask.
+
+    timings, if given, maps stage names to lists that the 'convert' and
+    'mask' stage times (ms) are appended to; fire_replay uses it.
+    """
+    t0 = _clock(timings)
+    if classifier is not None:
+        idx = classifier.index(frame)
+        t1 = _clock(timings)
+        mask = np.take(classifier.lut, idx, out=bufs.mask, mode='clip')
+    else:
+        # Convert to HSV color space
+        cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst=bufs.hsv)
+        t1 = _clock(timings)
+
+        # Create a mask for yellow objects
+        mask = cv2.inRange(bufs.hsv, LOWER_YELLOW, UPPER_YELLOW, dst=bufs.mask)
+    if timings is not None:
+        t2 = time.perf_counter()
+        timings['convert'].append((t1 - t0) * 1000)
+        timings['mask'].append((t2 - t1) * 1000)
+    return mask
+
+
+def largest_contour(mask):
+    """(area, bbox) of the largest external contour in mask; bbox is (x, y, w, h) or None."""
+    cnts, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    max_area = 0
+    max_cnt = None
+    for c in cnts:
+        area = cv2.contourArea(c)
+        if area > max_area:
+            max_area = area
+            max_cnt = c
+    bbox = tuple(int(v) for v in cv2.boundingRect(max_cnt)) if max_cnt is not None else None
+    return max_area, bbox
+
+
+def max_yellow_area(frame, bufs, classifier=None, timings=None):
+    """Largest flame-coloured contour area in frame, using bufs for all intermediates.
+
+    Returns (area, bbox) where bbox is the (x, y, w, h) of that contour or None.
+    timings is passed to flame_mask and also gets the 'contours' stage.
+    """
+    flame_mask(frame, bufs, classifier, timings)
+    t0 = _clock(timings)
+    found = largest_contour(bufs.mask)
+    if timings is not None:
+        timings['contours'].append((time.perf_counter() - t0) * 1000)
+    return found
+
+
+def max_yellow_area_alloc(frame):
+    """The original per-frame allocating path, kept for the memory benchmark."""
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv, np.array([15, 50, 50]), np.array([30, 255, 255]))
+    cnts, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    max_area = 0
+    for c in cnts:
+        area = cv2.contourArea(c)
+        if area > max_area:
+            max_area = area
+    return max_area
+
+
+class EventRecorder:
+    """Keeps the last pre_seconds of frames as JPEG and dumps them on a detection.
+
+    add() runs on the capture loop and only does the JPEG encode; the clip and
+    its JSON metadata are written by a background thread so a slow SD card
+    never stalls detection.
+    """
+
+    def __init__(self, out_dir, pre_seconds=5.0, fps=30.0, quality=80):
+        self.out_dir = out_dir
+        self.fps = fps
+        self.params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+        self.ring = collections.deque(maxlen=max(1, int(pre_seconds * fps)))
+        self.jobs = queue.Queue()
+        self.events = 0
+        os.makedirs(out_dir, exist_ok=True)
+        self.writer = threading.Thread(target=self._writer, name='event-writer', daemon=True)
+        self.writer.start()
+
+    def add(self, frame, ts):
+        ok, jpg = cv2.imencode('.jpg', frame, self.params)
+        if ok:
+            self.ring.append((ts, jpg))
+
+    def trigger(self, ts, area, bbox):
+        """Queue the buffered frames up to ts as a clip; returns the event name."""
+        self.events += 1
+        name = f"event_{time.strftime('%Y%m%d_%H%M%S', time.localtime(ts))}_{self.events:04d}"
+        meta = {
+            'event': name,
+            'triggered_at': ts,
+            'area': float(area),
+            'bbox': list(bbox) if bbox else None,
+        }
+        self.jobs.put((name, list(self.ring), meta))
+        return name
+
+    def close(self):
+        """Flush pending clips and stop the writer thread."""
+        self.jobs.put(None)
+        self.writer.join()
+
+    def _writer(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            name, frames, meta = job
+            try:
+                self._write_clip(name, frames, meta)
+            except Exception as e:
+                print(f"Failed to write {name}: {e}")
+
+    def _write_clip(self, name, frames, meta):
+        clip_path = os.path.join(self.out_dir, name + '.avi')
+        writer = None
+        for _, jpg in frames:
+            img = cv2.imdecode(jpg, cv2.IMREAD_COLOR)
+            if writer is None:
+                h, w = img.shape[:2]
+                writer = cv2.VideoWriter(clip_path, cv2.VideoWriter_fourcc(*'MJPG'), self.fps, (w, h))
+            writer.write(img)
+        if writer is not None:
+            writer.release()
+        meta['clip'] = os.path.basename(clip_path) if frames else None
+        meta['frames'] = len(frames)
+        meta['clip_start'] = frames[0][0] if frames else None
+        meta['clip_end'] = frames[-1][0] if frames else None
+        tmp = os.path.join(self.out_dir, name + '.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp, os.path.join(self.out_dir, name + '.json'))
+
+
+class MotionGate:
+    """Skips the full detection path on frames where nothing has changed.
+
+    A small grey thumbnail of each frame is compared with a running-average
+    background; the frame is processed when enough thumbnail pixels moved, when
+    the previous processed frame held a flame, or when force_every frames in a
+    row have been skipped, so a static flame is still caught within that many
+    frames.
+    """
+
+    def __init__(self, size=(80, 60), pixel_delta=12.0, changed_fraction=0.002, alpha=0.05,
+                 force_every=30):
+        w, h = size
+        self.size = size
+        self.pixel_delta = pixel_delta
+        self.min_changed = max(1, int(changed_fraction * w * h))
+        self.alpha = alpha
+        self.force_every = force_every
+        self.small = np.empty((h, w, 3), dtype=np.uint8)
+        self.grey = np.empty((h, w), dtype=np.uint8)
+        self.greyf = np.empty((h, w), dtype=np.float32)
+        self.diff = np.empty((h, w), dtype=np.float32)
+        self.background = None
+        self.last_hit = False
+        self.since_full = 0
+        self.processed = 0
+        self.gated = 0
+        self.forced = 0
+        self.gate_seconds = 0.0
+        self.full_seconds = 0.0
+
+    def check(self, frame):
+        """True if frame needs the full detection path."""
+        t0 = time.perf_counter()
+        cv2.resize(frame, self.size, dst=self.small, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.grey)
+        np.copyto(self.greyf, self.grey)
+        if self.background is None:
+            self.background = self.greyf.copy()
+            changed = True
+        else:
+            cv2.absdiff(self.greyf, self.background, dst=self.diff)
+            cv2.threshold(self.diff, self.pixel_delta, 1.0, cv2.THRESH_BINARY, dst=self.diff)
+            changed = cv2.countNonZero(self.diff) >= self.min_changed
+            cv2.accumulateWeighted(self.greyf, self.background, self.alpha)
+
+        forced = not changed and not self.last_hit and self.since_full + 1 >= self.force_every
+        run_full = changed or self.last_hit or forced
+        if run_full:
+            self.since_full = 0
+            self.processed += 1
+            self.forced += forced
+        else:
+            self.since_full += 1
+            self.gated += 1
+        self.gate_seconds += time.perf_counter() - t0
+        return run_full
+
+    def record(self, hit, seconds):
+        """Result and cost of a full detection that check() let through."""
+        self.last_hit = hit
+        self.full_seconds += seconds
+
+    def stats(self):
+        full_ms = self.full_seconds * 1000 / self.processed if self.processed else 0.0
+        saved_ms = self.gated * full_ms - self.gate_seconds * 1000
+        return {
+            'frames': self.processed + self.gated,
+            'processed': self.processed,
+            'gated': self.gated,
+            'forced': self.forced,
+            'full_ms_mean': round(full_ms, 3),
+            'gate_ms_total': round(self.gate_seconds * 1000, 1),
+            'est_saved_ms': round(saved_ms, 1),
+        }
+
+
+def open_source(source):
+    """Camera index (e.g. '0') or a path to a video file."""
+    if source is None:
+        return cv2.VideoCapture(CAMERA_INDEX), True
+    if str(source).isdigit():
+        return cv2.VideoCapture(int(source)), True
+    return cv2.VideoCapture(source), False
+
+
+def run(source=None, headless=False, out_dir=None, pre_seconds=5.0, cooldown=0.5, shm_name=None,
+        lut_path=None, motion_gate=False):
+    # Set up GPIO for switch control
+    if GPIO is not None:
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(SWITCH_PIN, GPIO.OUT)
+
+    # Initialize the camera (or a recorded clip)
+    cap, live = open_source(source)
+    cap, width, height = open_sized(cap)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    pool = FramePool(width, height, shm_name=shm_name)
+    bufs = DetectBuffers(width, height)
+    recorder = EventRecorder(out_dir, pre_seconds, fps) if out_dir else None
+    classifier = LutClassifier.load(lut_path) if lut_path else None
+    threshold = AREA_THRESHOLD
+    if classifier is not None and classifier.area_threshold is not None:
+        threshold = classifier.area_threshold
+    gate = MotionGate() if motion_gate else None
+    last_trigger = None
+    frame = None
+
+    try:
+        while True:
+            # Read frame from camera straight into the next pool slot
+            ret, frame = cap.read(image=pool.next())
+            if not ret:
+                break
+            # Files are timestamped by stream position so replays are reproducible
+            ts = time.time() if live else cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+
+            if recorder:
+                recorder.add(frame, ts)
+
+            # Trigger switch when a significant yellow object (flame) is detected
+            if gate is None:
+                max_area, bbox = max_yellow_area(frame, bufs, classifier)
+            elif gate.check(frame):
+                t0 = time.perf_counter()
+                max_area, bbox = max_yellow_area(frame, bufs, classifier)
+                gate.record(max_area > threshold, time.perf_counter() - t0)
+            else:
+                max_area, bbox = 0, None
+            if max_area > threshold and (last_trigger is None or ts - last_trigger >= cooldown):
+                last_trigger = ts
+                print(f"Flame detected! area={max_area:.0f} bbox={bbox}")
+                if GPIO is not None:
+                    GPIO.output(SWITCH_PIN, GPIO.HIGH)
+                if recorder:
+                    recorder.trigger(ts, max_area, bbox)
+                if not headless:
+                    cv2.waitKey(500)  # Wait for half a second to prevent repeated triggers
+
+            if headless:
+                continue
+
+            # Display the frame
+            cv2.imshow('Frame', frame)
+
+            # Exit if ESC pressed
+            if cv2.waitKey(1) == ord('q'):
+                break
+    finally:
+        # Release resources
+        cap.release()
+        if recorder:
+            recorder.close()
+        if GPIO is not None:
+            GPIO.cleanup()
+        if not headless:
+            cv2.destroyAllWindows()
+        if gate:
+            print(f"Motion gate: {gate.stats()}")
+        # frame is a view into the pool; drop it so a shared block can be closed
+        frame = None
+        pool.close(unlink=bool(shm_name))
+
+
+def compare_gate(source, lut_path=None):
+    """Run gated and ungated detection side by side over a clip and report agreement."""
+    cap, _ = open_source(source)
+    cap, width, height = open_sized(cap)
+    bufs = DetectBuffers(width, height)
+    classifier = LutClassifier.load(lut_path) if lut_path else None
+    threshold = AREA_THRESHOLD
+    if classifier is not None and classifier.area_threshold is not None:
+        threshold = classifier.area_threshold
+    gate = MotionGate()
+    frames = agree = missed = extra = 0
+    first_ungated = first_gated = None
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        ungated = max_yellow_area(frame, bufs, classifier)[0] > threshold
+        gated = False
+        if gate.check(frame):
+            t0 = time.perf_counter()
+            gated = max_yellow_area(frame, bufs, classifier)[0] > threshold
+            gate.record(gated, time.perf_counter() - t0)
+        if ungated and first_ungated is None:
+            first_ungated = frames
+        if gated and first_gated is None:
+            first_gated = frames
+        agree += gated == ungated
+        missed += ungated and not gated
+        extra += gated and not ungated
+        frames += 1
+    cap.release()
+    report = {
+        'frames': frames,
+        'agreement': round(agree / frames, 4) if frames else None,
+        'missed_frames': missed,
+        'extra_frames': extra,
+        'first_detection_frame': {'ungated': first_ungated, 'gated': first_gated},
+        'gate': gate.stats(),
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+
+class SyntheticCapture:
+    """Stand-in for cv2.VideoCapture that cycles through generated frames."""
+
+    def __init__(self, width=640, height=480, count=8, seed=0):
+        rng = np.random.default_rng(seed)
+        self.frames = rng.integers(0, 256, size=(count, height, width, 3), dtype=np.uint8)
+        # Paint a flame-coloured blob on every other frame
+        self.frames[::2, height // 3:height // 2, width // 3:width // 2] = (0, 200, 230)
+        self.index = 0
+
+    def read(self, image=None):
+        src = self.frames[self.index % len(self.frames)]
+        self.index += 1
+        if image is None:
+            return True, src.copy()
+        np.copyto(image, src)
+        return True, image
+
+
+def rss_kib():
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * 4096 // 1024
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench_memory(frames=10000, width=640, height=480):
+    """Run the allocating and pooled paths over a synthetic run and compare."""
+    results = {}
+    for mode in ('alloc', 'pool'):
+        cap = SyntheticCapture(width, height)
+        pool = FramePool(width, height)
+        bufs = DetectBuffers(width, height)
+        rss_start = rss_kib()
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        for _ in range(frames):
+            if mode == 'alloc':
+                _, frame = cap.read()
+                max_yellow_area_alloc(frame)
+            else:
+                _, frame = cap.read(image=pool.next())
+                max_yellow_area(frame, bufs)
+        elapsed = time.perf_counter() - t0
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[mode] = (elapsed, current, peak, rss_kib() - rss_start)
+
+    print(f"{frames} frames at {width}x{height}")
+    for mode, (elapsed, current, peak, rss_delta) in results.items():
+        print(f"{mode:>5}: {frames / elapsed:7.1f} fps  traced now {current / 1024:8.1f} KiB"
+              f"  traced peak {peak / 1024:8.1f} KiB  rss delta {rss_delta} KiB")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Flame detector driving a GPIO switch')
+    parser.add_argument('--source', help='camera index or video file (default: camera 0)')
+    parser.add_argument('--headless', action='store_true', help='run as a service without cv2.imshow')
+    parser.add_argument('--out-dir', help='write a clip + JSON metadata here for every detection')
+    parser.add_argument('--pre-seconds', type=float, default=5.0, help='seconds of video kept before a detection')
+    parser.add_argument('--cooldown', type=float, default=0.5, help='minimum seconds between detections')
+    parser.add_argument('--lut', help='calibrated lookup table from flame_calibrate.py instead of the HSV range')
+    parser.add_argument('--shm', nargs='?', const='fire_monitor_frames', help='back the frame ring with shared memory')
+    parser.add_argument('--motion-gate', action='store_true', help='skip full detection on static frames')
+    parser.add_argument('--compare-gate', action='store_true', help='check gated vs ungated detection on --source')
+    parser.add_argument('--bench-memory', type=int, metavar='FRAMES', help='run the synthetic memory benchmark')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.bench_memory:
+        bench_memory(args.bench_memory)
+    elif args.compare_gate:
+        compare_gate(args.source or str(CAMERA_INDEX), args.lut)
+    else:
+        run(args.source, args.headless, args.out_dir, args.pre_seconds, args.cooldown, args.shm, args.lut,
+            args.motion_gate)
@@ -0,0 +1,272 @@
+"""
+fire_replay.py
+
+Offline replay and benchmark harness for fire_monitor.py. Feeds the detector
+from a video file or a directory of images, with GPIO and the display stubbed
+out, and reports per-stage timings, FPS, p50/p99 latency and detection events,
+optionally scored against a ground-truth annotation file. Results are JSON so
+two detector versions can be compared on any Linux box.
+
+Annotation file:
+    {"events": [{"start_frame": 60, "end_frame": 89}, ...]}
+or with "start"/"end" in seconds of stream time instead of frame numbers.
+
+Usage:
+    python fire_replay.py clip.mp4 --truth clip.json --output result.json
+    python fire_replay.py frames_dir/ --fps 30 --lut flame_lut.npz --motion-gate
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from fire_monitor import (AREA_THRESHOLD, SWITCH_PIN, DetectBuffers, LutClassifier, MotionGate, max_yellow_area,
+                          open_sized)
+
+
+STAGES = ('decode', 'convert', 'mask', 'contours', 'decision')
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+class StubGPIO:
+    """Records what fire_monitor would have done to the switch pin."""
+
+    BCM = 'BCM'
+    OUT = 'OUT'
+    HIGH = 1
+    LOW = 0
+
+    def __init__(self):
+        self.calls = []
+
+    def setmode(self, mode):
+        self.calls.append(('setmode', mode))
+
+    def setup(self, pin, direction):
+        self.calls.append(('setup', pin, direction))
+
+    def output(self, pin, value):
+        self.calls.append(('output', pin, value))
+
+    def cleanup(self):
+        self.calls.append(('cleanup',))
+
+
+class ImageDirCapture:
+    """cv2.VideoCapture look-alike over a sorted directory of images."""
+
+    def __init__(self, path, fps=30.0):
+        self.paths = sorted(p for p in glob.glob(os.path.join(path, '*'))
+                            if os.path.splitext(p)[1].lower() in IMAGE_EXTS)
+        self.fps = fps
+        self.pos = 0
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self.pos * 1000.0 / self.fps
+        if prop in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT) and self.paths:
+            img = cv2.imread(self.paths[0], cv2.IMREAD_COLOR)
+            return img.shape[1] if prop == cv2.CAP_PROP_FRAME_WIDTH else img.shape[0]
+        return 0
+
+    def read(self, image=None):
+        if self.pos >= len(self.paths):
+            return False, None
+        img = cv2.imread(self.paths[self.pos], cv2.IMREAD_COLOR)
+        self.pos += 1
+        if img is None:
+            return False, None
+        if image is not None and image.shape == img.shape:
+            np.copyto(image, img)
+            return True, image
+        return True, img
+
+    def release(self):
+        pass
+
+
+def open_replay(source, fps=None):
+    if os.path.isdir(source):
+        return ImageDirCapture(source, fps or 30.0)
+    return cv2.VideoCapture(source)
+
+
+def load_truth(path, fps):
+    """Ground-truth events as (start_frame, end_frame) pairs."""
+    with open(path) as f:
+        data = json.load(f)
+    events = []
+    for ev in data.get('events', []):
+        if 'start_frame' in ev:
+            events.append((int(ev['start_frame']), int(ev.get('end_frame', ev['start_frame']))))
+        else:
+            start = float(ev['start'])
+            events.append((int(round(start * fps)), int(round(float(ev.get('end', start)) * fps))))
+    return events
+
+
+def summarize(samples_ms):
+    if not samples_ms:
+        return {'count': 0}
+    arr = np.asarray(samples_ms)
+    return {
+        'count': int(arr.size),
+        'mean_ms': round(float(arr.mean()), 4),
+        'p50_ms': round(float(np.percentile(arr, 50)), 4),
+        'p99_ms': round(float(np.percentile(arr, 99)), 4),
+        'max_ms': round(float(arr.max()), 4),
+    }
+
+
+def score(triggers, positive_frames, truth, frames, tolerance=0):
+    """Event and frame level accuracy of the replay against ground truth."""
+    matched = set()
+    delays = []
+    false_triggers = 0
+    for frame_no in triggers:
+        hit = None
+        for i, (start, end) in enumerate(truth):
+            if start - tolerance <= frame_no <= end + tolerance:
+                hit = i
+                break
+        if hit is None:
+            false_triggers += 1
+        elif hit not in matched:
+            matched.add(hit)
+            delays.append(max(0, frame_no - truth[hit][0]))
+
+    in_event = np.zeros(frames, dtype=bool)
+    for start, end in truth:
+        in_event[max(0, start):min(frames, end + 1)] = True
+    predicted = np.zeros(frames, dtype=bool)
+    predicted[[f for f in positive_frames if f < frames]] = True
+    tp = int(np.sum(predicted & in_event))
+    fp = int(np.sum(predicted & ~in_event))
+    fn = int(np.sum(~predicted & in_event))
+    return {
+        'truth_events': len(truth),
+        'detected_events': len(matched),
+        'missed_events': len(truth) - len(matched),
+        'false_triggers': false_triggers,
+        'detection_delay_frames': delays,
+        'frame_precision': round(tp / (tp + fp), 4) if tp + fp else None,
+        'frame_recall': round(tp / (tp + fn), 4) if tp + fn else None,
+    }
+
+
+def replay(source, fps=None, lut_path=None, motion_gate=False, cooldown=0.5, truth_path=None,
+           tolerance=0):
+    """Replay source through fire_monitor's detector and return the result dict.
+
+    With fps set, frames are released on a fixed schedule and latency is measured
+    from each frame's due time, so a detector that falls behind shows it; with
+    fps None frames are fed as fast as possible.
+    """
+    gpio = StubGPIO()
+    gpio.setmode(gpio.BCM)
+    gpio.setup(SWITCH_PIN, gpio.OUT)
+
+    cap, width, height = open_sized(open_replay(source, fps))
+    stream_fps = fps or cap.get(cv2.CAP_PROP_FPS) or 30.0
+    bufs = DetectBuffers(width, height)
+    classifier = LutClassifier.load(lut_path) if lut_path else None
+    threshold = AREA_THRESHOLD
+    if classifier is not None and classifier.area_threshold is not None:
+        threshold = classifier.area_threshold
+    gate = MotionGate() if motion_gate else None
+
+    timings = {stage: [] for stage in STAGES}
+    latency = []
+    triggers = []
+    positive = []
+    last_trigger = None
+    frame_no = 0
+    start = time.perf_counter()
+    while True:
+        due = start + frame_no / fps if fps else time.perf_counter()
+        if fps:
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        t0 = time.perf_counter()
+        ret, frame = cap.read()
+        t1 = time.perf_counter()
+        if not ret:
+            break
+        timings['decode'].append((t1 - t0) * 1000)
+
+        max_area = 0
+        if gate is None or gate.check(frame):
+            t_full = time.perf_counter()
+            max_area, _ = max_yellow_area(frame, bufs, classifier, timings)
+            if gate is not None:
+                gate.record(max_area > threshold, time.perf_counter() - t_full)
+
+        t5 = time.perf_counter()
+        ts = frame_no / stream_fps
+        if max_area > threshold:
+            positive.append(frame_no)
+            if last_trigger is None or ts - last_trigger >= cooldown:
+                last_trigger = ts
+                triggers.append(frame_no)
+                gpio.output(SWITCH_PIN, gpio.HIGH)
+        t6 = time.perf_counter()
+        timings['decision'].append((t6 - t5) * 1000)
+        latency.append((t6 - (due if fps else t0)) * 1000)
+        frame_no += 1
+
+    elapsed = time.perf_counter() - start
+    cap.release()
+    gpio.cleanup()
+
+    result = {
+        'source': source,
+        'detector': 'lut' if classifier is not None else 'hsv',
+        'motion_gate': motion_gate,
+        'rate': fps or 'max',
+        'frames': frame_no,
+        'wall_s': round(elapsed, 3),
+        'fps': round(frame_no / elapsed, 2) if elapsed else None,
+        'stages': {stage: summarize(timings[stage]) for stage in STAGES},
+        'latency': summarize(latency),
+        'triggers': [{'frame': f, 't': round(f / stream_fps, 3)} for f in triggers],
+        'gpio_pulses': sum(1 for c in gpio.calls if c[0] == 'output'),
+    }
+    if gate is not None:
+        result['gate'] = gate.stats()
+    if truth_path:
+        truth = load_truth(truth_path, stream_fps)
+        result['accuracy'] = score(triggers, positive, truth, frame_no, tolerance)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a clip or image directory through fire_monitor')
+    parser.add_argument('source', help='video file or directory of images')
+    parser.add_argument('--fps', type=float, help='feed at this fixed rate (default: as fast as possible)')
+    parser.add_argument('--lut', help='lookup table from flame_calibrate.py instead of the HSV range')
+    parser.add_argument('--motion-gate', action='store_true')
+    parser.add_argument('--cooldown', type=float, default=0.5, help='seconds of stream time between triggers')
+    parser.add_argument('--truth', help='ground-truth annotation JSON')
+    parser.add_argument('--tolerance', type=int, default=0, help='frames of slack when matching events')
+    parser.add_argument('-o', '--output', help='write the JSON result here instead of stdout')
+    args = parser.parse_args()
+
+    result = replay(args.source, args.fps, args.lut, args.motion_gate, args.cooldown, args.truth, args.tolerance)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
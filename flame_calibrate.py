@@ -0,0 +1,253 @@
+"""
+flame_calibrate.py
+
+Offline calibration for fire_monitor.py. Learns flame / non-flame colour
+distributions from labelled frames and compiles them into a BGR lookup table
+that fire_monitor.py loads with --lut, replacing cvtColor + inRange with one
+table gather per pixel. Also picks the contour area threshold and prints a
+precision/recall and speed comparison against the hard-coded HSV range.
+
+Dataset layout:
+    DATASET/images/<name>.png   BGR frame
+    DATASET/masks/<name>.png    non-zero where the frame shows flame
+
+Usage:
+    python flame_calibrate.py DATASET -o flame_lut.npz
+    python flame_calibrate.py --synthetic -o flame_lut.npz
+"""
+import argparse
+import glob
+import json
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from fire_monitor import (AREA_THRESHOLD, LOWER_YELLOW, UPPER_YELLOW, DetectBuffers, LutClassifier,
+                          flame_mask, largest_contour)
+
+
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+def load_dataset(path):
+    """List of (name, frame, mask) with mask as a bool array."""
+    samples = []
+    for img_path in sorted(glob.glob(os.path.join(path, 'images', '*'))):
+        name, ext = os.path.splitext(os.path.basename(img_path))
+        if ext.lower() not in IMAGE_EXTS:
+            continue
+        frame = cv2.imread(img_path, cv2.IMREAD_COLOR)
+        mask = cv2.imread(os.path.join(path, 'masks', name + '.png'), cv2.IMREAD_GRAYSCALE)
+        if frame is None:
+            continue
+        if mask is None:
+            # Frames without a mask file are pure negatives
+            mask = np.zeros(frame.shape[:2], dtype=np.uint8)
+        samples.append((name, frame, mask > 0))
+    return samples
+
+
+def make_synthetic(path, count=80, width=320, height=240, seed=1234):
+    """Write a reproducible labelled dataset of flames and yellow look-alikes.
+
+    Flames have a pale core, a yellow body and an orange rim (the rim falls
+    outside the HSV range). Distractors are mustard/olive objects that sit inside
+    the HSV range but are not flames, and every frame gets sensor-like noise.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(path, 'images'), exist_ok=True)
+    os.makedirs(os.path.join(path, 'masks'), exist_ok=True)
+    for i in range(count):
+        base = rng.integers(20, 120, size=3)
+        ramp = np.linspace(0.6, 1.2, width, dtype=np.float32)[None, :, None]
+        frame = np.clip(np.ones((height, width, 3), np.float32) * base * ramp, 0, 255).astype(np.uint8)
+        mask = np.zeros((height, width), dtype=np.uint8)
+
+        for _ in range(rng.integers(0, 3)):
+            x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+            w, h = int(rng.integers(10, 60)), int(rng.integers(10, 60))
+            colour = (int(rng.integers(10, 60)), int(rng.integers(130, 170)), int(rng.integers(150, 190)))
+            cv2.rectangle(frame, (x, y), (x + w, y + h), colour, -1)
+
+        if i % 3 != 0:
+            cx, cy = int(rng.integers(40, width - 40)), int(rng.integers(40, height - 40))
+            ax, ay = int(rng.integers(8, 30)), int(rng.integers(15, 45))
+            cv2.ellipse(frame, (cx, cy), (ax, ay), 0, 0, 360, (20, 120, 250), -1)
+            cv2.ellipse(frame, (cx, cy + ay // 4), (ax * 2 // 3, ay * 2 // 3), 0, 0, 360, (60, 210, 255), -1)
+            cv2.ellipse(frame, (cx, cy + ay // 3), (ax // 3, ay // 3), 0, 0, 360, (200, 250, 255), -1)
+            cv2.ellipse(mask, (cx, cy), (ax, ay), 0, 0, 360, 255, -1)
+
+        noise = rng.normal(0, 6, size=frame.shape)
+        frame = np.clip(frame + noise, 0, 255).astype(np.uint8)
+        cv2.imwrite(os.path.join(path, 'images', f'{i:04d}.png'), frame)
+        cv2.imwrite(os.path.join(path, 'masks', f'{i:04d}.png'), mask)
+    return path
+
+
+def coarse_index(frame, bits):
+    """Colour bin of every pixel at `bits` bits per channel, used for learning."""
+    shift = 8 - bits
+    b, g, r = (frame[..., i].astype(np.uint32) >> shift for i in range(3))
+    return (b << (2 * bits)) | (g << bits) | r
+
+
+def all_colours():
+    """Every 24-bit BGR colour as a 4096 x 4096 image, in lookup table order."""
+    i = np.arange(LutClassifier.SIZE, dtype=np.uint32)
+    colours = np.empty((LutClassifier.SIZE, 3), dtype=np.uint8)
+    colours[:, 0] = i & 0xFF
+    colours[:, 1] = (i >> 8) & 0xFF
+    colours[:, 2] = i >> 16
+    return colours.reshape(4096, 4096, 3)
+
+
+def hsv_lut(colours):
+    """Table equivalent to the hard-coded HSV range."""
+    hsv = cv2.cvtColor(colours, cv2.COLOR_BGR2HSV)
+    return cv2.inRange(hsv, LOWER_YELLOW, UPPER_YELLOW).ravel()
+
+
+def learn_lut(samples, bits=5, threshold=0.5, min_count=20):
+    """Compile a LutClassifier from labelled samples.
+
+    Statistics are gathered over coarse colour bins (labelled data never covers
+    16M colours) and a bin is flame when P(flame | bin) >= threshold. Bins seen
+    fewer than min_count times keep the HSV-range answer, so the table never does
+    worse than the old rule on colours the dataset does not cover. The result is
+    expanded to the full 24-bit table the runtime gathers from.
+    """
+    size = 1 << (3 * bits)
+    flame = np.zeros(size, dtype=np.int64)
+    total = np.zeros(size, dtype=np.int64)
+    for _, frame, mask in samples:
+        idx = coarse_index(frame, bits)
+        flame += np.bincount(idx[mask], minlength=size)
+        total += np.bincount(idx.ravel(), minlength=size)
+    seen = total >= min_count
+    learned = flame >= threshold * total
+
+    colours = all_colours()
+    lut = hsv_lut(colours)
+    coarse = coarse_index(colours, bits).ravel()
+    override = seen[coarse]
+    lut[override] = np.where(learned[coarse[override]], 255, 0)
+    return LutClassifier(lut)
+
+
+def frame_areas(samples, classifier=None):
+    bufs = None
+    areas = []
+    for _, frame, _ in samples:
+        if bufs is None or bufs.mask.shape != frame.shape[:2]:
+            bufs = DetectBuffers(frame.shape[1], frame.shape[0])
+        area, _ = largest_contour(flame_mask(frame, bufs, classifier))
+        areas.append(area)
+    return np.array(areas)
+
+
+def pick_area_threshold(samples, classifier):
+    """Contour area threshold with the best frame-level F1 on samples."""
+    areas = frame_areas(samples, classifier)
+    truth = np.array([mask.any() for _, _, mask in samples])
+    best, best_f1 = AREA_THRESHOLD, -1.0
+    for candidate in np.unique(np.concatenate([[0.0], areas])):
+        pred = areas > candidate
+        tp = np.sum(pred & truth)
+        f1 = 2 * tp / max(1, pred.sum() + truth.sum())
+        if f1 > best_f1:
+            best, best_f1 = float(candidate), f1
+    return best
+
+
+def precision_recall(tp, fp, fn):
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    return round(float(precision), 4), round(float(recall), 4)
+
+
+def evaluate(samples, classifier, area_threshold):
+    """Pixel and frame level precision/recall of a classifier (None = HSV range)."""
+    bufs = None
+    ptp = pfp = pfn = 0
+    ftp = ffp = ffn = 0
+    for _, frame, truth in samples:
+        if bufs is None or bufs.mask.shape != frame.shape[:2]:
+            bufs = DetectBuffers(frame.shape[1], frame.shape[0])
+        pred = flame_mask(frame, bufs, classifier) > 0
+        ptp += int(np.sum(pred & truth))
+        pfp += int(np.sum(pred & ~truth))
+        pfn += int(np.sum(~pred & truth))
+        area, _ = largest_contour(bufs.mask)
+        fired, burning = area > area_threshold, truth.any()
+        ftp += fired and burning
+        ffp += fired and not burning
+        ffn += burning and not fired
+    pixel = precision_recall(ptp, pfp, pfn)
+    frames = precision_recall(ftp, ffp, ffn)
+    return {'pixel_precision': pixel[0], 'pixel_recall': pixel[1],
+            'frame_precision': frames[0], 'frame_recall': frames[1]}
+
+
+def benchmark(samples, classifier, repeats=20):
+    """Mean milliseconds per frame for the mask stage only."""
+    frame = samples[0][1]
+    bufs = DetectBuffers(frame.shape[1], frame.shape[0])
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        for _, frame, _ in samples:
+            flame_mask(frame, bufs, classifier)
+    return round((time.perf_counter() - t0) * 1000 / (repeats * len(samples)), 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibrate the fire_monitor colour lookup table')
+    parser.add_argument('dataset', nargs='?', help='directory with images/ and masks/')
+    parser.add_argument('--synthetic', action='store_true',
+                        help='calibrate on a generated dataset (in a temporary directory) instead')
+    parser.add_argument('-o', '--output', default='flame_lut.npz')
+    parser.add_argument('--bits', type=int, default=5, help='bits per channel of the learning bins')
+    parser.add_argument('--threshold', type=float, default=0.5, help='P(flame) needed to mark a bin as flame')
+    parser.add_argument('--min-count', type=int, default=20, help='samples a bin needs before it overrides HSV')
+    parser.add_argument('--report', help='also write the report as JSON here')
+    args = parser.parse_args()
+
+    if bool(args.dataset) == args.synthetic:
+        parser.error('give either a DATASET directory or --synthetic')
+    if args.synthetic:
+        # Generated in a scratch directory so it never mixes with a real dataset
+        with tempfile.TemporaryDirectory(prefix='flame_synth_') as tmp:
+            samples = load_dataset(make_synthetic(tmp))
+        dataset = 'synthetic'
+    else:
+        dataset = args.dataset
+        samples = load_dataset(dataset)
+    if len(samples) < 2:
+        parser.error(f'need at least two labelled frames in {dataset}')
+
+    # Even frames train, odd frames are held out for the report
+    train, test = samples[0::2], samples[1::2]
+    classifier = learn_lut(train, args.bits, args.threshold, args.min_count)
+    classifier.area_threshold = pick_area_threshold(train, classifier)
+    classifier.save(args.output)
+
+    report = {
+        'dataset': dataset,
+        'train_frames': len(train),
+        'test_frames': len(test),
+        'bits': args.bits,
+        'area_threshold': classifier.area_threshold,
+        'hsv': dict(evaluate(test, None, AREA_THRESHOLD), ms_per_frame=benchmark(test, None)),
+        'lut': dict(evaluate(test, classifier, classifier.area_threshold), ms_per_frame=benchmark(test, classifier)),
+    }
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(f'Wrote {args.output}')
+
+
+if __name__ == '__main__':
+    main()
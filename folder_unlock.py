@@ -0,0 +1,519 @@
+"""
+folder_unlock.py
+
+Unlock a folder tree that Windows refuses to let you edit (README utility #2),
+e.g. a Visual Studio project copied from another machine or user.
+
+Instead of re-owning and re-ACLing the whole tree the way fix_permissions /
+attrib_reset in usb_formatter_909.py do, this walks the folder once and
+indexes only the entries that are actually in the way:
+
+    readonly  read-only attribute
+    hidden    hidden attribute
+    system    system attribute
+    owner     owned by someone other than you or Administrators
+    deny      carries deny ACEs (or cannot be listed at all)
+    open      held open by another process (reported, never forced closed)
+
+then fixes just those, in parallel batches, so the work is proportional to
+what is broken rather than to the size of the tree. Folders that could not
+be listed are walked once they have been fixed; one that still cannot be
+listed after its fix is reported as unresolved rather than retried. Hidden
+and system attributes are left alone on dot-named entries (.git, .vs), which
+are meant to be hidden.
+
+On Linux/macOS another owner, setgid or a missing write bit are ordinary
+states rather than locks, so a real tree is only diagnosed there (folders
+that cannot be listed, files held open according to /proc) and --fix is
+refused. The synthetic --bench tree, or --posix-standins on a scratch tree,
+runs the same pipeline on permission-bit stand-ins so it can be tested
+anywhere: no owner write bit = readonly, sticky bit on a file = hidden,
+setgid on a file = system, another uid = owner, no owner read (or search,
+for folders) bit = deny.
+
+Usage:
+    python folder_unlock.py C:\\src\\Project           # diagnose only
+    python folder_unlock.py C:\\src\\Project --fix     # fix what was found
+    python folder_unlock.py --bench 50000              # synthetic tree (POSIX)
+    python folder_unlock.py /tmp/scratch --fix --posix-standins
+"""
+import argparse
+import os
+import random
+import stat
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+WINDOWS = os.name == 'nt'
+
+if WINDOWS:
+    import ctypes
+    from ctypes import wintypes
+
+    advapi32 = ctypes.WinDLL('advapi32', use_last_error=True)
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    advapi32.GetNamedSecurityInfoW.argtypes = [wintypes.LPCWSTR, ctypes.c_int, wintypes.DWORD,
+                                               ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(ctypes.c_void_p),
+                                               ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(ctypes.c_void_p),
+                                               ctypes.POINTER(ctypes.c_void_p)]
+    advapi32.GetNamedSecurityInfoW.restype = wintypes.DWORD
+    advapi32.ConvertSidToStringSidW.argtypes = [ctypes.c_void_p, ctypes.POINTER(wintypes.LPWSTR)]
+    advapi32.GetAce.argtypes = [ctypes.c_void_p, wintypes.DWORD, ctypes.POINTER(ctypes.c_void_p)]
+    kernel32.LocalFree.argtypes = [ctypes.c_void_p]
+    kernel32.CreateFileW.argtypes = [wintypes.LPCWSTR, wintypes.DWORD, wintypes.DWORD, ctypes.c_void_p,
+                                     wintypes.DWORD, wintypes.DWORD, wintypes.HANDLE]
+    kernel32.CreateFileW.restype = wintypes.HANDLE
+    kernel32.SetFileAttributesW.argtypes = [wintypes.LPCWSTR, wintypes.DWORD]
+
+
+READONLY, HIDDEN, SYSTEM, OWNER, DENY, OPEN = 'readonly', 'hidden', 'system', 'owner', 'deny', 'open'
+FLAGS = (READONLY, HIDDEN, SYSTEM, OWNER, DENY, OPEN)
+
+ADMINISTRATORS = 'S-1-5-32-544'
+SE_FILE_OBJECT = 1
+OWNER_SECURITY_INFORMATION = 1
+DACL_SECURITY_INFORMATION = 4
+ACCESS_DENIED_ACE_TYPE = 1
+ERROR_SHARING_VIOLATION = 32
+INVALID_HANDLE = ctypes.c_void_p(-1).value if WINDOWS else None
+
+
+class Problem:
+    """One entry that needs fixing, with the flags that say why."""
+    __slots__ = ('path', 'is_dir', 'flags', 'mode', 'attrs', 'denied', 'holders')
+
+    def __init__(self, path, is_dir, flags, mode=0, attrs=0):
+        self.path = path
+        self.is_dir = is_dir
+        self.flags = flags
+        self.mode = mode
+        self.attrs = attrs
+        self.denied = []    # SIDs of deny ACEs (Windows)
+        self.holders = []   # pids holding it open (POSIX)
+
+    def __repr__(self):
+        return f'<Problem {self.path} {sorted(self.flags)}>'
+
+
+def current_user_sid():
+    out = subprocess.run(['whoami', '/user', '/fo', 'csv', '/nh'], capture_output=True, text=True).stdout
+    return out.strip().split(',')[-1].strip('"') if out else None
+
+
+def _sid_string(psid):
+    text = wintypes.LPWSTR()
+    if not advapi32.ConvertSidToStringSidW(psid, ctypes.byref(text)):
+        return None
+    try:
+        return text.value
+    finally:
+        kernel32.LocalFree(ctypes.cast(text, ctypes.c_void_p))
+
+
+def win_security(path):
+    """(owner SID, SIDs named by deny ACEs) of a path."""
+    owner, dacl, sd = ctypes.c_void_p(), ctypes.c_void_p(), ctypes.c_void_p()
+    rc = advapi32.GetNamedSecurityInfoW(path, SE_FILE_OBJECT, OWNER_SECURITY_INFORMATION | DACL_SECURITY_INFORMATION,
+                                        ctypes.byref(owner), None, ctypes.byref(dacl), None, ctypes.byref(sd))
+    if rc:
+        raise OSError(rc, 'GetNamedSecurityInfoW failed', path)
+    try:
+        denied = []
+        if dacl.value:
+            # ACL header: revision, sbz1, size (WORD), ace count (WORD), ...
+            count = ctypes.cast(dacl, ctypes.POINTER(ctypes.c_ushort))[2]
+            for i in range(count):
+                ace = ctypes.c_void_p()
+                if advapi32.GetAce(dacl, i, ctypes.byref(ace)) and \
+                        ctypes.cast(ace, ctypes.POINTER(ctypes.c_ubyte))[0] == ACCESS_DENIED_ACE_TYPE:
+                    # ACCESS_DENIED_ACE: 4-byte header, 4-byte mask, then the SID
+                    denied.append(_sid_string(ctypes.c_void_p(ace.value + 8)))
+        return _sid_string(owner), denied
+    finally:
+        kernel32.LocalFree(sd)
+
+
+def win_in_use(path):
+    """True if another process has the file open without sharing it."""
+    handle = kernel32.CreateFileW(path, 0x80000000, 0, None, 3, 0x80, None)  # GENERIC_READ, no sharing, OPEN_EXISTING
+    if handle == INVALID_HANDLE:
+        return ctypes.get_last_error() == ERROR_SHARING_VIOLATION
+    kernel32.CloseHandle(handle)
+    return False
+
+
+def open_files():
+    """(st_dev, st_ino) -> pids of other processes holding it open, from /proc."""
+    held = {}
+    me = os.getpid()
+    try:
+        pids = [int(p) for p in os.listdir('/proc') if p.isdigit()]
+    except OSError:
+        return held
+    for pid in pids:
+        if pid == me:
+            continue
+        fd_dir = f'/proc/{pid}/fd'
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                st = os.stat(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+            held.setdefault((st.st_dev, st.st_ino), set()).add(pid)
+    return held
+
+
+def classify(path, is_dir, st, uid, held, standins=False):
+    """Problem flags of one entry from its stat result (no further syscalls on POSIX).
+
+    On POSIX only open files count unless `standins` turns on the permission-bit stand-ins."""
+    flags = set()
+    if WINDOWS:
+        attrs = st.st_file_attributes
+        if attrs & stat.FILE_ATTRIBUTE_READONLY:
+            flags.add(READONLY)
+        if os.path.basename(path).startswith('.'):
+            # .git, .vs and friends are hidden on purpose
+            return flags
+        if attrs & stat.FILE_ATTRIBUTE_HIDDEN:
+            flags.add(HIDDEN)
+        if attrs & stat.FILE_ATTRIBUTE_SYSTEM:
+            flags.add(SYSTEM)
+        return flags
+    if held and (st.st_dev, st.st_ino) in held:
+        flags.add(OPEN)
+    if not standins:
+        return flags
+    mode = st.st_mode
+    if not mode & stat.S_IWUSR:
+        flags.add(READONLY)
+    if not mode & stat.S_IRUSR or (is_dir and not mode & stat.S_IXUSR):
+        flags.add(DENY)
+    if not is_dir and mode & stat.S_ISVTX:
+        flags.add(HIDDEN)
+    if not is_dir and mode & stat.S_ISGID:
+        flags.add(SYSTEM)
+    if st.st_uid != uid:
+        flags.add(OWNER)
+    return flags
+
+
+def walk(root, handles=True, standins=False):
+    """One pass over root; returns (index of Problems, entries seen, folders that could not be listed,
+    every (path, is_dir) on Windows where owner and ACL checks still need them). root itself is classified too."""
+    uid = None if WINDOWS else os.getuid()
+    held = open_files() if handles and not WINDOWS else None
+    index = []
+    seen = 0
+    unlisted = []
+    paths = [] if WINDOWS else None
+
+    def add(path, st):
+        is_dir = stat.S_ISDIR(st.st_mode)
+        if paths is not None:
+            paths.append((path, is_dir))
+        flags = classify(path, is_dir, st, uid, held, standins)
+        if flags:
+            problem = Problem(path, is_dir, flags, st.st_mode, getattr(st, 'st_file_attributes', 0))
+            if OPEN in flags:
+                problem.holders = sorted(held[(st.st_dev, st.st_ino)])
+            index.append(problem)
+        return is_dir
+
+    try:
+        add(root, os.stat(root, follow_symlinks=False))
+        seen += 1
+    except OSError:
+        pass
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            it = os.scandir(folder)
+        except PermissionError:
+            unlisted.append(folder)
+            continue
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                try:
+                    # DirEntry caches this from the directory listing (FindFirstFile on Windows)
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                seen += 1
+                if stat.S_ISLNK(st.st_mode):
+                    continue
+                if add(entry.path, st):
+                    stack.append(entry.path)
+    return index, seen, unlisted, paths
+
+
+def inspect_windows(index, seen_paths, workers=16, handles=True):
+    """Owner, deny-ACE and open-handle checks, which need a call per entry on Windows, in a pool."""
+    user = current_user_sid()
+    ok_owners = {user, ADMINISTRATORS}
+    by_path = {p.path: p for p in index}
+
+    def check(item):
+        path, is_dir = item
+        flags = set()
+        denied = []
+        try:
+            owner, denied = win_security(path)
+            if owner not in ok_owners:
+                flags.add(OWNER)
+            if denied:
+                flags.add(DENY)
+        except OSError:
+            flags.add(DENY)
+        if handles and not is_dir and win_in_use(path):
+            flags.add(OPEN)
+        return path, is_dir, flags, denied
+
+    with ThreadPoolExecutor(workers) as pool:
+        for path, is_dir, flags, denied in pool.map(check, seen_paths, chunksize=256):
+            if not flags:
+                continue
+            problem = by_path.get(path)
+            if problem is None:
+                problem = by_path[path] = Problem(path, is_dir, set())
+                index.append(problem)
+            problem.flags |= flags
+            problem.denied = denied
+    return user
+
+
+def diagnose(root, workers=16, handles=True, standins=False):
+    """(index, entries seen, unlisted folders, user SID or None) for one walk of root."""
+    t0 = time.perf_counter()
+    index, seen, unlisted, paths = walk(root, handles, standins)
+    user = None
+    if WINDOWS:
+        user = inspect_windows(index, paths, workers, handles)
+    known = {p.path: p for p in index}
+    for folder in unlisted:
+        if folder in known:
+            known[folder].flags.add(DENY)
+        else:
+            index.append(Problem(folder, True, {DENY}, _mode(folder)))
+    print(f'Walked {seen} entries under {root} in {time.perf_counter() - t0:.2f}s: '
+          f'{len(index)} need attention ({summary(index)})')
+    return index, seen, unlisted, user
+
+
+def _mode(path):
+    try:
+        return os.lstat(path).st_mode
+    except OSError:
+        return 0
+
+
+def summary(index):
+    counts = {flag: 0 for flag in FLAGS}
+    for problem in index:
+        for flag in problem.flags:
+            counts[flag] += 1
+    return ', '.join(f'{n} {flag}' for flag, n in counts.items() if n) or 'nothing'
+
+
+def fix_posix(problem, uid):
+    if OWNER in problem.flags:
+        os.chown(problem.path, uid, -1, follow_symlinks=False)
+    mode = stat.S_IMODE(problem.mode or os.lstat(problem.path).st_mode)
+    if READONLY in problem.flags:
+        mode |= stat.S_IWUSR
+    if DENY in problem.flags:
+        mode |= stat.S_IRUSR | (stat.S_IXUSR if problem.is_dir else 0)
+    if HIDDEN in problem.flags:
+        mode &= ~stat.S_ISVTX
+    if SYSTEM in problem.flags:
+        mode &= ~stat.S_ISGID
+    os.chmod(problem.path, mode)
+
+
+def fix_windows(problem, user):
+    path = problem.path
+    if problem.flags & {READONLY, HIDDEN, SYSTEM}:
+        keep = problem.attrs & ~(stat.FILE_ATTRIBUTE_READONLY | stat.FILE_ATTRIBUTE_HIDDEN |
+                                 stat.FILE_ATTRIBUTE_SYSTEM)
+        if not kernel32.SetFileAttributesW(path, keep or stat.FILE_ATTRIBUTE_NORMAL):
+            raise ctypes.WinError(ctypes.get_last_error())
+    if OWNER in problem.flags:
+        subprocess.run(['takeown', '/f', path] + (['/d', 'y'] if problem.is_dir else []),
+                       capture_output=True, check=True)
+        subprocess.run(['icacls', path, '/grant', f'*{user}:F'], capture_output=True, check=True)
+    if DENY in problem.flags:
+        sids = [f'*{sid}' for sid in problem.denied if sid]
+        if sids:
+            subprocess.run(['icacls', path, '/remove:d'] + sids, capture_output=True, check=True)
+        else:
+            # Unreadable ACL: take it over, then grant ourselves access
+            subprocess.run(['takeown', '/f', path], capture_output=True, check=True)
+            subprocess.run(['icacls', path, '/grant', f'*{user}:F'], capture_output=True, check=True)
+
+
+def fix(index, user=None, workers=16, batch=256, standins=False):
+    """Fix every indexed problem except open handles, in parallel batches; returns (fixed, failed)."""
+    if not WINDOWS and not standins:
+        raise ValueError('fixing on POSIX only applies to the permission-bit stand-ins')
+    uid = None if WINDOWS else os.getuid()
+    todo = [p for p in index if p.flags - {OPEN}]
+
+    def run(chunk):
+        fixed, failed = 0, []
+        for problem in chunk:
+            try:
+                if WINDOWS:
+                    fix_windows(problem, user)
+                else:
+                    fix_posix(problem, uid)
+                fixed += 1
+            except (OSError, subprocess.CalledProcessError) as e:
+                failed.append((problem, e))
+        return fixed, failed
+
+    fixed, failed = 0, []
+    batches = [todo[i:i + batch] for i in range(0, len(todo), batch)]
+    with ThreadPoolExecutor(workers) as pool:
+        for n, errors in pool.map(run, batches):
+            fixed += n
+            failed += errors
+    return fixed, failed
+
+
+def unlock(root, apply=False, workers=16, batch=256, handles=True, standins=False):
+    """Diagnose root and, with apply, fix it; folders unlisted until fixed are then walked the same way.
+
+    A folder that still cannot be listed after it was fixed is reported as
+    unresolved instead of being fixed again, so every pass makes progress.
+    """
+    index, seen, unlisted, user = diagnose(root, workers, handles, standins)
+    for problem in index:
+        if OPEN in problem.flags:
+            holders = f" by pid {', '.join(map(str, problem.holders))}" if problem.holders else ''
+            print(f'In use{holders}: {problem.path}')
+    if not apply:
+        return index
+    total_fixed, total_failed = 0, []
+    attempted, unresolved = set(), []
+    while True:
+        t0 = time.perf_counter()
+        fixed, failed = fix(index, user, workers, batch, standins)
+        total_fixed += fixed
+        total_failed += failed
+        print(f'Fixed {fixed} entries in {time.perf_counter() - t0:.2f}s' + (f', {len(failed)} failed' if failed else ''))
+        broken = {p.path for p, _ in failed}
+        reachable = [f for f in unlisted if f not in broken]
+        if not reachable:
+            break
+        attempted.update(reachable)
+        index, unlisted = [], []
+        for folder in reachable:
+            more, _, still, user = diagnose(folder, workers, handles, standins)
+            # Fixed once and still unlistable (an inherited deny, a POSIX ACL): fixing it again won't help
+            stuck = {f for f in still if f in attempted}
+            unresolved += sorted(stuck)
+            index += [p for p in more if p.path not in stuck]
+            unlisted += [f for f in still if f not in stuck]
+    for problem, error in total_failed:
+        print(f'Could not fix {problem.path} ({", ".join(sorted(problem.flags))}): {error}')
+    for folder in unresolved:
+        print(f'Still cannot list {folder} after fixing it; check its inherited ACEs by hand')
+    return index
+
+
+def make_synthetic(root, files=10000, broken=0.01, per_dir=50, seed=4):
+    """A POSIX tree with `broken` of its entries given the stand-in problems; returns how many."""
+    rng = random.Random(seed)
+    foreign = os.getuid() + 1000 if os.getuid() == 0 else None
+    count = 0
+    folders = []
+    for i in range(files):
+        folder = os.path.join(root, f'proj{i // (per_dir * 20)}', f'dir{i // per_dir}')
+        if i % per_dir == 0:
+            os.makedirs(folder, exist_ok=True)
+            folders.append(folder)
+        path = os.path.join(folder, f'file{i}.cs')
+        with open(path, 'w') as f:
+            f.write('// generated\n')
+        if rng.random() < broken:
+            count += 1
+            kind = rng.choice([READONLY, HIDDEN, SYSTEM, OWNER, DENY] if foreign else [READONLY, HIDDEN, SYSTEM, DENY])
+            if kind == OWNER:
+                os.chown(path, foreign, -1)
+            else:
+                bits = {READONLY: 0o444, HIDDEN: 0o1644, SYSTEM: 0o2644, DENY: 0o244}[kind]
+                os.chmod(path, bits)
+    # A couple of folders nobody can list until they are fixed (only meaningful when not root)
+    for folder in rng.sample(folders, min(2, len(folders))):
+        os.chmod(folder, 0o300)
+        count += 1
+    return count
+
+
+def reset_everything(root):
+    """The old approach: re-apply ownership and permissions to every entry in the tree."""
+    uid = os.getuid()
+    for folder, dirs, files in os.walk(root):
+        for name in dirs + files:
+            path = os.path.join(folder, name)
+            os.chown(path, uid, -1, follow_symlinks=False)
+            os.chmod(path, 0o755 if name in dirs else 0o644)
+
+
+def bench(files, broken, workers):
+    if WINDOWS:
+        print('The synthetic benchmark uses POSIX permission bits; run it on Linux/macOS')
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, 'tree')
+        planted = make_synthetic(root, files, broken)
+        print(f'{files} files, {planted} problems planted')
+        unlock(root, apply=True, workers=workers, standins=True)
+        index, _, _, _ = diagnose(root, workers, standins=True)
+        print(f'After unlock: {len(index)} problems left')
+        root = os.path.join(tmp, 'tree2')
+        make_synthetic(root, files, broken)
+        t0 = time.perf_counter()
+        reset_everything(root)
+        print(f'Re-applying everything (takeown /r + icacls /t + attrib /s style): {time.perf_counter() - t0:.2f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find and fix only the locked entries in a folder tree')
+    parser.add_argument('root', nargs='?', help='folder to unlock')
+    parser.add_argument('--fix', action='store_true', help='fix what was found (default: only report it)')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--batch', type=int, default=256, help='entries per fix batch')
+    parser.add_argument('--no-handles', action='store_true', help='skip the open-handle check')
+    parser.add_argument('--list', action='store_true', help='print every problem entry')
+    parser.add_argument('--posix-standins', action='store_true',
+                        help='treat permission bits as Windows locks (scratch trees only; POSIX)')
+    parser.add_argument('--bench', type=int, metavar='FILES', help='synthetic tree benchmark (POSIX)')
+    parser.add_argument('--broken', type=float, default=0.01, help='fraction of synthetic entries to break')
+    args = parser.parse_args()
+    if args.bench:
+        bench(args.bench, args.broken, args.workers)
+        return
+    if not args.root:
+        parser.error('give a folder to unlock')
+    if args.fix and not WINDOWS and not args.posix_standins:
+        parser.error('--fix only unlocks Windows folders; on this system it needs --posix-standins '
+                     '(which rewrites owners and permission bits, so use it on scratch trees only)')
+    index = unlock(os.path.abspath(args.root), args.fix, args.workers, args.batch, not args.no_handles,
+                   args.posix_standins)
+    if args.list and not args.fix:
+        for problem in index:
+            print(f'{", ".join(sorted(problem.flags)):<24} {problem.path}')
+
+
+if __name__ == '__main__':
+    main()
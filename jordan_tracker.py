@@ -1,28 +1,111 @@
-
-'''
-# Webhooks Discord Server 
-jordans_channel_webhook = 'https://discord.com/api/webhooks/1189636969161040073/FagVl-yrnHjKml13RrEq_xcsXrvhNnrpbG4AfbSLDQu51Mf3RnxwKfgNRiVDEXGzaRfS'
-nike_channel_webhook = 'https://discord.com/api/webhooks/1189942534517051512/iGUWnhTRQRNZSleCldyubvn-tFxCEGOwACBYmS1_R8OUf3B8qeqXUiRE8gVzsbt--Lgs'
-snkrs_channel_webhook = 'https://discord.com/api/webhooks/1191019888966381698/n7wO50NhtL170-IzY-RgxQwrpHJN0fXhwp8pzLR5YWh2-0Iye8msspecVQAsygVRQ4DR'
-testing_webhook = 'https://discord.com/api/webhooks/1189962255274610720/69gMnTcyLojjSNDw1PsYbK4-_j4eYUo3EewkykbCOqLWBUjfnZAUxHFys0RXqJmnQWnY'
-
-# The APIs from which the data is being fetched
-air_jordans_api_target_url = 'https://api.nike.com/cic/browse/v2?queryid=products&anonymousId=5BFC52F66E37C95FCB641DBC401EB101&country=gb&endpoint=%2Fproduct_feed%2Frollup_threads%2Fv2%3Ffilter%3Dmarketplace(GB)%26filter%3Dlanguage(en-GB)%26filter%3DemployeePrice(true)%26filter%3DattributeIds(0f64ecc7-d624-4e91-b171-b83a03dd8550%2C16633190-45e5-4830-a068-232ac7aea82c%2C193af413-39b0-4d7e-ae34-558821381d3f%2C498ac76f-4c2c-4b55-bbdc-dd37011887b1)%26anchor%3D24%26consumerChannelId%3Dd9a5bc42-4b9c-4976-858a-f159cf99c647%26count%3D24&language=en-GB&localizedRangeStr=%7BlowestPrice%7D%E2%80%94%7BhighestPrice%7D'
-nike_api_target_url = 'https://api.nike.com/cic/browse/v2?queryid=products&anonymousId=5BFC52F66E37C95FCB641DBC401EB101&country=gb&endpoint=%2Fproduct_feed%2Frollup_threads%2Fv2%3Ffilter%3Dmarketplace(GB)%26filter%3Dlanguage(en-GB)%26filter%3DemployeePrice(true)%26filter%3DattributeIds(0f64ecc7-d624-4e91-b171-b83a03dd8550%2C16633190-45e5-4830-a068-232ac7aea82c%2C193af413-39b0-4d7e-ae34-558821381d3f)%26anchor%3D24%26consumerChannelId%3Dd9a5bc42-4b9c-4976-858a-f159cf99c647%26count%3D24&language=en-GB&localizedRangeStr=%7BlowestPrice%7D%E2%80%94%7BhighestPrice%7D'
-snkrs_api_target_url = 'https://api.nike.com/product_feed/threads/v3/?anchor=50&count=50&filter=marketplace%28GB%29&filter=language%28en-GB%29&filter=inStock%28true%29&filter=productInfo.merchPrice.discounted%28false%29&filter=channelId%28010794e5-35fe-4e32-aaff-cd2c74f89d61%29&filter=exclusiveAccess%28true%2Cfalse%29'
-
-'''
-
-
-
-
-url_list = [
-    'https://2fwotdvm2o-3.algolianet.com/1/indexes/*/queries',
-    'https://www.goat.com/web-api/v1/product_templates/',
-    'https://www.goat.com/sneakers/',
-    'https://api.thesneakerdatabase.com/v1/sneakers?limit=100&brand=adidas',
-    'https://www.nike.com/in/t/air-max-sc-shoes-gMGhP8/FJ3242-100',
-    'https://www.nike.com/in/t/air-force-1-07-shoes-9nHjKZ/315122-111',####?????????
-    'https://www.nike.com/in/t/air-jordan-1-mid-shoes-9nHjKZ/554724-074',###?
-    'https://www.nike.com/gb/t/dunk-low-retro-shoes-szNRv1/FB3354-001'
-]
\ No newline at end of file
+import argparse
+import asyncio
+
+from tracker_metrics import TrackerMetrics, serve
+from tracker_mock_server import localize
+from tracker_poller import HttpClient, Poller
+from tracker_registry import DIFF_PARSERS, Registry, TargetScheduler
+from tracker_shards import Coordinator, run_sharded
+from tracker_store import SnapshotStore
+from tracker_webhooks import Outbox, WebhookDispatcher
+
+# Feeds, product pages and Discord webhooks live in the target config, which is
+# re-read while the tracker runs; see tracker_registry.py for the format.
+CONFIG = 'tracker_targets.json'
+
+# Per-host (concurrency, requests/second) so one busy host can't starve the rest
+host_limits = {
+    'api.nike.com': (4, 4.0),
+    'www.nike.com': (2, 1.0),
+    'www.goat.com': (2, 1.0),
+}
+
+
+def report(target, responses, store=None, dispatcher=None, metrics=None):
+    fresh = [r for r in responses if r.status == 200]
+    print(f'[{target.name}] {len(fresh)}/{len(responses)} pages changed, {sum(r.size for r in fresh)} bytes')
+    if store is None or target.parser not in DIFF_PARSERS:
+        return []
+    if metrics is not None:
+        events = metrics.diff(target, responses, store)
+    else:
+        events = store.diff_responses(target.name, responses)
+    for event in events:
+        print(f"[{target.name}] {event['kind']}: {event['title']} {event['sku']} {event['price']}")
+    if dispatcher is not None:
+        dispatcher.submit(events)
+    return events
+
+
+async def watch_config(registry, reloaded, stop, every=2.0):
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), every)
+        except asyncio.TimeoutError:
+            changes = registry.check()
+            if changes:
+                reloaded(changes)
+
+
+async def main(base=None, once=False, db_path='tracker_snapshot.db', outbox_path='tracker_outbox.db',
+               config_path=CONFIG, shards=1, cache_path='tracker_http_cache.db', metrics_port=None, metrics_out=None):
+    registry = Registry(config_path, (lambda u: localize(u, base)) if base else None)
+    store = SnapshotStore(db_path)
+    client = HttpClient(host_limits={} if base else host_limits)
+    dispatcher = WebhookDispatcher(client, registry.routes, registry.default_webhook, Outbox(outbox_path))
+    metrics = TrackerMetrics()
+    poller = Poller(registry.targets.values(), client, on_result=lambda t, r: report(t, r, store, dispatcher, metrics))
+    metrics.attach(poller, dispatcher)
+    if metrics_port:
+        serve(metrics, metrics_port)
+        print(f'Metrics on http://127.0.0.1:{metrics_port}/metrics and /metrics.json')
+
+    def reloaded(changes):
+        added, removed, changed = changes
+        dispatcher.routes = registry.routes
+        dispatcher.default = registry.default_webhook
+        print(f'Reloaded {config_path}: {len(added)} added, {len(removed)} removed, {len(changed)} changed')
+
+    stop = asyncio.Event()
+    delivery = asyncio.create_task(dispatcher.run(stop))
+    try:
+        if shards > 1:
+            # Workers poll and diff; this process merges their events and owns the webhooks
+            watcher = asyncio.create_task(watch_config(registry, reloaded, stop))
+            await run_sharded(shards, config_path, base, cache_path, db_path, Coordinator(dispatcher, metrics=metrics),
+                              host_limits, rounds=1 if once else None, stop=stop)
+            await dispatcher.drain(timeout=60)
+            stop.set()
+            await watcher
+        elif once:
+            await poller.poll_all()
+            await dispatcher.drain(timeout=60)
+        else:
+            await TargetScheduler(registry, poller.poll_once, on_reload=reloaded).run(stop)
+    finally:
+        stop.set()
+        await delivery
+        await client.close()
+        dispatcher.outbox.close()
+        store.close()
+        if metrics_out:
+            metrics.write(metrics_out)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Poll sneaker feeds for drops and restocks')
+    parser.add_argument('--base', help='send every request to this base URL (e.g. tracker_mock_server.py)')
+    parser.add_argument('--once', action='store_true', help='poll every target once and exit')
+    parser.add_argument('--db', default='tracker_snapshot.db', help='snapshot store used to diff polls')
+    parser.add_argument('--outbox', default='tracker_outbox.db', help='undelivered alerts, resent on start')
+    parser.add_argument('--config', default=CONFIG, help='target registry (reloaded when it changes)')
+    parser.add_argument('--shards', type=int, default=1, help='worker processes to split the targets across')
+    parser.add_argument('--cache', default='tracker_http_cache.db', help='HTTP cache shared by the shard workers')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus /metrics and /metrics.json on this port')
+    parser.add_argument('--metrics-out', help='write the metrics here on exit (.json or Prometheus text)')
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args.base, args.once, args.db, args.outbox, args.config, args.shards, args.cache,
+                         args.metrics_port, args.metrics_out))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,51 @@
+import json
+import pickle
+
+from tracker_metrics import TrackerMetrics
+from tracker_poller import Response, Target
+from tracker_store import SnapshotStore
+
+
+def page(ids, published='2024-01-01T09:00:00.000Z'):
+    objects = [{'id': f't{i}', 'publishedContent': {'properties': {'publishStartDate': published}},
+                'productInfo': [{'merchProduct': {'id': f'p{i}', 'styleColor': f'SC{i}'},
+                                 'merchPrice': {'currentPrice': 100.0},
+                                 'availability': {'available': True}}]}
+               for i in ids]
+    resp = Response('http://feed/page', 200, {}, json.dumps({'objects': objects}).encode(), 0.0)
+    return [resp]
+
+
+def test_first_poll_after_restart_measures_detection_lag(tmp_path):
+    target = Target('snkrs', 'http://feed/page', parser='json')
+    store = SnapshotStore(str(tmp_path / 's.db'))
+    metrics = TrackerMetrics()
+    assert metrics.diff(target, page([1, 2]), store) == []
+    assert metrics.detection_lag == {}
+    store.close()
+
+    store = SnapshotStore(str(tmp_path / 's.db'))
+    metrics = TrackerMetrics()
+    events = metrics.diff(target, page([1, 2, 3]), store)
+    assert [e['key'] for e in events] == ['p3']
+    assert metrics.detection_lag['snkrs'].count == 1
+    store.close()
+
+
+def test_worker_snapshots_merge_into_the_parent():
+    workers = [TrackerMetrics(), TrackerMetrics()]
+    for metrics, name in zip(workers, ('nike', 'snkrs')):
+        target = Target(name, 'http://feed/page', parser='json')
+        metrics.polled(target, page([1]), 0.01)
+        cached = page([1])[0]
+        cached.cached = True
+        metrics.polled(target, [cached], 0.01)
+    parent = TrackerMetrics()
+    for metrics in workers:
+        # Snapshots cross a multiprocessing queue, so they must pickle
+        parent.merge(pickle.loads(pickle.dumps(metrics.snapshot())))
+    parent.merge(pickle.loads(pickle.dumps(workers[0].snapshot())))
+    targets = parent.to_json()['targets']
+    assert sorted(targets) == ['nike', 'snkrs']
+    assert targets['nike']['polls'] == 2
+    assert targets['snkrs']['cache_hit_rate'] == 0.5
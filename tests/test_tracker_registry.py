@@ -0,0 +1,92 @@
+import asyncio
+import random
+
+from tracker_registry import FakeClock, Registry, TargetScheduler, write_json
+
+
+def config(**tiers):
+    return {'targets': [{'name': name, 'url': f'https://www.nike.com/gb/t/{name}', 'interval': 60,
+                         'jitter': 0, 'tier': tier} for name, tier in tiers.items()]}
+
+
+def run_scheduler(path, edits, until):
+    """Poll times per target in virtual time; edits maps a time to the config written then."""
+    clock = FakeClock()
+    registry = Registry(path)
+    polls = {}
+
+    async def poll(target):
+        polls.setdefault(target.name, []).append(clock())
+
+    async def main():
+        scheduler = TargetScheduler(registry, poll, clock, clock.sleep, random.Random(1), reload_every=2.0)
+        stop = asyncio.Event()
+        runner = asyncio.ensure_future(scheduler.run(stop))
+        for when, doc in sorted(edits.items()):
+            await clock.advance(when)
+            write_json(path, doc)
+        await clock.advance(until)
+        stop.set()
+        await clock.advance(until + 60)
+        await runner
+        return scheduler
+
+    return asyncio.run(main()), registry, polls
+
+
+def gaps(times):
+    return [round(b - a, 6) for a, b in zip(times, times[1:])]
+
+
+def test_promotion_to_hot_takes_effect_at_the_next_reload(tmp_path):
+    path = str(tmp_path / 'targets.json')
+    write_json(path, config(a='normal', b='normal'))
+    scheduler, registry, polls = run_scheduler(path, {121: config(a='hot', b='normal')}, 600)
+
+    assert registry.reloads == 2
+    before = [t for t in polls['a'] if t < 121]
+    after = [t for t in polls['a'] if t >= 121]
+    assert set(gaps(before)) == {60.0}
+    # Picked up within one reload_every, without waiting out the old 60 s interval
+    assert after[0] <= 121 + 2.0 + 15.0
+    assert set(gaps(after)) == {15.0}
+    assert set(gaps(polls['b'])) == {60.0}
+    assert scheduler.stats()['in_flight'] == 0
+
+
+def test_reload_adds_and_drops_targets_and_ignores_a_broken_edit(tmp_path):
+    path = str(tmp_path / 'targets.json')
+    write_json(path, config(a='normal', b='normal'))
+    edits = {
+        100: config(a='normal', c='cold'),
+        300: {'targets': [{'name': 'a', 'url': 'https://www.nike.com/gb/t/a', 'tier': 'scorching'}]},
+    }
+    _, registry, polls = run_scheduler(path, edits, 1200)
+
+    assert max(polls['b']) < 100
+    assert min(polls['c']) >= 100
+    assert set(gaps(polls['c'])) == {240.0}
+    # The bad edit is reported and the last good targets keep polling
+    assert sorted(registry.targets) == ['a', 'c']
+    assert max(polls['a']) > 1100
+
+
+def test_config_with_wrong_types_is_rejected_and_old_targets_kept(tmp_path):
+    path = str(tmp_path / 'targets.json')
+    write_json(path, config(a='normal'))
+    bad = [
+        {'targets': [42]},
+        {'targets': [{'name': 'a', 'url': 'https://www.nike.com/gb/t/a', 'tier': ['hot']}]},
+        {'targets': [{'name': 'a', 'url': 'https://www.nike.com/gb/t/a', 'webhook': 5}]},
+        {'targets': [{'name': 'a', 'url': 'https://www.nike.com/gb/t/a', 'interval': None}]},
+        {'tiers': {'hot': 'fast'}, 'targets': [{'name': 'a', 'url': 'https://www.nike.com/gb/t/a'}]},
+        {'targets': {'a': 'https://www.nike.com/gb/t/a'}},
+    ]
+    edits = {100 + 50 * i: doc for i, doc in enumerate(bad)}
+    scheduler, registry, polls = run_scheduler(path, edits, 900)
+
+    assert registry.reloads == 1
+    assert sorted(registry.targets) == ['a']
+    assert set(gaps(polls['a'])) == {60.0}
+    assert max(polls['a']) > 800
+    assert scheduler.stats()['in_flight'] == 0
@@ -0,0 +1,71 @@
+import json
+import sqlite3
+
+from tracker_poller import Response
+from tracker_store import SnapshotStore
+
+
+def page(products):
+    objects = [{'id': f't{i}', 'productInfo': [{'merchProduct': {'id': f'p{i}', 'styleColor': f'SC{i}'},
+                                                 'merchPrice': {'currentPrice': price},
+                                                 'availability': {'available': True}}]}
+               for i, price in products]
+    return Response('http://feed/page', 200, {}, json.dumps({'objects': objects}).encode(), 0.0)
+
+
+def test_first_poll_is_a_silent_baseline(tmp_path):
+    store = SnapshotStore(str(tmp_path / 's.db'))
+    assert store.diff_responses('nike', [page([(1, 100.0), (2, 100.0)])]) == []
+    assert store.baseline_records == 2
+    events = store.diff_responses('nike', [page([(1, 100.0), (2, 90.0), (3, 120.0)])])
+    assert sorted((e['key'], e['kind']) for e in events) == [('p2', 'price'), ('p3', 'new')]
+    store.close()
+    # The baseline is remembered across restarts
+    store = SnapshotStore(str(tmp_path / 's.db'))
+    assert store.diff_responses('nike', [page([(4, 100.0)])])[0]['kind'] == 'new'
+    store.close()
+
+
+def test_product_on_several_feeds_is_reported_on_each(tmp_path):
+    store = SnapshotStore(str(tmp_path / 's.db'))
+    for feed in ('nike', 'snkrs'):
+        store.diff_responses(feed, [page([(1, 100.0)])])
+    for feed in ('nike', 'snkrs'):
+        events = store.diff_responses(feed, [page([(1, 100.0), (2, 150.0)])])
+        assert [(e['feed'], e['key'], e['kind']) for e in events] == [(feed, 'p2', 'new')]
+    store.close()
+
+
+def test_store_keyed_on_product_alone_is_upgraded(tmp_path):
+    path = str(tmp_path / 'old.db')
+    db = sqlite3.connect(path)
+    db.executescript('''
+        CREATE TABLE products (key TEXT PRIMARY KEY, feed TEXT, hash INTEGER, sku TEXT, title TEXT, price REAL,
+                               available INTEGER, launch TEXT, first_seen REAL, last_changed REAL);
+        CREATE TABLE pages (url TEXT PRIMARY KEY, hash INTEGER);
+        INSERT INTO products VALUES ('p1', 'nike', 1, 'SC1', NULL, 100.0, 1, NULL, 0, 0);
+        INSERT INTO pages VALUES ('http://feed/page', 1);
+    ''')
+    db.commit()
+    db.close()
+    store = SnapshotStore(path)
+    assert store.db.execute('SELECT feed, key FROM products').fetchall() == [('nike', 'p1')]
+    assert store.page_hashes == {}
+    assert store.diff_responses('snkrs', [page([(1, 100.0)])]) == []
+    store.close()
+
+
+def test_baseline_waits_for_a_poll_with_every_page(tmp_path):
+    store = SnapshotStore(str(tmp_path / 's.db'))
+    first = page([(1, 100.0)])
+    second = page([(2, 100.0)])
+    second.url = 'http://feed/page2'
+    failed = Response(second.url, 0, {}, b'', 0.0)
+    assert store.diff_responses('nike', [first, failed]) == []
+    assert 'nike' not in store.baselined
+    # The page that failed loads now: its products are part of the baseline, not new
+    assert store.diff_responses('nike', [first, second]) == []
+    assert 'nike' in store.baselined
+    third = page([(3, 100.0)])
+    assert [e['key'] for e in store.diff_responses('nike', [third])] == ['p3']
+    store.close()
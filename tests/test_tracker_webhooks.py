@@ -0,0 +1,209 @@
+import asyncio
+
+from tracker_mock_server import MockHandler, MockServer
+from tracker_poller import HttpClient, Response
+from tracker_webhooks import Outbox, WebhookDispatcher
+
+HOOK = '/api/webhooks/1/test'
+
+
+def events(n, feed='nike'):
+    return [{'kind': 'new', 'feed': feed, 'key': f'prod-{i}', 'title': f'Shoe {i}', 'sku': f'SKU{i}',
+             'price': 100.0, 'available': True} for i in range(n)]
+
+
+def embeds_posted(server):
+    return sum(len(doc['embeds']) for _, doc in server.webhook_posts)
+
+
+def test_rate_limited_burst_is_delivered_after_429s(tmp_path):
+    with MockServer(webhook_limit=2, webhook_window=0.5) as server:
+        # No bucket headers on success, so the dispatcher only learns the limit from 429 + Retry-After
+        server.httpd.webhook_bucket_headers = False
+
+        async def go():
+            client = HttpClient()
+            dispatcher = WebhookDispatcher(client, {'nike': server.url + HOOK},
+                                           outbox=Outbox(str(tmp_path / 'outbox.db')), coalesce_window=0.05)
+            stop = asyncio.Event()
+            delivery = asyncio.ensure_future(dispatcher.run(stop))
+            await asyncio.sleep(0)
+            assert dispatcher.submit(events(45)) == 45
+            assert await dispatcher.drain(timeout=10)
+            stop.set()
+            await delivery
+            await client.close()
+            pending = dispatcher.outbox.pending()
+            dispatcher.outbox.close()
+            return dispatcher, pending
+
+        dispatcher, pending = asyncio.run(go())
+        assert embeds_posted(server) == 45
+        assert len(server.webhook_posts) == 5
+        assert server.httpd.webhook_429s >= 1
+        assert dispatcher.rate_limited == server.httpd.webhook_429s
+        assert pending == []
+
+
+def test_stop_inside_coalescing_window_keeps_events_in_outbox(tmp_path):
+    path = str(tmp_path / 'outbox.db')
+    with MockServer() as server:
+        routes = {'nike': server.url + HOOK}
+
+        async def first_run():
+            client = HttpClient()
+            dispatcher = WebhookDispatcher(client, routes, outbox=Outbox(path), coalesce_window=1.0)
+            stop = asyncio.Event()
+            delivery = asyncio.ensure_future(dispatcher.run(stop))
+            await asyncio.sleep(0)
+            dispatcher.submit(events(25))
+            await asyncio.sleep(0.2)
+            stop.set()
+            await delivery
+            await client.close()
+            dispatcher.outbox.close()
+
+        asyncio.run(first_run())
+        assert server.webhook_posts == []
+        outbox = Outbox(path)
+        assert sum(len(payload['embeds']) for _, _, payload in outbox.pending()) == 25
+        outbox.close()
+
+        async def second_run():
+            client = HttpClient()
+            dispatcher = WebhookDispatcher(client, routes, outbox=Outbox(path), coalesce_window=0.05)
+            stop = asyncio.Event()
+            delivery = asyncio.ensure_future(dispatcher.run(stop))
+            await asyncio.sleep(0.05)
+            assert await dispatcher.drain(timeout=10)
+            stop.set()
+            await delivery
+            await client.close()
+            pending = dispatcher.outbox.pending()
+            dispatcher.outbox.close()
+            return pending
+
+        assert asyncio.run(second_run()) == []
+        assert embeds_posted(server) == 25
+
+
+class FlakyClient:
+    """Answers 500 to the first `failures` posts, then 204."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.posts = []
+
+    async def post_json(self, url, data, headers=None):
+        self.posts.append(data)
+        status = 500 if len(self.posts) <= self.failures else 204
+        return Response(url, status, {}, b'', 0.0)
+
+
+def test_message_out_of_retries_is_requeued(tmp_path):
+    client = FlakyClient(failures=3)
+
+    async def go():
+        dispatcher = WebhookDispatcher(client, {'nike': 'http://hook'}, outbox=Outbox(str(tmp_path / 'o.db')),
+                                       coalesce_window=0.01, max_retries=1, base_backoff=0.01,
+                                       requeue_after=0.1)
+        stop = asyncio.Event()
+        delivery = asyncio.ensure_future(dispatcher.run(stop))
+        await asyncio.sleep(0)
+        dispatcher.submit(events(3))
+        for _ in range(100):
+            if dispatcher.sent_messages:
+                break
+            await asyncio.sleep(0.05)
+        stop.set()
+        await delivery
+        pending = dispatcher.outbox.pending()
+        dispatcher.outbox.close()
+        return dispatcher, pending
+
+    dispatcher, pending = asyncio.run(go())
+    assert dispatcher.requeued == 1
+    assert dispatcher.sent_messages == 1
+    assert len(client.posts) == 4
+    assert pending == []
+
+
+class TruncatingHandler(MockHandler):
+    """Drops the connection halfway through the response to the first `truncate` webhook posts."""
+
+    truncate = 2
+
+    def webhook(self, doc):
+        if TruncatingHandler.truncate > 0:
+            TruncatingHandler.truncate -= 1
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', '100')
+            self.end_headers()
+            self.wfile.write(b'{"id": ')
+            self.close_connection = True
+            return
+        super().webhook(doc)
+
+
+def test_connection_closed_mid_response_is_retried(tmp_path):
+    TruncatingHandler.truncate = 2
+    with MockServer(handler=TruncatingHandler) as server:
+
+        async def go():
+            client = HttpClient()
+            dispatcher = WebhookDispatcher(client, {'nike': server.url + HOOK},
+                                           outbox=Outbox(str(tmp_path / 'outbox.db')), coalesce_window=0.01,
+                                           base_backoff=0.01)
+            stop = asyncio.Event()
+            delivery = asyncio.ensure_future(dispatcher.run(stop))
+            await asyncio.sleep(0)
+            dispatcher.submit(events(3))
+            assert await dispatcher.drain(timeout=10)
+            stop.set()
+            await delivery
+            await client.close()
+            pending = dispatcher.outbox.pending()
+            dispatcher.outbox.close()
+            return dispatcher, pending
+
+        dispatcher, pending = asyncio.run(go())
+        assert dispatcher.failures == 2
+        assert dispatcher.sent_messages == 1
+        assert embeds_posted(server) == 3
+        assert pending == []
+
+
+class CrashingClient(FlakyClient):
+    """Raises something the dispatcher does not expect on the first post."""
+
+    async def post_json(self, url, data, headers=None):
+        if not self.posts:
+            self.posts.append(data)
+            raise RuntimeError('boom')
+        return await super().post_json(url, data, headers)
+
+
+def test_crashed_worker_is_restarted_by_the_next_submit(tmp_path):
+    client = CrashingClient(failures=0)
+
+    async def go():
+        dispatcher = WebhookDispatcher(client, {'nike': 'http://hook'}, outbox=Outbox(str(tmp_path / 'o.db')),
+                                       coalesce_window=0.01)
+        stop = asyncio.Event()
+        delivery = asyncio.ensure_future(dispatcher.run(stop))
+        await asyncio.sleep(0)
+        dispatcher.submit(events(3))
+        await asyncio.sleep(0.1)
+        assert dispatcher.tasks['http://hook'].done()
+        dispatcher.submit(events(2))
+        assert await dispatcher.drain(timeout=5)
+        stop.set()
+        await delivery
+        pending = dispatcher.outbox.pending()
+        dispatcher.outbox.close()
+        return dispatcher, pending
+
+    dispatcher, pending = asyncio.run(go())
+    assert dispatcher.sent_embeds == 5
+    assert pending == []
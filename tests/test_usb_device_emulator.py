@@ -0,0 +1,80 @@
+import errno
+
+import pytest
+
+from usb_device_emulator import MiB, PART_OFFSET, Emulator, make_disks
+
+SCRIPT = ['select disk {}', 'attributes disk clear readonly', 'clean', 'create partition primary',
+          'format fs=ntfs quick', 'assign']
+
+
+def disks(tmp_path, **kinds):
+    found = make_disks(str(tmp_path), 4, 8 * MiB, time_scale=1000.0, **kinds)
+    return {d.index: d for d in found}
+
+
+def diskpart(emulator, index):
+    return emulator.run_diskpart_script([line.format(index) for line in SCRIPT])
+
+
+def test_read_only_can_be_cleared_but_write_protect_cannot(tmp_path):
+    d = disks(tmp_path, read_only=1, locked=1)
+    read_only, locked = d[4], d[3]
+    for disk in (read_only, locked):
+        with pytest.raises(OSError) as e:
+            disk.write(PART_OFFSET, bytes(512))
+        assert e.value.errno == errno.EROFS
+        assert disk.bytes_written == 0 and disk.io_errors == 1
+
+    emulator = Emulator(d.values())
+    code, out = diskpart(emulator, 4)
+    assert code == 0 and read_only.writable
+    assert read_only.fs == 'NTFS' and read_only.filesystem() == 'NTFS'
+
+    code, out = diskpart(emulator, 3)
+    assert code == 1
+    assert out.strip().endswith('DiskPart failed to clear disk attributes.')
+    assert not locked.writable and locked.filesystem() == 'FAT32'
+    for disk in d.values():
+        disk.close()
+
+
+def test_injected_errors_and_bad_sectors_raise_eio(tmp_path):
+    d = disks(tmp_path)
+    d[1].error_rate = 1.0
+    d[2].bad_ranges = [(PART_OFFSET, 512)]
+    for disk in (d[1], d[2]):
+        with pytest.raises(OSError) as e:
+            disk.read(PART_OFFSET, 512)
+        assert e.value.errno == errno.EIO
+        assert disk.bytes_read == 0 and disk.io_errors == 1
+    # Outside the bad range the disk still works
+    assert len(d[2].read(0, 512)) == 512
+    for disk in d.values():
+        disk.close()
+
+
+def test_diskpart_stops_at_the_first_error(tmp_path):
+    d = disks(tmp_path)
+    disk = d[1]
+    disk.bad_ranges = [(PART_OFFSET, 512)]
+    emulator = Emulator(d.values())
+    code, out = diskpart(emulator, 1)
+
+    assert code == 1
+    assert out.strip().splitlines()[-1] == ('DiskPart has encountered an error: '
+                                            'The request could not be performed because of an I/O device error.')
+    # clean and create partition ran; format hit the bad sector and assign never did
+    assert 'DiskPart succeeded in creating the specified partition.' in out
+    assert disk.partitioned and disk.fs == '' and disk.letter is None
+
+    # A stick that drops off mid-script fails the command in flight, then can't be selected again
+    disk.disconnect_after = 0
+    code, out = emulator.run_diskpart_script(['select disk 1', 'clean', 'create partition primary'])
+    assert code == 1
+    assert out.strip().splitlines()[-1] == 'DiskPart has encountered an error: The device is not ready.'
+    code, out = emulator.run_diskpart_script(['select disk 1', 'clean'])
+    assert code == 1 and out.strip() == 'The disk you specified is not valid.'
+    assert disk.io_errors == 2
+    for disk in d.values():
+        disk.close()
@@ -0,0 +1,343 @@
+"""
+tracker_feed_parser.py
+
+Streaming, projection-based parsing of the Nike feed pages jordan_tracker.py
+polls. A FeedStream is fed the response body chunk by chunk as it arrives and
+hands back each product of the page's `objects` array as soon as that product
+is complete, already cut down to the few fields the tracker uses. The page is
+never held as one string or one object tree; at most one product is.
+
+With ijson installed its C backend does the tokenising; otherwise the stdlib
+json scanner decodes one product at a time with raw_decode while a small
+scanner walks the envelope around the array.
+
+Usage:
+    python tracker_feed_parser.py                  # synthetic pages
+    python tracker_feed_parser.py page1.json ...   # recorded fixtures
+"""
+import argparse
+import codecs
+import hashlib
+import json
+import re
+import time
+import tracemalloc
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Where the product array and the paging block sit in each feed flavour
+OBJECT_PATHS = (('objects',), ('data', 'products', 'objects'))
+CAPTURE_PATHS = {('pages',): 'pages', ('data', 'products', 'pages'): 'pages'}
+
+_OUTER = re.compile(r'[\[\]{},:"]')
+_STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.S)
+_SPACE = re.compile(r'[ \t\r\n]*')
+
+
+class _StdlibBackend:
+    """Envelope scanner plus json raw_decode for each wanted value."""
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.text = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.stack = []         # key of each open container (None for the root and array items)
+        self.kinds = []         # '{' or '[' for each open container
+        self.expect_key = False
+        self.key = None         # key whose value comes next
+        self.in_objects = False
+
+    def feed(self, chunk, final=False):
+        self.buf = self.buf[self.pos:] + self.text.decode(chunk, final)
+        self.pos = 0
+        items, captured = [], {}
+        while self._step(items, captured, final):
+            pass
+        return items, captured
+
+    def _decode_value(self, final):
+        """Decode the value at pos, or None if more data is needed."""
+        try:
+            value, end = self.decoder.raw_decode(self.buf, self.pos)
+        except json.JSONDecodeError as e:
+            # Mid-stream the error is almost always the value running off the end
+            # of the buffer (and not necessarily reported there), so wait for more
+            if not final:
+                return None
+            raise ValueError(f'bad feed JSON at offset {e.pos}: {e.msg}')
+        if not final and end == len(self.buf) and isinstance(value, (int, float)):
+            # A number touching the end of the buffer may have more digits coming
+            return None
+        self.pos = end
+        return (value,)
+
+    def _step(self, items, captured, final):
+        buf = self.buf
+        if self.in_objects:
+            self.pos = _SPACE.match(buf, self.pos).end()
+            if self.pos >= len(buf):
+                return False
+            c = buf[self.pos]
+            if c == ',':
+                self.pos += 1
+                return True
+            if c == ']':
+                self.in_objects = False
+                self.pos += 1
+                self._end_value()
+                return True
+            decoded = self._decode_value(final)
+            if decoded is None:
+                return False
+            items.append(decoded[0])
+            return True
+
+        m = _OUTER.search(buf, self.pos)
+        if m is None:
+            self.pos = len(buf)
+            return False
+        c = m.group()
+        i = m.start()
+        if c == '"':
+            s = _STRING.match(buf, i)
+            if s is None:
+                self.pos = i
+                return False
+            self.pos = s.end()
+            if self.expect_key:
+                self.key = json.loads(s.group())
+                self.expect_key = False
+            else:
+                self._end_value()
+            return True
+        if c == ':':
+            self.pos = _SPACE.match(buf, i + 1).end()
+            if self.pos >= len(buf):
+                # Need to see how the value starts; resume from the colon
+                self.pos = i
+                return False
+            path = tuple(self.stack[1:]) + (self.key,)
+            if path in CAPTURE_PATHS:
+                decoded = self._decode_value(final)
+                if decoded is None:
+                    self.pos = i
+                    return False
+                captured[CAPTURE_PATHS[path]] = decoded[0]
+                self._end_value()
+            elif path in OBJECT_PATHS and buf[self.pos] == '[':
+                self.in_objects = True
+                self.pos += 1
+            return True
+        self.pos = i + 1
+        if c in '{[':
+            self.stack.append(self.key if self.kinds and self.kinds[-1] == '{' else None)
+            self.kinds.append(c)
+            self.expect_key = c == '{'
+            self.key = None
+        elif c in '}]':
+            if self.kinds:
+                self.kinds.pop()
+                self.stack.pop()
+            self._end_value()
+        elif c == ',':
+            self.expect_key = bool(self.kinds) and self.kinds[-1] == '{'
+        return True
+
+    def _end_value(self):
+        self.key = None
+        self.expect_key = False
+
+
+class _IjsonBackend:
+    """Same contract as _StdlibBackend on top of ijson's event stream."""
+
+    ITEMS = {'.'.join(p) + '.item' for p in OBJECT_PATHS}
+    CAPTURES = {'.'.join(p): name for p, name in CAPTURE_PATHS.items()}
+
+    def __init__(self):
+        self.events = ijson.sendable_list()
+        self.coro = ijson.parse_coro(self.events, use_float=True)
+        self.builder = None
+        self.building = None
+
+    def feed(self, chunk, final=False):
+        if chunk:
+            self.coro.send(chunk)
+        if final:
+            self.coro.close()
+        items, captured = [], {}
+        for prefix, event, value in self.events:
+            if self.builder is not None:
+                self.builder.event(event, value)
+                if prefix == self.building[0] and event in ('end_map', 'end_array'):
+                    self._finish(items, captured)
+                continue
+            target = prefix in self.ITEMS or prefix in self.CAPTURES
+            if not target:
+                continue
+            if event in ('start_map', 'start_array'):
+                self.builder = ijson.ObjectBuilder()
+                self.builder.event(event, value)
+                self.building = (prefix,)
+            elif event not in ('map_key', 'end_map', 'end_array'):
+                self.builder = ijson.ObjectBuilder()
+                self.builder.event(event, value)
+                self.building = (prefix,)
+                self._finish(items, captured)
+        del self.events[:]
+        return items, captured
+
+    def _finish(self, items, captured):
+        prefix = self.building[0]
+        if prefix in self.ITEMS:
+            items.append(self.builder.value)
+        else:
+            captured[self.CAPTURES[prefix]] = self.builder.value
+        self.builder = None
+        self.building = None
+
+
+class FeedStream:
+    """Incremental parser for one feed page.
+
+    feed() takes raw response bytes as they arrive and returns the projected
+    products completed so far; close() flushes the rest. `meta` collects the
+    page's `pages` block for pagination and `digest` is a 64-bit hash of the
+    raw bytes, so a page can be recognised as unchanged without keeping it.
+    """
+
+    def __init__(self, project=None, backend=None):
+        self.project = project
+        if backend is None:
+            backend = 'ijson' if ijson is not None else 'stdlib'
+        self.backend_name = backend
+        self.backend = _IjsonBackend() if backend == 'ijson' else _StdlibBackend()
+        self.hasher = hashlib.blake2b(digest_size=8)
+        self.meta = {}
+        self.records = []
+        self.nbytes = 0
+        self.parse_seconds = 0.0
+        self.closed = False
+
+    def _take(self, items, captured):
+        self.meta.update(captured)
+        project = self.project
+        out = [project(o) for o in items] if project else items
+        self.records.extend(out)
+        return out
+
+    def feed(self, chunk):
+        t0 = time.perf_counter()
+        self.hasher.update(chunk)
+        self.nbytes += len(chunk)
+        out = self._take(*self.backend.feed(chunk))
+        self.parse_seconds += time.perf_counter() - t0
+        return out
+
+    def close(self):
+        if self.closed:
+            return []
+        self.closed = True
+        t0 = time.perf_counter()
+        out = self._take(*self.backend.feed(b'', final=True))
+        self.parse_seconds += time.perf_counter() - t0
+        return out
+
+    @property
+    def digest(self):
+        return int.from_bytes(self.hasher.digest(), 'big', signed=True)
+
+
+def parse_page(body, project=None, chunk_size=65536, backend=None):
+    """Run a whole body through a FeedStream in chunk_size pieces."""
+    stream = FeedStream(project, backend)
+    view = memoryview(body)
+    for i in range(0, len(body), chunk_size):
+        stream.feed(bytes(view[i:i + chunk_size]))
+    stream.close()
+    return stream
+
+
+def measure(fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def bench(bodies, chunk_size=16384, repeats=5):
+    """Per-page parse time and peak traced memory of each parser."""
+    from tracker_store import feed_objects, product_record
+
+    parsers = {'json.loads': lambda b: [product_record(o) for o in feed_objects(json.loads(b))]}
+    if orjson is not None:
+        parsers['orjson.loads'] = lambda b: [product_record(o) for o in feed_objects(orjson.loads(b))]
+    parsers['stream/stdlib'] = lambda b: parse_page(b, product_record, chunk_size, 'stdlib').records
+    if ijson is not None:
+        parsers['stream/ijson'] = lambda b: parse_page(b, product_record, chunk_size, 'ijson').records
+
+    total = sum(len(b) for b in bodies)
+    print(f'{len(bodies)} pages, {total / len(bodies) / 1024:.0f} KiB/page, {chunk_size} B chunks')
+    # Every parser must give the records the first one did, page for page
+    expected = [None] * len(bodies)
+    for name, fn in parsers.items():
+        times, peaks = [], []
+        count = 0
+        for i, body in enumerate(bodies):
+            best = None
+            for _ in range(repeats):
+                records, elapsed, peak = measure(lambda: fn(body))
+                best = elapsed if best is None else min(best, elapsed)
+            if expected[i] is None:
+                expected[i] = records
+            elif records != expected[i]:
+                raise AssertionError(f'{name} disagrees with {next(iter(parsers))} on page {i}')
+            times.append(best)
+            peaks.append(peak)
+            count += len(records)
+        print(f'{name:>14}: {sum(times) / len(times) * 1000:7.2f} ms/page  '
+              f'peak {max(peaks) / 1024:8.1f} KiB  ({count} products)')
+
+
+def synthetic_bodies(pages=5, per_page=50):
+    from tracker_mock_server import Catalog, MockHandler
+    catalog = Catalog(pages * per_page)
+    bodies = []
+    for p in range(pages):
+        doc = MockHandler.threads_page({'anchor': p * per_page, 'count': per_page}, catalog)
+        bodies.append(json.dumps(doc).encode())
+    return bodies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark streaming feed parsing against json.loads')
+    parser.add_argument('fixtures', nargs='*', help='recorded feed pages (JSON files)')
+    parser.add_argument('--pages', type=int, default=5, help='synthetic pages when no fixtures are given')
+    parser.add_argument('--per-page', type=int, default=50)
+    parser.add_argument('--chunk-size', type=int, default=16384)
+    args = parser.parse_args()
+    if args.fixtures:
+        bodies = []
+        for path in args.fixtures:
+            with open(path, 'rb') as f:
+                bodies.append(f.read())
+    else:
+        bodies = synthetic_bodies(args.pages, args.per_page)
+    bench(bodies, args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
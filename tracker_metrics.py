@@ -0,0 +1,412 @@
+"""
+tracker_metrics.py
+
+Latency and freshness instrumentation for jordan_tracker.py.
+
+Per target: poll duration, bytes transferred, shared-cache hits and 304s,
+parse time, diff time and when it was last polled. Per event: detection lag
+(when the tracker first saw a new product vs the feed's publishStartDate)
+and webhook delivery latency (detection to Discord accepting the message).
+
+Exposed as Prometheus text (/metrics) and JSON (/metrics.json) from a small
+HTTP endpoint, or written to a file. In --shards mode each worker keeps its
+own TrackerMetrics and sends snapshot()s to the parent, which merge()s them.
+
+Usage:
+    python jordan_tracker.py --metrics-port 9108
+    python tracker_metrics.py --bench                  # synthetic feed timeline
+    python tracker_metrics.py --bench timeline.json    # scripted timeline
+"""
+import argparse
+import asyncio
+import bisect
+import calendar
+import copy
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tracker_mock_server import Catalog, MockServer
+from tracker_poller import HttpClient, Poller
+from tracker_registry import DIFF_PARSERS, Registry, TargetScheduler
+from tracker_store import SnapshotStore
+from tracker_webhooks import Outbox, WebhookDispatcher
+
+
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+
+def parse_iso(stamp):
+    """Epoch seconds of a feed timestamp like 2024-01-01T09:00:00.000Z, or None."""
+    if not stamp:
+        return None
+    try:
+        base, _, frac = stamp.rstrip('Z').partition('.')
+        ts = calendar.timegm(time.strptime(base, '%Y-%m-%dT%H:%M:%S'))
+    except (ValueError, AttributeError):
+        return None
+    return ts + (float('0.' + frac) if frac.isdigit() else 0.0)
+
+
+class Histogram:
+    """Prometheus-style cumulative buckets plus recent samples for JSON quantiles."""
+
+    def __init__(self, buckets, keep=1024):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=keep)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def quantile(self, q):
+        if not self.recent:
+            return None
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'max': max(self.recent) if self.recent else None,
+        }
+
+    def prometheus(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{_labels(labels, le=le)} {cumulative}')
+        lines.append(f'{name}_sum{_labels(labels)} {self.sum:.6f}')
+        lines.append(f'{name}_count{_labels(labels)} {self.count}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    items = dict(labels, **extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items.items()) + '}'
+
+
+class TargetStats:
+    def __init__(self):
+        self.polls = 0
+        self.responses = 0
+        self.cache_hits = 0
+        self.not_modified = 0
+        self.bytes = 0
+        self.last_poll = None
+        self.poll_seconds = Histogram(FAST_BUCKETS)
+        self.parse_seconds = Histogram(FAST_BUCKETS)
+        self.diff_seconds = Histogram(FAST_BUCKETS)
+
+
+class TrackerMetrics:
+    """Collects tracker timings; hook it up with attach() and use diff() for the store.
+
+    A feed's baseline poll (see SnapshotStore) is not counted as detection
+    lag; the store remembers baselines across restarts, so after one the
+    first poll's new products are measured like any other.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.targets = {}
+        self.events = {}        # (feed, kind) -> count
+        self.detection_lag = {}   # feed -> Histogram
+        self.delivery_latency = {}
+        self.started = clock()
+
+    def _target(self, name):
+        stats = self.targets.get(name)
+        if stats is None:
+            stats = self.targets[name] = TargetStats()
+        return stats
+
+    def attach(self, poller=None, dispatcher=None):
+        if poller is not None:
+            poller.on_poll = self.polled
+        if dispatcher is not None:
+            dispatcher.on_delivered = self.delivered
+
+    def polled(self, target, responses, seconds):
+        with self.lock:
+            stats = self._target(target.name)
+            stats.polls += 1
+            stats.last_poll = self.clock()
+            stats.poll_seconds.observe(seconds)
+            for resp in responses:
+                stats.responses += 1
+                stats.bytes += resp.size
+                stats.cache_hits += resp.cached
+                stats.not_modified += resp.not_modified
+
+    def diff(self, target, responses, store):
+        """store.diff_responses, timed into parse and diff seconds; returns the events."""
+        parse0, diff0 = store.parse_seconds, store.diff_seconds
+        baseline = target.name not in store.baselined
+        events = store.diff_responses(target.name, responses)
+        streamed = sum(r.stream.parse_seconds for r in responses if r.stream is not None and r.status == 200)
+        with self.lock:
+            stats = self._target(target.name)
+            stats.parse_seconds.observe(store.parse_seconds - parse0 + streamed)
+            stats.diff_seconds.observe(store.diff_seconds - diff0)
+            for event in events:
+                key = (event['feed'], event['kind'])
+                self.events[key] = self.events.get(key, 0) + 1
+                published = parse_iso(event.get('published'))
+                if event['kind'] == 'new' and published is not None and not baseline:
+                    lag = max(0.0, event['detected_at'] - published)
+                    self.detection_lag.setdefault(event['feed'], Histogram(LAG_BUCKETS)).observe(lag)
+        return events
+
+    def delivered(self, url, events):
+        now = self.clock()
+        with self.lock:
+            for event in events:
+                if event.get('detected_at'):
+                    self.delivery_latency.setdefault(event['feed'], Histogram(LAG_BUCKETS)).observe(
+                        max(0.0, now - event['detected_at']))
+
+    def snapshot(self):
+        """Copy of the per-target and per-feed state, for a shard worker to send to the parent."""
+        with self.lock:
+            return copy.deepcopy({'targets': self.targets, 'events': self.events,
+                                  'detection_lag': self.detection_lag})
+
+    def merge(self, snapshot):
+        """Take in a worker's snapshot(); its targets and feeds are its own, so they replace ours."""
+        with self.lock:
+            self.targets.update(snapshot['targets'])
+            self.events.update(snapshot['events'])
+            self.detection_lag.update(snapshot['detection_lag'])
+
+    def to_json(self):
+        now = self.clock()
+        with self.lock:
+            targets = {}
+            for name, s in sorted(self.targets.items()):
+                targets[name] = {
+                    'polls': s.polls,
+                    'responses': s.responses,
+                    'bytes': s.bytes,
+                    'cache_hit_rate': s.cache_hits / s.responses if s.responses else None,
+                    'not_modified_rate': s.not_modified / s.responses if s.responses else None,
+                    'age': now - s.last_poll if s.last_poll is not None else None,
+                    'poll_seconds': s.poll_seconds.summary(),
+                    'parse_seconds': s.parse_seconds.summary(),
+                    'diff_seconds': s.diff_seconds.summary(),
+                }
+            return {
+                'uptime': now - self.started,
+                'targets': targets,
+                'events': {f'{feed}/{kind}': n for (feed, kind), n in sorted(self.events.items())},
+                'detection_lag': {f: h.summary() for f, h in sorted(self.detection_lag.items())},
+                'delivery_latency': {f: h.summary() for f, h in sorted(self.delivery_latency.items())},
+            }
+
+    def to_prometheus(self):
+        now = self.clock()
+        out = []
+
+        def family(name, kind, help_text):
+            out.append(f'# HELP {name} {help_text}')
+            out.append(f'# TYPE {name} {kind}')
+
+        with self.lock:
+            targets = sorted(self.targets.items())
+            family('tracker_polls_total', 'counter', 'Completed polls per target.')
+            out += [f'tracker_polls_total{_labels({"target": n})} {s.polls}' for n, s in targets]
+            family('tracker_responses_total', 'counter', 'Responses per target by where they came from.')
+            for n, s in targets:
+                network = s.responses - s.cache_hits - s.not_modified
+                for source, count in (('network', network), ('not_modified', s.not_modified),
+                                      ('cache', s.cache_hits)):
+                    out.append(f'tracker_responses_total{_labels({"target": n, "source": source})} {count}')
+            family('tracker_bytes_total', 'counter', 'Response body bytes per target.')
+            out += [f'tracker_bytes_total{_labels({"target": n})} {s.bytes}' for n, s in targets]
+            family('tracker_poll_age_seconds', 'gauge', 'Seconds since the target was last polled.')
+            out += [f'tracker_poll_age_seconds{_labels({"target": n})} {now - s.last_poll:.3f}'
+                    for n, s in targets if s.last_poll is not None]
+            for attr, help_text in (('poll_seconds', 'Wall time of a poll, all pages included.'),
+                                    ('parse_seconds', 'Time parsing changed pages into records.'),
+                                    ('diff_seconds', 'Time diffing records against the snapshot store.')):
+                family(f'tracker_{attr}', 'histogram', help_text)
+                for n, s in targets:
+                    out += getattr(s, attr).prometheus(f'tracker_{attr}', {'target': n})
+            family('tracker_events_total', 'counter', 'Change events per feed and kind.')
+            out += [f'tracker_events_total{_labels({"feed": f, "kind": k})} {n}'
+                    for (f, k), n in sorted(self.events.items())]
+            family('tracker_detection_lag_seconds', 'histogram', 'First seen minus the feed publish time.')
+            for feed, h in sorted(self.detection_lag.items()):
+                out += h.prometheus('tracker_detection_lag_seconds', {'feed': feed})
+            family('tracker_delivery_latency_seconds', 'histogram', 'Detection to webhook delivery.')
+            for feed, h in sorted(self.delivery_latency.items()):
+                out += h.prometheus('tracker_delivery_latency_seconds', {'feed': feed})
+        return '\n'.join(out) + '\n'
+
+    def write(self, path):
+        """Write JSON (.json) or Prometheus text (anything else) atomically."""
+        text = json.dumps(self.to_json(), indent=2) if path.endswith('.json') else self.to_prometheus()
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(path + '.tmp', path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        metrics = self.server.metrics
+        if self.path.split('?')[0] == '/metrics.json':
+            body, ctype = json.dumps(metrics.to_json(), indent=2).encode(), 'application/json'
+        elif self.path.split('?')[0] == '/metrics':
+            body, ctype = metrics.to_prometheus().encode(), 'text/plain; version=0.0.4'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(metrics, port, host='127.0.0.1'):
+    """Serve /metrics and /metrics.json from a daemon thread; returns the server."""
+    httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+    httpd.daemon_threads = True
+    httpd.metrics = metrics
+    threading.Thread(target=httpd.serve_forever, name='metrics', daemon=True).start()
+    return httpd
+
+
+def synthetic_timeline(duration=30.0, seed=9):
+    """Drops every few seconds plus restocks, sell-outs and price changes of existing products."""
+    rng = random.Random(seed)
+    steps = []
+    t = 2.0
+    while t < duration - 5:
+        steps.append({'at': round(t, 2), 'add': rng.randint(1, 3)})
+        index = rng.randrange(100)
+        steps.append({'at': round(t + 1.0, 2), 'update': index, 'available': rng.random() < 0.5})
+        if rng.random() < 0.3:
+            steps.append({'at': round(t + 1.5, 2), 'update': rng.randrange(100), 'price': 79.99})
+        t += rng.uniform(2.0, 4.0)
+    return {'duration': duration, 'poll_interval': 2.0, 'products': 200, 'steps': steps}
+
+
+async def play(catalog, steps, t0):
+    """Apply timeline steps to the mock catalog at their offsets from t0."""
+    for step in sorted(steps, key=lambda s: s['at']):
+        await asyncio.sleep(max(0.0, t0 + step['at'] - time.time()))
+        if 'add' in step:
+            catalog.add(step['add'], published=time.time())
+        else:
+            catalog.update(step['update'], step.get('price'), step.get('available'))
+
+
+async def bench(timeline, out=None):
+    """Run the poll -> diff -> webhook pipeline against the mock server while the timeline plays."""
+    catalog = Catalog(timeline.get('products', 200))
+    with MockServer(catalog=catalog) as server, tempfile.TemporaryDirectory() as tmp:
+        config = os.path.join(tmp, 'targets.json')
+        with open(config, 'w', encoding='utf-8') as f:
+            json.dump({'webhooks': {'alerts': server.url + '/api/webhooks/1/bench'}, 'targets': [
+                {'name': 'snkrs', 'url': server.url + '/product_feed/threads/v3/?anchor=0&count=50',
+                 'interval': timeline.get('poll_interval', 2.0), 'parser': 'feed', 'paginate': True,
+                 'webhook': 'alerts'},
+            ]}, f)
+        registry = Registry(config)
+        store = SnapshotStore(os.path.join(tmp, 'snapshot.db'))
+        client = HttpClient()
+        dispatcher = WebhookDispatcher(client, registry.routes, outbox=Outbox(os.path.join(tmp, 'outbox.db')))
+        metrics = TrackerMetrics()
+
+        live = False
+
+        def on_result(target, responses):
+            if target.parser not in DIFF_PARSERS:
+                return
+            if live:
+                dispatcher.submit(metrics.diff(target, responses, store))
+            else:
+                store.diff_responses(target.name, responses)
+
+        poller = Poller(registry.targets.values(), client, on_result)
+        # Baseline: load the catalog as it stands without alerting or measuring it
+        await poller.poll_all()
+        metrics.attach(poller, dispatcher)
+        live = True
+        delivering = asyncio.Event()
+        delivery = asyncio.ensure_future(dispatcher.run(delivering))
+
+        polling = asyncio.Event()
+        scheduler = asyncio.ensure_future(TargetScheduler(registry, poller.poll_once).run(polling))
+        t0 = time.time()
+        await play(catalog, timeline.get('steps', []), t0)
+        await asyncio.sleep(max(0.0, t0 + timeline.get('duration', 30.0) - time.time()))
+        polling.set()
+        await scheduler
+        await dispatcher.drain(timeout=30)
+        delivering.set()
+        await delivery
+        await client.close()
+        dispatcher.outbox.close()
+        store.close()
+
+    report = metrics.to_json()
+    print(json.dumps({'events': report['events'], 'detection_lag': report['detection_lag'],
+                      'delivery_latency': report['delivery_latency'],
+                      'targets': {n: {k: t[k] for k in ('polls', 'bytes', 'not_modified_rate', 'poll_seconds',
+                                                        'parse_seconds', 'diff_seconds')}
+                                  for n, t in report['targets'].items()}}, indent=2))
+    if out:
+        for path in out:
+            metrics.write(path)
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a feed timeline through the tracker and report latency')
+    parser.add_argument('--bench', nargs='?', const='', metavar='TIMELINE',
+                        help='timeline JSON ({"duration", "poll_interval", "products", "steps": [...]}); '
+                             'synthetic if omitted')
+    parser.add_argument('--duration', type=float, default=30.0, help='length of the synthetic timeline')
+    parser.add_argument('--out', nargs='+', help='also write the metrics here (.json or Prometheus text)')
+    args = parser.parse_args()
+    if args.bench is None:
+        parser.print_help()
+        return
+    if args.bench:
+        with open(args.bench, encoding='utf-8') as f:
+            timeline = json.load(f)
+    else:
+        timeline = synthetic_timeline(args.duration)
+    asyncio.run(bench(timeline, args.out))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+"""
+tracker_mock_server.py
+
+Local stand-in for the Nike / GOAT endpoints jordan_tracker.py polls, so the
+fetch engine can be exercised without touching the real APIs. Serves canned,
+deterministic feed JSON with the same envelopes and anchor/count paging as
+the real feeds, and answers conditional requests with 304. POSTs to
+/api/webhooks/... behave like a Discord webhook with a small rate-limit
+bucket that answers 429.
+
+Usage:
+    python tracker_mock_server.py --port 8765 --products 500
+    python jordan_tracker.py --base http://127.0.0.1:8765
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit, urlunsplit
+
+
+def iso_time(ts):
+    """Epoch seconds as the feeds' ISO-8601 timestamps (millisecond precision, UTC)."""
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(ts)) + f'.{int(ts % 1 * 1000):03d}Z'
+
+
+def make_product(i, rng, published='2024-01-01T09:00:00.000Z'):
+    style = f'{rng.choice("ABCDFJ")}{rng.choice("BJQVZ")}{rng.randint(1000, 9999)}-{rng.randint(0, 999):03d}'
+    price = round(rng.choice([89.99, 99.99, 109.99, 119.99, 149.99, 179.99]), 2)
+    title = f"{rng.choice(['Air Jordan 1', 'Air Force 1', 'Dunk Low', 'Air Max 90', 'Air Jordan 4'])} #{i}"
+    return {
+        'id': f'thread-{i:07d}',
+        'publishedContent': {'properties': {'title': title, 'publishStartDate': published}},
+        'productInfo': [{
+            'merchProduct': {'id': f'prod-{i:07d}', 'styleColor': style, 'status': 'ACTIVE',
+                             'commerceStartDate': '2024-01-01T09:00:00.000Z'},
+            'merchPrice': {'currentPrice': price, 'fullPrice': price, 'currency': 'GBP', 'discounted': False},
+            'availability': {'available': rng.random() > 0.2},
+            'productContent': {'title': title, 'colorDescription': 'White/Black',
+                               'description': 'Lorem ipsum ' * 20},
+            'skus': [{'id': f'sku-{i:07d}-{s}', 'nikeSize': str(6 + s / 2)} for s in range(12)],
+        }],
+    }
+
+
+class Catalog:
+    """Mutable set of products the server publishes, in feed order."""
+
+    def __init__(self, count=200, seed=7):
+        self.rng = random.Random(seed)
+        self.products = [make_product(i, self.rng) for i in range(count)]
+        self.lock = threading.Lock()
+        self.version = 0
+
+    def page(self, anchor, count):
+        with self.lock:
+            return self.products[anchor:anchor + count], len(self.products)
+
+    def add(self, n=1, published=None):
+        """Publish n products at the front of the feed (newest first, as the real feeds list them).
+
+        published (epoch seconds) stamps their publishStartDate.
+        """
+        stamp = iso_time(published) if published is not None else '2024-01-01T09:00:00.000Z'
+        with self.lock:
+            start = len(self.products)
+            self.products[:0] = [make_product(start + i, self.rng, stamp) for i in reversed(range(n))]
+            self.version += 1
+
+    def update(self, index, price=None, available=None):
+        with self.lock:
+            info = self.products[index]['productInfo'][0]
+            if price is not None:
+                info['merchPrice']['currentPrice'] = price
+            if available is not None:
+                info['availability']['available'] = available
+            self.version += 1
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'TrackerMock/1.0'
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def send_json(self, doc, status=200):
+        body = json.dumps(doc, separators=(',', ':')).encode()
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with self.server.hits_lock:
+            self.server.hits += 1
+        if self.server.latency:
+            # Stand-in for a remote server's response time
+            time.sleep(self.server.latency)
+        parts = urlsplit(self.path)
+        query = dict(parse_qsl(parts.query))
+        catalog = self.server.catalog
+        if parts.path.startswith('/product_feed/threads/v3'):
+            self.send_json(self.threads_page(query, catalog))
+        elif parts.path.startswith('/cic/browse/v2'):
+            inner = dict(parse_qsl(urlsplit(query.get('endpoint', '')).query))
+            self.send_json({'data': {'products': self.threads_page(inner, catalog)}})
+        elif parts.path.startswith('/web-api/v1/product_templates'):
+            items, _ = catalog.page(0, 50)
+            self.send_json({'productTemplates': [
+                {'id': p['id'], 'sku': p['productInfo'][0]['merchProduct']['styleColor'],
+                 'name': p['publishedContent']['properties']['title'],
+                 'retailPriceCents': int(p['productInfo'][0]['merchPrice']['currentPrice'] * 100)}
+                for p in items]})
+        elif parts.path.startswith('/v1/sneakers'):
+            items, total = catalog.page(0, int(query.get('limit', 100)))
+            self.send_json({'count': total, 'results': [
+                {'id': p['id'], 'sku': p['productInfo'][0]['merchProduct']['styleColor'],
+                 'name': p['publishedContent']['properties']['title']} for p in items]})
+        else:
+            body = b'<html><body>mock product page</body></html>'
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def do_POST(self):
+        with self.server.hits_lock:
+            self.server.hits += 1
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        try:
+            doc = json.loads(body or b'{}')
+        except ValueError:
+            doc = {}
+        if urlsplit(self.path).path.startswith('/api/webhooks/'):
+            self.webhook(doc)
+        else:
+            self.send_json({'results': [], 'echo': doc})
+
+    def webhook(self, doc):
+        """Discord-style webhook: a bucket of `webhook_limit` posts per `webhook_window` seconds."""
+        server = self.server
+        path = urlsplit(self.path).path
+        now = time.monotonic()
+        with server.webhook_lock:
+            sent = server.webhook_buckets.setdefault(path, deque())
+            while sent and now - sent[0] >= server.webhook_window:
+                sent.popleft()
+            if len(sent) >= server.webhook_limit:
+                retry_after = server.webhook_window - (now - sent[0])
+                server.webhook_429s += 1
+                limited = True
+            else:
+                sent.append(now)
+                server.webhook_posts.append((path, doc))
+                remaining = server.webhook_limit - len(sent)
+                reset_after = server.webhook_window - (now - sent[0])
+                limited = False
+        if limited:
+            body = json.dumps({'message': 'You are being rate limited.', 'retry_after': round(retry_after, 3),
+                               'global': False}).encode()
+            self.send_response(429)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Retry-After', str(max(1, int(retry_after + 0.999))))
+            self.send_header('X-RateLimit-Limit', str(server.webhook_limit))
+            self.send_header('X-RateLimit-Remaining', '0')
+            self.send_header('X-RateLimit-Reset-After', f'{retry_after:.3f}')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_response(204)
+        if server.webhook_bucket_headers:
+            self.send_header('X-RateLimit-Limit', str(server.webhook_limit))
+            self.send_header('X-RateLimit-Remaining', str(remaining))
+            self.send_header('X-RateLimit-Reset-After', f'{reset_after:.3f}')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    @staticmethod
+    def threads_page(query, catalog):
+        anchor = int(query.get('anchor', 0))
+        count = int(query.get('count', 50))
+        items, total = catalog.page(anchor, count)
+        nxt = f'/product_feed/threads/v3/?anchor={anchor + count}&count={count}' if anchor + count < total else ''
+        return {
+            'pages': {'prev': '', 'next': nxt, 'totalPages': -(-total // count), 'totalResources': total},
+            'objects': items,
+        }
+
+
+class MockServer:
+    """Threaded mock server; use as a context manager or start()/stop()."""
+
+    def __init__(self, port=0, catalog=None, verbose=False, handler=MockHandler, webhook_limit=5,
+                 webhook_window=2.0, latency=0.0):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.httpd.daemon_threads = True
+        self.httpd.catalog = catalog or Catalog()
+        self.httpd.verbose = verbose
+        self.httpd.hits = 0
+        self.httpd.hits_lock = threading.Lock()
+        self.httpd.latency = latency
+        self.httpd.webhook_limit = webhook_limit
+        self.httpd.webhook_window = webhook_window
+        self.httpd.webhook_lock = threading.Lock()
+        self.httpd.webhook_buckets = {}
+        self.httpd.webhook_posts = []
+        self.httpd.webhook_429s = 0
+        # Without bucket headers on success a client only learns the limit from 429s
+        self.httpd.webhook_bucket_headers = True
+        self.thread = None
+
+    @property
+    def catalog(self):
+        return self.httpd.catalog
+
+    @property
+    def hits(self):
+        return self.httpd.hits
+
+    @property
+    def webhook_posts(self):
+        return self.httpd.webhook_posts
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='mock-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def localize(url, base):
+    """Point a real target URL at base (e.g. the mock server), keeping path and query."""
+    b = urlsplit(base)
+    return urlunsplit(urlsplit(url)._replace(scheme=b.scheme, netloc=b.netloc))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the tracker feed endpoints')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every GET')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    server = MockServer(args.port, Catalog(args.products), verbose=args.verbose, latency=args.latency)
+    print(f'Serving {args.products} products on {server.url}')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,465 @@
+"""
+tracker_poller.py
+
+Concurrent fetch engine for jordan_tracker.py. One asyncio event loop polls
+every target on its own jittered interval through a shared keep-alive
+connection pool with per-host concurrency and rate limits. Requests are
+conditional (ETag / If-Modified-Since) so unchanged feeds cost a 304, and the
+Nike feeds' anchor/count pages are fetched concurrently once the first page
+says how many there are. A target with a `stream` factory has its 200 bodies
+fed to a parser (tracker_feed_parser.FeedStream) as they arrive instead of
+being buffered.
+
+Only the standard library is used so it runs anywhere the tracker does.
+"""
+import asyncio
+import gzip
+import inspect
+import json
+import random
+import ssl
+import time
+import zlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) utilities_are_meh/jordan_tracker'
+
+
+class Response:
+    def __init__(self, url, status, headers, body, elapsed, stream=None):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.elapsed = elapsed
+        # Parser the body was streamed into (body is then empty)
+        self.stream = stream
+        # Served from tracker_shards.HttpCache rather than the network
+        self.cached = False
+
+    @property
+    def not_modified(self):
+        return self.status == 304
+
+    @property
+    def size(self):
+        return self.stream.nbytes if self.stream is not None else len(self.body)
+
+    def json(self):
+        return json.loads(self.body)
+
+    def __repr__(self):
+        return f'<Response {self.status} {self.url} {self.size}B>'
+
+
+class HostPool:
+    """Idle keep-alive connections plus the concurrency/rate limits of one host."""
+
+    def __init__(self, concurrency, rate):
+        self.idle = []
+        self.slots = asyncio.Semaphore(concurrency)
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_start = 0.0
+
+    async def wait_turn(self):
+        """Space request starts at least `interval` apart."""
+        if not self.interval:
+            return
+        now = time.monotonic()
+        start = max(now, self.next_start)
+        self.next_start = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+class HttpClient:
+    """Minimal HTTP/1.1 client with a per-host keep-alive pool.
+
+    host_limits maps a hostname to (concurrency, requests_per_second) and
+    overrides the defaults for that host.
+    """
+
+    def __init__(self, concurrency=4, rate=None, host_limits=None, timeout=20.0):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.host_limits = host_limits or {}
+        self.timeout = timeout
+        self.pools = {}
+        self.ssl_context = ssl.create_default_context()
+        self.requests = 0
+        self.bytes_in = 0
+
+    def _pool(self, key):
+        pool = self.pools.get(key)
+        if pool is None:
+            concurrency, rate = self.host_limits.get(key[1], (self.concurrency, self.rate))
+            pool = self.pools[key] = HostPool(concurrency, rate)
+        return pool
+
+    async def _connect(self, scheme, host, port):
+        tls = self.ssl_context if scheme == 'https' else None
+        return await asyncio.wait_for(asyncio.open_connection(host, port, ssl=tls), self.timeout)
+
+    async def request(self, method, url, headers=None, body=None, stream=None, cached=None):
+        """stream, if given, makes a parser that a 200 body is fed to chunk by chunk.
+
+        cached, if given, is called once the request holds a connection slot;
+        a Response it returns is used instead of sending the request.
+        """
+        parts = urlsplit(url)
+        scheme = parts.scheme or 'http'
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+
+        hdrs = {
+            'Host': parts.netloc,
+            'User-Agent': USER_AGENT,
+            'Accept': 'application/json, text/html;q=0.9, */*;q=0.8',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        }
+        if headers:
+            hdrs.update(headers)
+        if body is not None:
+            hdrs['Content-Length'] = str(len(body))
+        head = f'{method} {target} HTTP/1.1\r\n'
+        head += ''.join(f'{k}: {v}\r\n' for k, v in hdrs.items()) + '\r\n'
+        payload = head.encode('latin-1') + (body or b'')
+
+        pool = self._pool(key)
+        async with pool.slots:
+            hit = cached() if cached is not None else None
+            if hit is not None:
+                return hit
+            await pool.wait_turn()
+            # A pooled connection may have been closed by the server while idle;
+            # retry once on a fresh one before giving up.
+            for attempt in range(2):
+                fresh = not pool.idle
+                reader, writer = pool.idle.pop() if pool.idle else await self._connect(*key)
+                t0 = time.monotonic()
+                try:
+                    writer.write(payload)
+                    await writer.drain()
+                    status, resp_headers, resp_body, keep, nbytes, sink = await asyncio.wait_for(
+                        self._read_response(reader, method, stream), self.timeout)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if fresh or attempt:
+                        raise
+                    continue
+                except BaseException:
+                    writer.close()
+                    raise
+                if keep:
+                    pool.idle.append((reader, writer))
+                else:
+                    writer.close()
+                break
+
+        self.requests += 1
+        self.bytes_in += nbytes
+        encoding = resp_headers.get('content-encoding', '')
+        if sink is None:
+            if encoding == 'gzip':
+                resp_body = gzip.decompress(resp_body)
+            elif encoding == 'deflate':
+                resp_body = zlib.decompress(resp_body)
+        return Response(url, status, resp_headers, resp_body, time.monotonic() - t0, sink)
+
+    async def _read_response(self, reader, method, stream=None):
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError('connection closed before response')
+        version, status = line.decode('latin-1').split(None, 2)[:2]
+        status = int(status)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            return status, headers, b'', keep, 0, None
+        if headers.get('transfer-encoding', '').lower() != 'chunked' and 'content-length' not in headers:
+            keep = False
+
+        # Made per attempt, so a retried request starts from a fresh parser
+        sink = stream() if stream is not None and status == 200 else None
+        encoding = headers.get('content-encoding', '')
+        if sink is not None and encoding == 'gzip':
+            inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif sink is not None and encoding == 'deflate':
+            inflate = zlib.decompressobj()
+        else:
+            inflate = None
+        chunks = []
+        nbytes = 0
+        async for piece in self._body_pieces(reader, headers):
+            nbytes += len(piece)
+            if sink is None:
+                chunks.append(piece)
+            else:
+                sink.feed(inflate.decompress(piece) if inflate else piece)
+        if sink is not None:
+            if inflate:
+                sink.feed(inflate.flush())
+            sink.close()
+        return status, headers, b''.join(chunks), keep, nbytes, sink
+
+    @staticmethod
+    async def _body_pieces(reader, headers, size=65536):
+        """Raw body bytes as they arrive, for chunked, sized and read-to-close bodies."""
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                length = int((await reader.readline()).split(b';')[0], 16)
+                if length == 0:
+                    # Trailers until the blank line
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                yield await reader.readexactly(length)
+                await reader.readexactly(2)
+        elif 'content-length' in headers:
+            left = int(headers['content-length'])
+            while left:
+                piece = await reader.read(min(left, size))
+                if not piece:
+                    raise asyncio.IncompleteReadError(b'', left)
+                left -= len(piece)
+                yield piece
+        else:
+            while True:
+                piece = await reader.read(size)
+                if not piece:
+                    return
+                yield piece
+
+    async def get(self, url, headers=None, stream=None, cached=None, max_age=None):
+        # max_age is for caching fronts (tracker_shards.CachingClient); this client always asks the server
+        return await self.request('GET', url, headers, stream=stream, cached=cached)
+
+    async def post_json(self, url, data, headers=None):
+        hdrs = {'Content-Type': 'application/json'}
+        if headers:
+            hdrs.update(headers)
+        return await self.request('POST', url, hdrs, json.dumps(data).encode())
+
+    async def close(self):
+        for pool in self.pools.values():
+            for _, writer in pool.idle:
+                writer.close()
+            pool.idle.clear()
+
+
+def anchor_count(url):
+    """(anchor, count) of a Nike feed URL, looking inside the cic `endpoint` param too."""
+    query = dict(parse_qsl(urlsplit(url).query))
+    if 'anchor' not in query and 'endpoint' in query:
+        query = dict(parse_qsl(urlsplit(query['endpoint']).query))
+    try:
+        return int(query['anchor']), int(query['count'])
+    except (KeyError, ValueError):
+        return None, None
+
+
+def with_anchor(url, anchor):
+    """Same feed URL pointing at another page."""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if any(k == 'anchor' for k, _ in query):
+        query = [(k, str(anchor) if k == 'anchor' else v) for k, v in query]
+    else:
+        query = [(k, with_anchor(v, anchor) if k == 'endpoint' else v) for k, v in query]
+    # Keep the characters the feeds leave bare so a nested endpoint is not double-encoded
+    return urlunsplit(parts._replace(query=urlencode(query, safe='(),')))
+
+
+def feed_pages(doc):
+    """The `pages` block of a product_feed (top level) or cic browse (data.products) page."""
+    if not isinstance(doc, dict):
+        return {}
+    if 'pages' in doc:
+        return doc['pages'] or {}
+    products = (doc.get('data') or {}).get('products') or {}
+    return products.get('pages') or {}
+
+
+class Target:
+    """One polled URL. stream is an optional zero-argument parser factory (see HttpClient.request).
+
+    parser, tier and webhook are the registry settings the target came from
+    (tracker_registry); the poller itself only uses the fetch settings.
+    """
+
+    def __init__(self, name, url, interval=60.0, jitter=0.2, paginate=False, max_pages=20, stream=None,
+                 parser=None, tier='normal', webhook=None):
+        self.name = name
+        self.url = url
+        self.interval = interval
+        self.jitter = jitter
+        self.paginate = paginate
+        self.max_pages = max_pages
+        self.stream = stream
+        self.parser = parser
+        self.tier = tier
+        self.webhook = webhook
+
+    def __repr__(self):
+        return f'<Target {self.name} every {self.interval}s>'
+
+
+class Poller:
+    """Polls targets concurrently and hands changed pages to on_result.
+
+    on_result(target, responses) may be a plain function or a coroutine; it is
+    only called when at least one page came back 200 rather than 304.
+    """
+
+    def __init__(self, targets, client=None, on_result=None, rng=None):
+        self.targets = list(targets)
+        self.client = client or HttpClient()
+        self.on_result = on_result
+        self.rng = rng or random.Random()
+        self.validators = {}
+        self.page_urls = {}
+        self.polls = 0
+        self.not_modified = 0
+        self.errors = 0
+        # on_poll(target, responses, seconds) after every completed poll, e.g. tracker_metrics
+        self.on_poll = None
+
+    async def fetch(self, url, stream=None, max_age=None):
+        """Conditional GET that remembers the validators of every URL it has seen.
+
+        max_age is how old a cached copy the client may answer with, if it caches.
+        """
+        headers = {}
+        etag, modified = self.validators.get(url, (None, None))
+        if etag:
+            headers['If-None-Match'] = etag
+        if modified:
+            headers['If-Modified-Since'] = modified
+        resp = await self.client.get(url, headers, stream, max_age=max_age)
+        if resp.status == 200:
+            self.validators[url] = (resp.headers.get('etag'), resp.headers.get('last-modified'))
+        elif resp.not_modified:
+            self.not_modified += 1
+        return resp
+
+    @staticmethod
+    def first_url(target):
+        """Where polling a target starts: the first page of a paginated feed, whatever anchor it names.
+
+        The feeds list newest first, so a configured anchor=24 would otherwise skip the new drops.
+        """
+        if target.paginate:
+            anchor, count = anchor_count(target.url)
+            if count is not None and anchor:
+                return with_anchor(target.url, 0)
+        return target.url
+
+    async def poll(self, target):
+        """Fetch a target (and its other pages); returns the list of responses."""
+        self.polls += 1
+        t0 = time.monotonic()
+        # A cached copy younger than the shortest gap between two polls of this
+        # target was fetched for someone else, so it is as good as a new request
+        max_age = target.interval * (1 - target.jitter)
+        first = await self.fetch(self.first_url(target), target.stream, max_age)
+        responses = [first]
+        if target.paginate:
+            if first.status == 200:
+                self.page_urls[target.name] = self._other_page_urls(target, first)
+            # An unchanged first page says nothing about the later ones, so they
+            # are re-checked too (conditionally, so unchanged pages are a 304).
+            responses += await self._fetch_pages(self.page_urls.get(target.name, []), target.stream, max_age)
+        if self.on_poll is not None:
+            self.on_poll(target, responses, time.monotonic() - t0)
+        return responses
+
+    def _other_page_urls(self, target, first):
+        _, count = anchor_count(target.url)
+        if count is None:
+            return []
+        if first.stream is not None:
+            pages = first.stream.meta.get('pages') or {}
+        else:
+            try:
+                pages = feed_pages(first.json())
+            except ValueError:
+                return []
+        total = pages.get('totalResources')
+        if total is None and pages.get('totalPages') is not None:
+            total = pages['totalPages'] * count
+        if not total:
+            return []
+        anchors = range(count, int(total), count)
+        return [with_anchor(target.url, a) for a in anchors][:max(0, target.max_pages - 1)]
+
+    async def _fetch_pages(self, urls, stream=None, max_age=None):
+        results = await asyncio.gather(*(self.fetch(url, stream, max_age) for url in urls), return_exceptions=True)
+        out = []
+        for url, res in zip(urls, results):
+            if isinstance(res, BaseException):
+                self.errors += 1
+                # Status 0 stands for a page that could not be fetched, so callers can tell the poll was incomplete
+                res = Response(url, 0, {}, b'', 0.0)
+            out.append(res)
+        return out
+
+    def next_delay(self, target):
+        return target.interval * self.rng.uniform(1 - target.jitter, 1 + target.jitter)
+
+    async def _deliver(self, target, responses):
+        if self.on_result is None or not any(r.status == 200 for r in responses):
+            return
+        result = self.on_result(target, responses)
+        if inspect.isawaitable(result):
+            await result
+
+    async def poll_once(self, target):
+        """Poll and deliver one target, reporting (not raising) fetch errors."""
+        try:
+            responses = await self.poll(target)
+            await self._deliver(target, responses)
+        except (OSError, asyncio.TimeoutError, ValueError) as e:
+            self.errors += 1
+            print(f'[{target.name}] poll failed: {e!r}')
+
+    async def _loop(self, target, stop):
+        # Spread the first round out so every target does not fire at once
+        await asyncio.sleep(self.rng.uniform(0, target.interval * target.jitter))
+        while not stop.is_set():
+            await self.poll_once(target)
+            try:
+                await asyncio.wait_for(stop.wait(), self.next_delay(target))
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self, stop=None):
+        """Poll every target until stop (an asyncio.Event) is set."""
+        stop = stop or asyncio.Event()
+        try:
+            await asyncio.gather(*(self._loop(t, stop) for t in self.targets))
+        finally:
+            await self.client.close()
+
+    async def poll_all(self):
+        """One concurrent round over every target, e.g. for benchmarks or cron use."""
+        results = await asyncio.gather(*(self.poll(t) for t in self.targets), return_exceptions=True)
+        out = {}
+        for target, res in zip(self.targets, results):
+            if isinstance(res, BaseException):
+                self.errors += 1
+                continue
+            out[target.name] = res
+            await self._deliver(target, res)
+        return out
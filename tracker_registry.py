@@ -0,0 +1,433 @@
+"""
+tracker_registry.py
+
+Poll targets for jordan_tracker.py, loaded from a JSON config file
+(tracker_targets.json) instead of living in the code. Each target has its own
+interval, a priority tier that scales it (hot targets poll faster on release
+day), the parser its pages go through and the webhook its alerts go to. The
+file is re-read whenever it changes; a target that is being polled at that
+moment finishes with its old settings and picks up the new ones for its next
+poll.
+
+TargetScheduler keeps one heap of next-due times, so finding the next poll
+costs O(log n) however many targets there are. Its clock and sleep are
+injected, and FakeClock runs it in virtual time for tests and --simulate.
+
+Usage:
+    python tracker_registry.py tracker_targets.json          # validate and list
+    python tracker_registry.py --simulate 5000 --hours 2     # scheduler in virtual time
+"""
+import argparse
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+from functools import partial
+
+from tracker_feed_parser import FeedStream
+from tracker_poller import Target
+from tracker_store import product_record
+
+
+# Parser name -> stream factory for the HttpClient (None means the body is buffered)
+PARSERS = {
+    'feed': partial(FeedStream, product_record),  # Nike feed, streamed and diffed
+    'json': None,                                 # Nike feed, buffered and diffed
+    'raw': None,                                  # any page; only reported when it changes
+}
+DIFF_PARSERS = ('feed', 'json')
+
+DEFAULT_TIERS = {'hot': 0.25, 'normal': 1.0, 'cold': 4.0}
+
+
+def target_name(url):
+    """Default name of a target: the last path segment of its URL."""
+    return url.rstrip('/').rsplit('/', 1)[-1].split('?')[0] or url
+
+
+def _number(value, where):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f'{where} must be a number, not {value!r}')
+    return float(value)
+
+
+def _mapping(value, where):
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise ValueError(f'{where} must be a JSON object')
+    return value
+
+
+def parse_config(config):
+    """Validate a loaded config; returns (webhooks, default webhook, {name: spec}).
+
+    Anything malformed, including a value of the wrong JSON type, is a ValueError.
+    """
+    if not isinstance(config, dict):
+        raise ValueError('config must be a JSON object')
+    webhooks = dict(_mapping(config.get('webhooks'), 'webhooks'))
+    for ref, url in webhooks.items():
+        if not isinstance(url, str):
+            raise ValueError(f'webhook {ref!r} must be a URL string')
+    tiers = dict(DEFAULT_TIERS)
+    for tier, scale in _mapping(config.get('tiers'), 'tiers').items():
+        tiers[tier] = _number(scale, f'tier {tier!r}')
+        if tiers[tier] <= 0:
+            raise ValueError(f'tier {tier!r} must be positive')
+    defaults = _mapping(config.get('defaults'), 'defaults')
+    targets = config.get('targets') or []
+    if not isinstance(targets, list):
+        raise ValueError('targets must be a list')
+
+    def webhook_url(ref, where):
+        if ref is not None and not isinstance(ref, str):
+            raise ValueError(f'{where}: webhook must be a string, not {ref!r}')
+        if ref is None or '://' in ref:
+            return ref
+        if ref not in webhooks:
+            raise ValueError(f'{where}: unknown webhook {ref!r}')
+        return webhooks[ref]
+
+    default_webhook = webhook_url(config.get('default_webhook'), 'default_webhook')
+    specs = {}
+    for i, entry in enumerate(targets):
+        if isinstance(entry, str):
+            entry = {'url': entry}
+        if not isinstance(entry, dict):
+            raise ValueError(f'target #{i} must be a URL or an object, not {entry!r}')
+        spec = dict(defaults)
+        spec.update(entry)
+        if not spec.get('url') or not isinstance(spec['url'], str):
+            raise ValueError(f'target #{i} has no url')
+        name = spec.setdefault('name', target_name(spec['url']))
+        if not isinstance(name, str) or not name:
+            raise ValueError(f'target #{i}: name must be a non-empty string')
+        if name in specs:
+            raise ValueError(f'duplicate target name {name!r}')
+        tier = spec.setdefault('tier', 'normal')
+        if not isinstance(tier, str) or tier not in tiers:
+            raise ValueError(f'{name}: unknown tier {tier!r}')
+        parser = spec.setdefault('parser', 'raw')
+        if not isinstance(parser, str) or parser not in PARSERS:
+            raise ValueError(f'{name}: unknown parser {parser!r}')
+        interval = _number(spec.setdefault('interval', 60.0), f'{name}: interval')
+        if interval <= 0:
+            raise ValueError(f'{name}: interval must be positive')
+        jitter = _number(spec.setdefault('jitter', 0.2), f'{name}: jitter')
+        if not 0 <= jitter < 1:
+            raise ValueError(f'{name}: jitter must be in [0, 1)')
+        if not isinstance(spec.setdefault('paginate', False), bool):
+            raise ValueError(f'{name}: paginate must be true or false')
+        max_pages = spec.setdefault('max_pages', 20)
+        if isinstance(max_pages, bool) or not isinstance(max_pages, int) or max_pages < 1:
+            raise ValueError(f'{name}: max_pages must be a positive integer')
+        spec['poll_every'] = interval * tiers[tier]
+        spec['webhook_url'] = webhook_url(spec.get('webhook'), name)
+        specs[name] = spec
+    return webhooks, default_webhook, specs
+
+
+def make_target(spec, rewrite=None):
+    rewrite = rewrite or (lambda url: url)
+    webhook = rewrite(spec['webhook_url']) if spec['webhook_url'] else None
+    return Target(spec['name'], rewrite(spec['url']), spec['poll_every'], spec.get('jitter', 0.2),
+                  spec.get('paginate', False), spec.get('max_pages', 20), PARSERS[spec['parser']],
+                  spec['parser'], spec['tier'], webhook)
+
+
+class Registry:
+    """The targets of one config file, reloaded by check() when the file changes.
+
+    rewrite is applied to every target and webhook URL (jordan_tracker uses it
+    to point everything at the mock server); select(name), if given, keeps
+    only the targets it returns true for (tracker_shards uses it per worker).
+    """
+
+    def __init__(self, path, rewrite=None, select=None):
+        self.path = path
+        self.rewrite = rewrite
+        self.select = select
+        self.stamp = None
+        self.specs = {}
+        self.targets = {}
+        self.default_webhook = None
+        self.reloads = 0
+        self.load()
+
+    def _stamp(self):
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    def load(self):
+        """Read the file; returns the (added, removed, changed) target names."""
+        stamp = self._stamp()
+        with open(self.path, encoding='utf-8') as f:
+            config = json.load(f)
+        _, default_webhook, specs = parse_config(config)
+        if self.select is not None:
+            specs = {name: spec for name, spec in specs.items() if self.select(name)}
+        self.stamp = stamp
+        added = [n for n in specs if n not in self.specs]
+        removed = [n for n in self.specs if n not in specs]
+        changed = [n for n in specs if n in self.specs and specs[n] != self.specs[n]]
+        for name in removed:
+            del self.targets[name]
+        for name in added + changed:
+            # A new Target object, so a poll already holding the old one is unaffected
+            self.targets[name] = make_target(specs[name], self.rewrite)
+        self.specs = specs
+        self.default_webhook = self.rewrite(default_webhook) if self.rewrite and default_webhook else default_webhook
+        self.reloads += 1
+        return added, removed, changed
+
+    def check(self):
+        """Reload if the file changed; a broken edit is reported and the old targets kept."""
+        try:
+            stamp = self._stamp()
+        except OSError as e:
+            print(f'Target config unavailable ({e}); keeping {len(self.targets)} targets')
+            return None
+        if stamp == self.stamp:
+            return None
+        try:
+            return self.load()
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            # Remember the broken version so it is not re-parsed every check
+            self.stamp = stamp
+            print(f'Ignoring bad target config {self.path}: {e}')
+            return None
+
+    @property
+    def routes(self):
+        """Target name -> webhook URL, as WebhookDispatcher routes events by feed."""
+        return {name: t.webhook for name, t in self.targets.items() if t.webhook}
+
+
+class TargetScheduler:
+    """Runs each registry target when it is due, off a heap of next-due times.
+
+    poll(target) is awaited in its own task, so a slow target never delays
+    the others; a target is not started again while its last poll is still
+    running. Heap entries are invalidated lazily: only the entry whose
+    sequence number matches `entries` is live.
+    """
+
+    def __init__(self, registry, poll, clock=time.monotonic, sleep=asyncio.sleep, rng=None, reload_every=2.0,
+                 on_reload=None):
+        self.registry = registry
+        self.poll = poll
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+        self.reload_every = reload_every
+        self.on_reload = on_reload
+        self.heap = []
+        self.entries = {}   # name -> (due, seq) of its live heap entry
+        self.seq = itertools.count()
+        self.inflight = {}
+        self.polls = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+    def next_delay(self, target):
+        return target.interval * self.rng.uniform(1 - target.jitter, 1 + target.jitter)
+
+    def schedule(self, name, due):
+        seq = next(self.seq)
+        self.entries[name] = (due, seq)
+        heapq.heappush(self.heap, (due, seq, name))
+
+    def due(self, name):
+        entry = self.entries.get(name)
+        return entry[0] if entry else None
+
+    def sync(self, added, removed, changed):
+        now = self.clock()
+        for name in added:
+            if name in self.inflight:
+                continue
+            target = self.registry.targets[name]
+            # Spread first polls out so a big config does not fire all at once
+            self.schedule(name, now + self.rng.uniform(0, target.interval * max(target.jitter, 0.05)))
+        for name in removed:
+            self.entries.pop(name, None)
+        for name in changed:
+            if name in self.inflight or name not in self.entries:
+                continue
+            # Promoted to a faster tier: poll sooner; slowed down: let the current wait run out
+            due = min(self.entries[name][0], now + self.next_delay(self.registry.targets[name]))
+            self.schedule(name, due)
+
+    async def _run_one(self, name, target):
+        try:
+            await self.poll(target)
+        except Exception as e:
+            print(f'[{name}] poll crashed: {e!r}')
+        finally:
+            del self.inflight[name]
+            # Reschedule from the current config, which may have changed or dropped it
+            current = self.registry.targets.get(name)
+            if current is not None:
+                self.schedule(name, self.clock() + self.next_delay(current))
+
+    def _start_due(self, now):
+        while self.heap and self.heap[0][0] <= now:
+            due, seq, name = heapq.heappop(self.heap)
+            entry = self.entries.get(name)
+            if entry is None or entry[1] != seq:
+                continue
+            del self.entries[name]
+            if name in self.inflight:
+                continue
+            lag = now - due
+            self.polls += 1
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+            self.inflight[name] = asyncio.ensure_future(self._run_one(name, self.registry.targets[name]))
+
+    async def run(self, stop=None):
+        """Poll until stop (an asyncio.Event) is set; polls in flight are then awaited, not dropped."""
+        stop = stop or asyncio.Event()
+        self.sync(list(self.registry.targets), [], [])
+        next_check = self.clock() + self.reload_every
+        while not stop.is_set():
+            now = self.clock()
+            if now >= next_check:
+                changes = self.registry.check()
+                if changes:
+                    self.sync(*changes)
+                    if self.on_reload is not None:
+                        self.on_reload(changes)
+                next_check = now + self.reload_every
+            self._start_due(now)
+            wake = min(self.heap[0][0] if self.heap else next_check, next_check)
+            await self.sleep(max(0.0, wake - self.clock()))
+        if self.inflight:
+            await asyncio.gather(*self.inflight.values(), return_exceptions=True)
+
+    def stats(self):
+        return {
+            'targets': len(self.registry.targets),
+            'polls': self.polls,
+            'in_flight': len(self.inflight),
+            'heap': len(self.heap),
+            'mean_lag': self.lag_total / self.polls if self.polls else 0.0,
+            'max_lag': self.lag_max,
+        }
+
+
+class FakeClock:
+    """Virtual time: call it for the time, await sleep() to park until advance() gets there.
+
+    advance() first lets every runnable task reach its next await (a few
+    event-loop turns), so it is meant for code that only waits on this clock.
+    """
+
+    def __init__(self, start=0.0, settle=20):
+        self.now = start
+        self.settle = settle
+        self.sleepers = []
+        self.seq = itertools.count()
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, delay):
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.sleepers, (self.now + max(0.0, delay), next(self.seq), fut))
+        await fut
+
+    async def advance(self, until):
+        """Run everything sleeping on this clock up to virtual time `until`."""
+        while True:
+            for _ in range(self.settle):
+                await asyncio.sleep(0)
+            if not self.sleepers or self.sleepers[0][0] > until:
+                self.now = max(self.now, until)
+                return
+            when, _, fut = heapq.heappop(self.sleepers)
+            self.now = max(self.now, when)
+            if not fut.done():
+                fut.set_result(None)
+
+
+def synthetic_config(count, rng, hot=0.05, cold=0.15):
+    targets = []
+    for i in range(count):
+        r = rng.random()
+        tier = 'hot' if r < hot else 'cold' if r < hot + cold else 'normal'
+        targets.append({'name': f'sku-{i:05d}', 'url': f'https://www.nike.com/gb/t/shoe-{i}/SKU{i:05d}',
+                        'interval': rng.choice([30, 60, 120, 300]), 'tier': tier})
+    return {'targets': targets}
+
+
+def write_json(path, doc):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(doc, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+async def simulate(count, hours, promote, seed=5):
+    """Scheduler over `count` targets in virtual time, promoting some to hot halfway through."""
+    rng = random.Random(seed)
+    clock = FakeClock()
+    config = synthetic_config(count, rng)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'targets.json')
+        write_json(path, config)
+        registry = Registry(path)
+        polls = {}
+
+        async def poll(target):
+            polls[target.tier] = polls.get(target.tier, 0) + 1
+            await clock.sleep(rng.uniform(0.1, 1.5))
+
+        scheduler = TargetScheduler(registry, poll, clock, clock.sleep, random.Random(seed))
+        stop = asyncio.Event()
+        runner = asyncio.ensure_future(scheduler.run(stop))
+        half = hours * 3600 / 2
+        t0 = time.perf_counter()
+        await clock.advance(half)
+        first = dict(polls)
+        normal = [t for t in config['targets'] if t['tier'] == 'normal']
+        for t in normal[:promote]:
+            t['tier'] = 'hot'
+        write_json(path, config)
+        polls.clear()
+        await clock.advance(2 * half)
+        stop.set()
+        await clock.advance(2 * half + 60)
+        await runner
+        wall = time.perf_counter() - t0
+
+    stats = scheduler.stats()
+    print(f'{count} targets, {hours} h virtual in {wall:.2f} s wall, {stats["polls"]} polls '
+          f'({stats["polls"] / wall:.0f} scheduled/s), schedule lag mean {stats["mean_lag"] * 1000:.2f} ms '
+          f'max {stats["max_lag"] * 1000:.2f} ms')
+    print(f'  first half polls by tier:  {dict(sorted(first.items()))}')
+    print(f'  after promoting {promote} to hot: {dict(sorted(polls.items()))}  (reloads: {registry.reloads - 1})')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Validate a tracker target config or simulate its scheduler')
+    parser.add_argument('config', nargs='?', default='tracker_targets.json')
+    parser.add_argument('--simulate', type=int, metavar='TARGETS', help='run the scheduler on synthetic targets')
+    parser.add_argument('--hours', type=float, default=1.0, help='virtual hours to simulate')
+    parser.add_argument('--promote', type=int, default=100, help='targets moved to the hot tier halfway')
+    args = parser.parse_args()
+    if args.simulate:
+        asyncio.run(simulate(args.simulate, args.hours, args.promote))
+        return
+    registry = Registry(args.config)
+    for name, t in registry.targets.items():
+        print(f'{name:>24}  {t.tier:>6}  every {t.interval:6.1f}s  {t.parser:>4}  '
+              f'{"paged" if t.paginate else "     "}  {"own webhook" if t.webhook else "default webhook"}')
+
+
+if __name__ == '__main__':
+    main()
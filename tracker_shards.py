@@ -0,0 +1,491 @@
+"""
+tracker_shards.py
+
+Sharded mode for jordan_tracker.py: the registry's targets are split across
+worker processes by consistent hashing of their names, so adding a worker
+moves only about 1/n of them. Each worker polls, parses and diffs its own
+shard; a coordinator in the parent collects their change events and hands
+them to the one webhook dispatcher.
+
+Workers share an on-disk HTTP cache (SQLite, keyed by URL) with a TTL and
+LRU eviction, so the same product page listed under several targets is
+fetched once per TTL however many workers poll it. Feed pages skip it and
+are streamed straight into their parser.
+
+Usage:
+    python jordan_tracker.py --shards 4
+    python tracker_shards.py --bench 1 2 4      # scaling against the mock server
+"""
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import sqlite3
+import tempfile
+import time
+
+from tracker_metrics import TrackerMetrics
+from tracker_mock_server import Catalog, MockServer, localize
+from tracker_poller import HttpClient, Poller, Response
+from tracker_registry import DIFF_PARSERS, Registry, TargetScheduler
+from tracker_store import SnapshotStore
+
+
+def hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent hash ring with `replicas` virtual points per node."""
+
+    def __init__(self, nodes, replicas=64):
+        self.points = sorted((hash64(f'{node}#{i}'), node) for node in nodes for i in range(replicas))
+        self.hashes = [h for h, _ in self.points]
+
+    def node_for(self, key):
+        i = bisect.bisect(self.hashes, hash64(key)) % len(self.points)
+        return self.points[i][1]
+
+
+def max_age(headers):
+    """Freshness lifetime from Cache-Control, 0 for no-store/no-cache, None if unspecified."""
+    directives = [d.strip().lower() for d in headers.get('cache-control', '').split(',')]
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+    for d in directives:
+        if d.startswith('max-age='):
+            try:
+                return float(d[8:])
+            except ValueError:
+                pass
+    return None
+
+
+class HttpCache:
+    """Last 200 response per URL, shared by every worker through one SQLite file.
+
+    Entries are fresh for `ttl` seconds (or the response's max-age); stale ones
+    are kept so their ETag can revalidate them. Past max_entries the least
+    recently used entries are evicted.
+
+    The cache is used from the event loop, so lookups never write: access
+    times are collected in memory and written with the next put (or every
+    touch_every lookups), and a write that waits more than busy_timeout
+    seconds on another worker is dropped rather than stalling every poll.
+    """
+
+    def __init__(self, path='tracker_http_cache.db', ttl=30.0, max_entries=20000, evict_every=200,
+                 touch_every=200, busy_timeout=1.0):
+        # Setting up waits for the other workers; after that writes give up after busy_timeout
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(responses)')]
+        if columns and 'fetched' not in columns:
+            # Cache files from before `fetched` was recorded: nothing in them is worth migrating
+            with self.db:
+                self.db.execute('DROP TABLE responses')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                headers TEXT,
+                body BLOB,
+                expires REAL,
+                last_access REAL,
+                fetched REAL
+            );
+            CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access);
+        ''')
+        self.db.execute(f'PRAGMA busy_timeout = {int(busy_timeout * 1000)}')
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.touch_every = touch_every
+        self.touched = {}   # url -> last access not yet written
+        self.puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evicted = 0
+        self.busy = 0
+
+    def close(self):
+        self._write(None)
+        self.db.close()
+
+    def _write(self, sql, args=()):
+        """Run one write, plus the pending access times, in a transaction; False if the file stayed locked."""
+        touched, self.touched = self.touched, {}
+        try:
+            with self.db:
+                if touched:
+                    self.db.executemany('UPDATE responses SET last_access = ? WHERE url = ?',
+                                        [(t, url) for url, t in touched.items()])
+                if sql is not None:
+                    self.db.execute(sql, args)
+            return True
+        except sqlite3.OperationalError:
+            # Another worker holds the write lock; an LRU hint or a cache fill is not worth waiting for
+            self.busy += 1
+            return False
+
+    def get(self, url, now=None):
+        """(headers, body, expires, fetched) of the cached response, or None."""
+        now = time.time() if now is None else now
+        row = self.db.execute('SELECT headers, body, expires, fetched FROM responses WHERE url = ?',
+                              (url,)).fetchone()
+        if row is None:
+            return None
+        self.touched[url] = now
+        if len(self.touched) >= self.touch_every:
+            self._write(None)
+        return json.loads(row[0]), row[1], row[2], row[3]
+
+    def put(self, url, headers, body, now=None):
+        now = time.time() if now is None else now
+        ttl = max_age(headers)
+        if ttl == 0:
+            return
+        # Bodies are stored decoded, so the transfer headers no longer apply
+        headers = {k: v for k, v in headers.items()
+                   if k not in ('content-encoding', 'content-length', 'transfer-encoding')}
+        if not self._write('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                           (url, json.dumps(headers), body, now + (self.ttl if ttl is None else ttl), now, now)):
+            return
+        self.puts += 1
+        if self.puts % self.evict_every == 0:
+            self.evict()
+
+    def refresh(self, url, headers, now=None):
+        """A 304 confirmed the cached copy: start a new freshness period."""
+        now = time.time() if now is None else now
+        ttl = max_age(headers)
+        self._write('UPDATE responses SET expires = ?, last_access = ?, fetched = ? WHERE url = ?',
+                    (now + (self.ttl if ttl is None else ttl), now, now, url))
+
+    def evict(self):
+        count = self.db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0 and self._write('DELETE FROM responses WHERE url IN '
+                                      '(SELECT url FROM responses ORDER BY last_access LIMIT ?)', (excess,)):
+            self.evicted += excess
+
+
+def replay(url, status, headers, body, elapsed, stream):
+    """Response for a body that is already in memory, run through the target's parser if it has one."""
+    if stream is None or status != 200:
+        return Response(url, status, headers, body, elapsed)
+    sink = stream()
+    sink.feed(body)
+    sink.close()
+    return Response(url, status, headers, b'', elapsed, sink)
+
+
+class CachingClient:
+    """HttpClient front that answers GETs from an HttpCache while they are fresh.
+
+    The poller's own validators still work: a fresh entry whose ETag the
+    poller already has comes back as a 304, as the server would have said.
+    A caller's max_age caps freshness further, so a target polled every few
+    seconds never gets a copy older than its own interval. Streamed requests
+    (the feed parsers) skip the cache and are parsed as they arrive.
+    """
+
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+
+    @property
+    def requests(self):
+        return self.client.requests
+
+    @property
+    def bytes_in(self):
+        return self.client.bytes_in
+
+    def _fresh(self, url, known, stream, max_age):
+        entry = self.cache.get(url)
+        now = time.time()
+        if entry is None or entry[2] <= now:
+            return None
+        if max_age is not None and (entry[3] or 0.0) <= now - max_age:
+            return None
+        self.cache.hits += 1
+        headers, body, _, _ = entry
+        etag = headers.get('etag')
+        status = 304 if etag and known == etag else 200
+        resp = replay(url, status, headers, body if status == 200 else b'', 0.0, stream)
+        resp.cached = True
+        return resp
+
+    async def get(self, url, headers=None, stream=None, max_age=None):
+        if stream is not None:
+            # Buffering the body for the cache would undo the parser's streaming
+            return await self.client.get(url, headers, stream)
+        headers = dict(headers or {})
+        known = headers.get('If-None-Match')
+        resp = self._fresh(url, known, stream, max_age)
+        if resp is not None:
+            return resp
+        entry = self.cache.get(url)
+        etag = entry[0].get('etag') if entry is not None else None
+        if etag:
+            # Revalidate the shared copy, which may be newer than what this poller has seen
+            headers['If-None-Match'] = etag
+        # Looked up again once a connection is free: a twin of this URL queued
+        # ahead of it (here or in another worker) may have fetched it meanwhile
+        resp = await self.client.get(url, headers, cached=lambda: self._fresh(url, known, stream, max_age))
+        if resp.cached:
+            return resp
+        self.cache.misses += 1
+        if resp.status == 200:
+            self.cache.put(url, resp.headers, resp.body)
+        elif resp.not_modified and etag:
+            self.cache.revalidated += 1
+            self.cache.refresh(url, resp.headers)
+            if known != etag:
+                # Unchanged for the cache but new to this poller
+                return replay(url, 200, entry[0], entry[1], resp.elapsed, stream)
+        return replay(url, resp.status, resp.headers, resp.body, resp.elapsed, stream)
+
+    async def post_json(self, url, data, headers=None):
+        return await self.client.post_json(url, data, headers)
+
+    async def close(self):
+        await self.client.close()
+
+
+def _shard_registry(config_path, base, index, workers):
+    ring = HashRing(range(workers))
+    rewrite = (lambda u: localize(u, base)) if base else None
+    return Registry(config_path, rewrite, lambda name: ring.node_for(name) == index)
+
+
+def worker_main(index, workers, config_path, base, cache_path, db_path, events, stop, host_limits=None,
+                ttl=30.0, rounds=None, start_at=None, metrics_every=5.0):
+    """Entry point of one worker process; see _worker."""
+    try:
+        asyncio.run(_worker(index, workers, config_path, base, cache_path, db_path, events, stop, host_limits,
+                            ttl, rounds, start_at, metrics_every))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker(index, workers, config_path, base, cache_path, db_path, events, stop, host_limits, ttl, rounds,
+                  start_at, metrics_every):
+    """Poll this worker's shard and put its results on `events`, then ('stats', index, {...}).
+
+    Every changed target is sent as ('pages', index, (name, changed pages,
+    pages, bytes)) and, for the diffed parsers, its change events as
+    ('events', index, [...]). Its TrackerMetrics go out as ('metrics', index,
+    snapshot) every metrics_every seconds and once more at the end.
+
+    With rounds set, every target is polled that many times back to back
+    (forgetting validators between rounds, as if every page had changed)
+    instead of on its schedule; that is the benchmark mode.
+    """
+    registry = _shard_registry(config_path, base, index, workers)
+    cache = HttpCache(cache_path, ttl)
+    store = SnapshotStore(db_path)
+    client = CachingClient(HttpClient(host_limits={} if base else host_limits), cache)
+    metrics = TrackerMetrics()
+    found = 0
+
+    def on_result(target, responses):
+        nonlocal found
+        fresh = [r for r in responses if r.status == 200]
+        events.put(('pages', index, (target.name, len(fresh), len(responses), sum(r.size for r in fresh))))
+        if target.parser not in DIFF_PARSERS:
+            return
+        changes = metrics.diff(target, responses, store)
+        if changes:
+            found += len(changes)
+            events.put(('events', index, changes))
+
+    poller = Poller(registry.targets.values(), client, on_result)
+    metrics.attach(poller)
+
+    async def publish_metrics():
+        while True:
+            await asyncio.sleep(metrics_every)
+            events.put(('metrics', index, metrics.snapshot()))
+
+    publisher = asyncio.ensure_future(publish_metrics())
+    if start_at is not None:
+        await asyncio.sleep(max(0.0, start_at - time.time()))
+    t0 = time.time()
+    try:
+        if rounds is not None:
+            for _ in range(rounds):
+                poller.validators.clear()
+                await poller.poll_all()
+        else:
+            done = asyncio.Event()
+
+            async def watch_stop():
+                # multiprocessing.Event can't be awaited, so look at it twice a second
+                while not stop.is_set():
+                    await asyncio.sleep(0.5)
+                done.set()
+
+            watcher = asyncio.ensure_future(watch_stop())
+            await TargetScheduler(registry, poller.poll_once).run(done)
+            watcher.cancel()
+    finally:
+        elapsed = time.time() - t0
+        publisher.cancel()
+        await client.close()
+        events.put(('metrics', index, metrics.snapshot()))
+        events.put(('stats', index, {
+            'targets': len(registry.targets), 'polls': poller.polls, 'requests': client.requests,
+            'bytes_in': client.bytes_in, 'cache_hits': cache.hits, 'cache_misses': cache.misses,
+            'revalidated': cache.revalidated, 'events': found, 'errors': poller.errors,
+            'started': t0, 'elapsed': elapsed,
+        }))
+        cache.close()
+        store.close()
+
+
+class Coordinator:
+    """Collects what the workers send and hands their change events to the one webhook dispatcher.
+
+    Each target belongs to exactly one worker (the ring is over fixed worker
+    indices, so a reload never moves a name), and the snapshot store keys
+    rows by feed, so workers never report the same change twice and events
+    are passed on as they come. Worker metrics snapshots are merged into
+    `metrics` (a TrackerMetrics) if one is given.
+    """
+
+    def __init__(self, dispatcher=None, verbose=True, metrics=None):
+        self.dispatcher = dispatcher
+        self.verbose = verbose
+        self.metrics = metrics
+        self.received = 0
+        self.changed_targets = 0
+        self.stats = {}
+
+    def handle(self, message):
+        kind, index, payload = message
+        if kind == 'events':
+            self.received += len(payload)
+            if self.dispatcher is not None:
+                self.dispatcher.submit(payload)
+            if self.verbose:
+                for event in payload:
+                    print(f"[{event['feed']}] {event['kind']}: {event['title']} {event['sku']} {event['price']}")
+        elif kind == 'pages':
+            self.changed_targets += 1
+            if self.verbose:
+                name, fresh, pages, size = payload
+                print(f'[{name}] {fresh}/{pages} pages changed, {size} bytes')
+        elif kind == 'metrics':
+            if self.metrics is not None:
+                self.metrics.merge(payload)
+        elif kind == 'stats':
+            self.stats[index] = payload
+
+
+def _get(q, timeout):
+    try:
+        return q.get(True, timeout)
+    except queue.Empty:
+        return None
+
+
+async def run_sharded(workers, config_path, base=None, cache_path='tracker_http_cache.db',
+                      db_path='tracker_snapshot.db', coordinator=None, host_limits=None, ttl=30.0, rounds=None,
+                      stop=None):
+    """Start the workers and feed their events to coordinator until stop is set (or the rounds are done)."""
+    coordinator = coordinator or Coordinator()
+    stop = stop or asyncio.Event()
+    # spawn, not fork: the parent runs an event loop and threads that must not be copied
+    ctx = multiprocessing.get_context('spawn')
+    events = ctx.Queue()
+    worker_stop = ctx.Event()
+    start_at = time.time() + 1.0 + 0.5 * workers if rounds is not None else None
+    procs = [ctx.Process(target=worker_main, name=f'tracker-shard-{i}',
+                         args=(i, workers, config_path, base, cache_path, db_path, events, worker_stop, host_limits,
+                               ttl, rounds, start_at))
+             for i in range(workers)]
+    for p in procs:
+        p.start()
+    loop = asyncio.get_running_loop()
+    try:
+        while len(coordinator.stats) < workers:
+            if stop.is_set():
+                worker_stop.set()
+            message = await loop.run_in_executor(None, _get, events, 0.5)
+            if message is not None:
+                coordinator.handle(message)
+            elif not any(p.is_alive() for p in procs):
+                break
+    finally:
+        worker_stop.set()
+        for p in procs:
+            p.join(10)
+    return coordinator
+
+
+def bench_config(path, base, skus, duplicates, products):
+    """SKU pages (some listed twice under different names) plus both feed flavours over the same products."""
+    targets = [{'name': f'sku-{i}', 'url': f'{base}/gb/t/shoe-{i}/SKU{i:05d}'} for i in range(skus)]
+    targets += [{'name': f'listed-{i}', 'url': f'{base}/gb/t/shoe-{i}/SKU{i:05d}'}
+                for i in range(int(skus * duplicates))]
+    for anchor in range(0, products, 50):
+        endpoint = f'/product_feed/rollup_threads/v2?anchor={anchor}&count=50'
+        targets.append({'name': f'threads-{anchor}', 'parser': 'feed',
+                        'url': f'{base}/product_feed/threads/v3/?anchor={anchor}&count=50'})
+        targets.append({'name': f'browse-{anchor}', 'parser': 'feed',
+                        'url': f'{base}/cic/browse/v2?queryid=products&endpoint={endpoint}'})
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'targets': targets}, f)
+    return [t['name'] for t in targets]
+
+
+def ring_moves(names, workers):
+    before, after = HashRing(range(workers)), HashRing(range(workers + 1))
+    return sum(before.node_for(n) != after.node_for(n) for n in names) / len(names)
+
+
+def bench(worker_counts, skus=1000, duplicates=0.25, products=500, latency=0.02, rounds=1, ttl=30.0):
+    with MockServer(catalog=Catalog(products), latency=latency) as server:
+        for workers in worker_counts:
+            with tempfile.TemporaryDirectory() as tmp:
+                config = os.path.join(tmp, 'targets.json')
+                names = bench_config(config, server.url, skus, duplicates, products)
+                hits_before = server.hits
+                coordinator = asyncio.run(run_sharded(
+                    workers, config, None, os.path.join(tmp, 'cache.db'), os.path.join(tmp, 'snapshot.db'),
+                    Coordinator(verbose=False), ttl=ttl, rounds=rounds))
+            stats = list(coordinator.stats.values())
+            polls = sum(s['polls'] for s in stats)
+            wall = max(s['started'] + s['elapsed'] for s in stats) - min(s['started'] for s in stats)
+            hits = sum(s['cache_hits'] for s in stats)
+            lookups = hits + sum(s['cache_misses'] for s in stats)
+            print(f'{workers} worker(s): {len(names)} targets, {polls} polls in {wall:5.2f}s = {polls / wall:6.0f}/s  '
+                  f'server GETs {server.hits - hits_before}  cache hits {hits / max(lookups, 1):5.1%}  '
+                  f'{coordinator.changed_targets} targets changed  events {coordinator.received}  '
+                  f'shard sizes {sorted(s["targets"] for s in stats)}')
+        print(f'Going from {worker_counts[-1]} to {worker_counts[-1] + 1} workers moves '
+              f'{ring_moves(names, worker_counts[-1]):.1%} of targets')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sharded tracker benchmark against the local mock server')
+    parser.add_argument('--bench', type=int, nargs='+', metavar='WORKERS', default=[1, 2, 4])
+    parser.add_argument('--skus', type=int, default=1000, help='product page targets')
+    parser.add_argument('--duplicates', type=float, default=0.25, help='fraction of pages listed under a second target')
+    parser.add_argument('--products', type=int, default=500, help='products in the mock feeds')
+    parser.add_argument('--latency', type=float, default=0.02, help='mock server response time')
+    parser.add_argument('--rounds', type=int, default=1)
+    parser.add_argument('--ttl', type=float, default=30.0, help='HTTP cache freshness')
+    args = parser.parse_args()
+    bench(args.bench, args.skus, args.duplicates, args.products, args.latency, args.rounds, args.ttl)
+
+
+if __name__ == '__main__':
+    main()
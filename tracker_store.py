@@ -0,0 +1,347 @@
+"""
+tracker_store.py
+
+Incremental product diff engine for jordan_tracker.py. Keeps the last-seen
+state of every product in a small SQLite file and turns each poll into
+new / restock / sold_out / price / changed events.
+
+Work per poll is proportional to what changed: a page whose bytes hash the
+same as last time is skipped without being parsed, and within a changed page
+only records whose 64-bit hash moved are compared field by field and written.
+Pages already streamed through tracker_feed_parser arrive as projected
+records plus the same byte hash and take the same path.
+
+Products are tracked per feed, so one that several feeds list is reported on
+each of them (and reaches each feed's webhook). The first poll of a feed the
+store has never seen - a fresh database, or a target added while running -
+is a baseline: its products are stored without raising "new" events.
+
+Usage:
+    python tracker_store.py --bench 10000 100000
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+
+FIELDS = ('sku', 'title', 'price', 'available', 'launch')
+
+
+def hash64(data):
+    """Signed 64-bit blake2b of bytes, the width SQLite stores natively."""
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big', signed=True)
+
+
+def feed_objects(doc):
+    """The product objects of a product_feed (top level) or cic browse (data.products) page."""
+    if not isinstance(doc, dict):
+        return []
+    if 'objects' in doc:
+        return doc['objects'] or []
+    products = (doc.get('data') or {}).get('products') or {}
+    return products.get('objects') or []
+
+
+def product_record(obj):
+    """Flatten one feed object to the fields the tracker alerts on."""
+    props = (obj.get('publishedContent') or {}).get('properties') or {}
+    infos = obj.get('productInfo') or [{}]
+    info = infos[0]
+    merch = info.get('merchProduct') or {}
+    price = info.get('merchPrice') or obj.get('price') or {}
+    availability = info.get('availability') or {}
+    available = availability.get('available', obj.get('inStock'))
+    return {
+        'key': merch.get('id') or obj.get('id') or obj.get('pid'),
+        'sku': merch.get('styleColor') or obj.get('styleColor') or obj.get('sku'),
+        'title': props.get('title') or (info.get('productContent') or {}).get('title') or obj.get('title'),
+        'price': price.get('currentPrice'),
+        'available': None if available is None else bool(available),
+        'launch': merch.get('commerceStartDate') or props.get('publishStartDate'),
+        # When the feed says the product went up; not diffed, only used for detection lag
+        'published': props.get('publishStartDate'),
+    }
+
+
+def record_hash(rec):
+    # repr of a tuple of str/float/bool/None is stable and far cheaper than json.dumps
+    return hash64(repr(tuple(rec.get(f) for f in FIELDS)).encode())
+
+
+class SnapshotStore:
+    """Last-seen product state and page hashes, persisted in SQLite."""
+
+    def __init__(self, path='tracker_snapshot.db'):
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self._upgrade()
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS products (
+                feed TEXT NOT NULL,
+                key TEXT NOT NULL,
+                hash INTEGER,
+                sku TEXT,
+                title TEXT,
+                price REAL,
+                available INTEGER,
+                launch TEXT,
+                first_seen REAL,
+                last_changed REAL,
+                PRIMARY KEY (feed, key)
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                feed TEXT NOT NULL,
+                url TEXT NOT NULL,
+                hash INTEGER,
+                PRIMARY KEY (feed, url)
+            );
+            CREATE TABLE IF NOT EXISTS feeds (
+                feed TEXT PRIMARY KEY,
+                baselined REAL
+            );
+        ''')
+        # Page hashes are few (one per feed page) so they are kept in memory too
+        self.page_hashes = {(feed, url): h for feed, url, h in self.db.execute('SELECT feed, url, hash FROM pages')}
+        self.baselined = {feed for feed, in self.db.execute('SELECT feed FROM feeds')}
+        self.baseline_records = 0
+        self.pages_skipped = 0
+        self.pages_parsed = 0
+        self.records_compared = 0
+        # Cumulative time spent turning bodies into records and records into events
+        self.parse_seconds = 0.0
+        self.diff_seconds = 0.0
+
+    def close(self):
+        self.db.close()
+
+    def _upgrade(self):
+        """Move tables keyed on product / page URL alone to per-feed keys.
+
+        Rows kept the feed that happened to diff them first, so every feed's next poll is a fresh baseline.
+        """
+        pk = [row[1] for row in self.db.execute('PRAGMA table_info(products)') if row[5]]
+        if pk != ['key']:
+            return
+        with self.db:
+            # Re-read every page once so each feed's baseline sees all of its products
+            self.db.execute('DROP TABLE IF EXISTS pages')
+            self.db.execute('ALTER TABLE products RENAME TO products_old')
+            self.db.execute('''
+                CREATE TABLE products (
+                    feed TEXT NOT NULL, key TEXT NOT NULL, hash INTEGER, sku TEXT, title TEXT, price REAL,
+                    available INTEGER, launch TEXT, first_seen REAL, last_changed REAL,
+                    PRIMARY KEY (feed, key)
+                )
+            ''')
+            self.db.execute('''
+                INSERT INTO products SELECT coalesce(feed, ''), key, hash, sku, title, price, available, launch,
+                                            first_seen, last_changed FROM products_old
+            ''')
+            self.db.execute('DROP TABLE products_old')
+
+    def _known(self, feed, keys):
+        known = {}
+        keys = list(keys)
+        # Stay under SQLite's bound-parameter limit
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            marks = ','.join('?' * len(chunk))
+            for row in self.db.execute(
+                    'SELECT key, hash, sku, title, price, available, launch FROM products '
+                    f'WHERE feed = ? AND key IN ({marks})', [feed] + chunk):
+                known[row[0]] = row
+        return known
+
+    def diff_records(self, feed, records, now=None):
+        """Compare records with the store, persist the changes and return events."""
+        now = time.time() if now is None else now
+        t0 = time.perf_counter()
+        records = [r for r in records if r.get('key')]
+        hashes = {r['key']: record_hash(r) for r in records}
+        known = self._known(feed, hashes)
+        self.records_compared += len(records)
+
+        events = []
+        rows = []
+        for rec in records:
+            key = rec['key']
+            h = hashes[key]
+            old = known.get(key)
+            if old is not None and old[1] == h:
+                continue
+            event = {'feed': feed, 'key': key, 'detected_at': now, 'published': rec.get('published')}
+            event.update((f, rec.get(f)) for f in FIELDS)
+            if old is None:
+                event['kind'] = 'new'
+            else:
+                price, available = old[4], old[5]
+                was_available = None if available is None else bool(available)
+                if rec.get('available') and was_available is False:
+                    event['kind'] = 'restock'
+                elif rec.get('available') is False and was_available:
+                    event['kind'] = 'sold_out'
+                elif rec.get('price') != price:
+                    event['kind'] = 'price'
+                else:
+                    event['kind'] = 'changed'
+                if rec.get('price') != price:
+                    event['old_price'] = price
+            events.append(event)
+            available = rec.get('available')
+            rows.append((key, feed, h, rec.get('sku'), rec.get('title'), rec.get('price'),
+                         None if available is None else int(available), rec.get('launch'), now, now))
+
+        if rows:
+            with self.db:
+                self.db.executemany('''
+                    INSERT INTO products (key, feed, hash, sku, title, price, available, launch,
+                                          first_seen, last_changed)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(feed, key) DO UPDATE SET
+                        hash = excluded.hash, sku = excluded.sku,
+                        title = excluded.title, price = excluded.price, available = excluded.available,
+                        launch = excluded.launch, last_changed = excluded.last_changed
+                ''', rows)
+        self.diff_seconds += time.perf_counter() - t0
+        return events
+
+    def _page_unchanged(self, feed, url, h):
+        if self.page_hashes.get((feed, url)) == h:
+            self.pages_skipped += 1
+            return True
+        self.pages_parsed += 1
+        return False
+
+    def diff_page(self, feed, url, body, now=None):
+        """Events for one fetched page; unchanged pages cost a hash and a lookup."""
+        h = hash64(body)
+        if self._page_unchanged(feed, url, h):
+            return []
+        t0 = time.perf_counter()
+        try:
+            records = [product_record(o) for o in feed_objects(json.loads(body))]
+        except ValueError:
+            records = []
+        self.parse_seconds += time.perf_counter() - t0
+        return self._store_page(feed, url, h, records, now)
+
+    def diff_stream(self, feed, url, stream, now=None):
+        """Events for a page parsed by a FeedStream projecting with product_record."""
+        if self._page_unchanged(feed, url, stream.digest):
+            return []
+        return self._store_page(feed, url, stream.digest, stream.records, now)
+
+    def _store_page(self, feed, url, h, records, now):
+        events = self.diff_records(feed, records, now)
+        # Only remember the page once its records are stored, so a crash re-diffs it
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO pages (feed, url, hash) VALUES (?, ?, ?)', (feed, url, h))
+        self.page_hashes[feed, url] = h
+        return events
+
+    def diff_responses(self, feed, responses, now=None):
+        """Events for every 200 response of one poll (304s carry nothing new).
+
+        Until a feed has a baseline its polls only record products and return no
+        events; the baseline is committed by the first poll in which every page
+        was stored (200) or already known (304), so products on a page that
+        failed are not announced as new once it loads.
+        """
+        events = []
+        fresh = [resp for resp in responses if resp.status == 200]
+        for resp in fresh:
+            if resp.stream is not None:
+                events += self.diff_stream(feed, resp.url, resp.stream, now)
+            else:
+                events += self.diff_page(feed, resp.url, resp.body, now)
+        if feed not in self.baselined:
+            self.baseline_records += len(events)
+            if fresh and all(resp.status in (200, 304) for resp in responses):
+                self.mark_baselined(feed, now)
+            return []
+        return events
+
+    def mark_baselined(self, feed, now=None):
+        """From now on products first seen on `feed` are reported as new."""
+        with self.db:
+            self.db.execute('INSERT OR IGNORE INTO feeds (feed, baselined) VALUES (?, ?)',
+                            (feed, time.time() if now is None else now))
+        self.baselined.add(feed)
+
+
+def synthetic_pages(products, page_size=50, seed=3):
+    """Compact feed pages for benchmarking, as a list of (url, record dicts)."""
+    rng = random.Random(seed)
+    pages = []
+    for start in range(0, products, page_size):
+        objects = []
+        for i in range(start, min(products, start + page_size)):
+            objects.append({
+                'id': f't{i}',
+                'productInfo': [{
+                    'merchProduct': {'id': f'p{i}', 'styleColor': f'SC{i:07d}-{i % 1000:03d}',
+                                     'commerceStartDate': '2024-01-01T09:00:00Z'},
+                    'merchPrice': {'currentPrice': rng.choice([89.99, 99.99, 119.99, 179.99])},
+                    'availability': {'available': rng.random() > 0.2},
+                    'productContent': {'title': f'Air Jordan {i}'},
+                }],
+            })
+        pages.append((f'https://api.nike.com/product_feed/threads/v3/?anchor={start}&count={page_size}', objects))
+    return pages
+
+
+def bench(sizes, change_rate=0.001, polls=3):
+    """Time a cold load and steady-state polls where change_rate of products move."""
+    rng = random.Random(11)
+    for products in sizes:
+        pages = synthetic_pages(products)
+        bodies = [json.dumps({'objects': objs}, separators=(',', ':')).encode() for _, objs in pages]
+        with tempfile.TemporaryDirectory() as tmp:
+            store = SnapshotStore(os.path.join(tmp, 'bench.db'))
+            t0 = time.perf_counter()
+            for (url, _), body in zip(pages, bodies):
+                store.diff_page('bench', url, body)
+            cold = time.perf_counter() - t0
+
+            steady = []
+            for _ in range(polls):
+                touched = set()
+                for _ in range(max(1, int(products * change_rate))):
+                    p = rng.randrange(len(pages))
+                    obj = rng.choice(pages[p][1])
+                    info = obj['productInfo'][0]
+                    info['availability']['available'] = not info['availability']['available']
+                    touched.add(p)
+                for p in touched:
+                    bodies[p] = json.dumps({'objects': pages[p][1]}, separators=(',', ':')).encode()
+                t0 = time.perf_counter()
+                events = 0
+                for (url, _), body in zip(pages, bodies):
+                    events += len(store.diff_page('bench', url, body))
+                steady.append((time.perf_counter() - t0, events, len(touched)))
+            store.close()
+
+        mean = sum(s[0] for s in steady) / len(steady)
+        print(f'{products:>9} products {len(pages):>6} pages  cold load {cold:7.2f}s  '
+              f'poll {mean * 1000:8.1f} ms  ({steady[-1][2]} pages changed, {steady[-1][1]} events)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Product snapshot store and diff engine')
+    parser.add_argument('--bench', type=int, nargs='+', metavar='PRODUCTS', help='run the synthetic benchmark')
+    parser.add_argument('--change-rate', type=float, default=0.001, help='fraction of products changed per poll')
+    args = parser.parse_args()
+    if args.bench:
+        bench(args.bench, args.change_rate)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+"""
+tracker_webhooks.py
+
+Discord alert dispatcher for jordan_tracker.py. Events are routed to a
+webhook by feed, queued per webhook and coalesced so a burst of restocks goes
+out as a few messages of up to ten embeds instead of one request each.
+
+Every message is written to a SQLite outbox before it is sent and removed only
+once Discord accepts it, so alerts survive rate limits, outages and restarts;
+events still waiting out the coalescing window when the dispatcher stops are
+written to the outbox too. A message that runs out of retries stays in the
+outbox and is queued again after requeue_after seconds.
+Rate limits are honoured from the bucket headers (X-RateLimit-Remaining /
+Reset-After) before they are hit, and from Retry-After when a 429 arrives
+anyway; other failures retry with jittered exponential backoff.
+"""
+import asyncio
+import json
+import random
+import sqlite3
+import time
+from collections import deque
+
+
+MAX_EMBEDS = 10  # Discord's limit per message
+
+KIND_COLOURS = {
+    'new': 0x2ECC71,
+    'restock': 0x3498DB,
+    'price': 0xF1C40F,
+    'sold_out': 0x95A5A6,
+    'changed': 0x7F8C8D,
+}
+
+
+def event_embed(event):
+    """Discord embed for one tracker_store event."""
+    price = event.get('price')
+    if event.get('old_price') is not None:
+        price = f"{event['old_price']} -> {price}"
+    fields = [
+        {'name': 'SKU', 'value': str(event.get('sku') or '-'), 'inline': True},
+        {'name': 'Price', 'value': str(price if price is not None else '-'), 'inline': True},
+        {'name': 'In stock', 'value': {True: 'yes', False: 'no'}.get(event.get('available'), '-'), 'inline': True},
+    ]
+    if event.get('launch'):
+        fields.append({'name': 'Launch', 'value': str(event['launch']), 'inline': True})
+    embed = {
+        'title': f"{event.get('kind', 'update').replace('_', ' ').upper()}: {event.get('title') or event.get('key')}",
+        'color': KIND_COLOURS.get(event.get('kind'), 0x7F8C8D),
+        'fields': fields,
+        'footer': {'text': event.get('feed') or ''},
+    }
+    if event.get('detected_at'):
+        embed['timestamp'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(event['detected_at']))
+    return embed
+
+
+class Outbox:
+    """Messages not yet accepted by Discord, persisted in SQLite."""
+
+    def __init__(self, path='tracker_outbox.db'):
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                webhook TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created REAL NOT NULL
+            )
+        ''')
+
+    def add(self, webhook, payload):
+        with self.db:
+            cur = self.db.execute('INSERT INTO outbox (webhook, payload, created) VALUES (?, ?, ?)',
+                                  (webhook, json.dumps(payload), time.time()))
+        return cur.lastrowid
+
+    def delete(self, msg_id):
+        with self.db:
+            self.db.execute('DELETE FROM outbox WHERE id = ?', (msg_id,))
+
+    def pending(self):
+        rows = self.db.execute('SELECT id, webhook, payload FROM outbox ORDER BY id').fetchall()
+        return [(msg_id, webhook, json.loads(payload)) for msg_id, webhook, payload in rows]
+
+    def close(self):
+        self.db.close()
+
+
+class WebhookState:
+    def __init__(self):
+        self.embeds = deque()
+        self.messages = deque()
+        self.wake = asyncio.Event()
+        self.blocked_until = 0.0
+
+
+class WebhookDispatcher:
+    """Per-webhook queues that coalesce events and deliver them with retries.
+
+    routes maps a feed name to a webhook URL; events from other feeds go to
+    default. Call submit() with tracker_store events from inside the event loop
+    that is running run().
+    """
+
+    def __init__(self, client, routes, default=None, outbox=None, coalesce_window=1.0, max_retries=6,
+                 base_backoff=1.0, max_backoff=60.0, requeue_after=300.0):
+        self.client = client
+        self.routes = dict(routes)
+        self.default = default
+        self.outbox = outbox or Outbox()
+        self.coalesce_window = coalesce_window
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.requeue_after = requeue_after
+        self.webhooks = {}
+        self.parked = set()
+        self.tasks = {}
+        self.global_until = 0.0
+        self.stop = None
+        self.sent_messages = 0
+        self.sent_embeds = 0
+        self.rate_limited = 0
+        self.failures = 0
+        self.requeued = 0
+        self.on_delivered = None
+
+    def _state(self, url):
+        state = self.webhooks.get(url)
+        if state is None:
+            state = self.webhooks[url] = WebhookState()
+        task = self.tasks.get(url)
+        if task is not None and task.done() and not self.stop.is_set():
+            # A worker that died must not leave its webhook's outbox undelivered until a restart
+            if not task.cancelled() and task.exception() is not None:
+                print(f'Webhook worker crashed ({task.exception()!r}); restarting it')
+            task = None
+        if self.stop is not None and task is None:
+            self.tasks[url] = asyncio.get_running_loop().create_task(self._worker(url, state))
+        return state
+
+    def submit(self, events):
+        """Queue tracker events for delivery; returns how many were routed."""
+        routed = 0
+        for event in events:
+            url = self.routes.get(event.get('feed'), self.default)
+            if not url:
+                continue
+            state = self._state(url)
+            state.embeds.append((event, event_embed(event)))
+            state.wake.set()
+            routed += 1
+        return routed
+
+    def idle(self):
+        """Nothing queued or in flight; messages parked until a requeue are left to their timer."""
+        return all(not s.embeds and not s.messages for s in self.webhooks.values())
+
+    async def drain(self, timeout=None):
+        """Wait until everything queued so far has been delivered or given up on."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.idle():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def run(self, stop=None):
+        """Deliver until stop is set; messages left in the outbox are resent first."""
+        self.stop = stop or asyncio.Event()
+        for msg_id, url, payload in self.outbox.pending():
+            self._state(url).messages.append((msg_id, payload, []))
+        for url, state in self.webhooks.items():
+            self._state(url).wake.set()
+        await self.stop.wait()
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        self.tasks.clear()
+        for handle in self.parked:
+            handle.cancel()
+        self.parked.clear()
+        # Events still waiting out the coalescing window go to the outbox for the next run
+        for url, state in self.webhooks.items():
+            while state.embeds:
+                self._batch(url, state)
+            state.messages.clear()
+
+    def _batch(self, url, state):
+        """Move up to MAX_EMBEDS queued events into one outbox-backed message."""
+        batch = [state.embeds.popleft() for _ in range(min(MAX_EMBEDS, len(state.embeds)))]
+        payload = {'embeds': [embed for _, embed in batch]}
+        state.messages.append((self.outbox.add(url, payload), payload, [ev for ev, _ in batch]))
+
+    def _park(self, state, message):
+        """Queue a message that ran out of retries again after requeue_after seconds."""
+        def requeue():
+            self.parked.discard(handle)
+            self.requeued += 1
+            state.messages.append(message)
+            state.wake.set()
+
+        handle = asyncio.get_running_loop().call_later(self.requeue_after, requeue)
+        self.parked.add(handle)
+
+    async def _worker(self, url, state):
+        while True:
+            if not state.embeds and not state.messages:
+                state.wake.clear()
+                await state.wake.wait()
+            if state.embeds and not state.messages:
+                # Give the rest of a burst a moment to arrive so it shares messages
+                await asyncio.sleep(self.coalesce_window)
+            while state.embeds:
+                self._batch(url, state)
+            while state.messages:
+                msg_id, payload, events = state.messages[0]
+                delivered = await self._send(url, state, payload)
+                message = state.messages.popleft()
+                if delivered is None:
+                    self._park(state, message)
+                    continue
+                # Accepted, or rejected for good (bad payload / deleted webhook)
+                self.outbox.delete(msg_id)
+                if delivered and self.on_delivered is not None:
+                    self.on_delivered(url, events)
+
+    async def _wait_rate_limit(self, state):
+        delay = max(self.global_until, state.blocked_until) - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _backoff(self, attempt):
+        delay = min(self.max_backoff, self.base_backoff * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _send(self, url, state, payload):
+        """True once delivered, False if rejected for good, None if retries ran out."""
+        attempt = 0
+        while attempt <= self.max_retries:
+            await self._wait_rate_limit(state)
+            try:
+                resp = await self.client.post_json(url, payload)
+            except (OSError, EOFError, asyncio.TimeoutError, ValueError) as e:
+                # EOFError covers asyncio.IncompleteReadError: the connection closed mid-response
+                self.failures += 1
+                print(f'Webhook post failed ({e!r}), retrying')
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            self._note_bucket(state, resp.headers)
+            if resp.status == 429:
+                self.rate_limited += 1
+                retry_after = self._retry_after(resp)
+                until = time.monotonic() + retry_after
+                if resp.headers.get('x-ratelimit-global', '').lower() == 'true':
+                    self.global_until = max(self.global_until, until)
+                state.blocked_until = max(state.blocked_until, until)
+                # A 429 is Discord pacing us, not a failure, so it does not use up a retry
+                continue
+            if 200 <= resp.status < 300:
+                self.sent_messages += 1
+                self.sent_embeds += len(payload.get('embeds', []))
+                return True
+            if resp.status >= 500:
+                self.failures += 1
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            print(f'Webhook rejected message with {resp.status}: {resp.body[:200]!r}')
+            return False
+        print(f'Webhook still failing; message kept in the outbox and retried in {self.requeue_after:.0f}s')
+        return None
+
+    @staticmethod
+    def _retry_after(resp):
+        try:
+            return float(json.loads(resp.body).get('retry_after'))
+        except (ValueError, TypeError, AttributeError):
+            pass
+        try:
+            return float(resp.headers.get('retry-after', 1.0))
+        except ValueError:
+            return 1.0
+
+    @staticmethod
+    def _note_bucket(state, headers):
+        """Pause this webhook early when the bucket says no requests are left."""
+        if headers.get('x-ratelimit-remaining') == '0':
+            try:
+                reset_after = float(headers.get('x-ratelimit-reset-after', 0))
+            except ValueError:
+                return
+            state.blocked_until = max(state.blocked_until, time.monotonic() + reset_after)
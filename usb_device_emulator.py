@@ -0,0 +1,641 @@
+"""
+usb_device_emulator.py
+
+Emulated removable disks for usb_formatter_909.py, so format_drive,
+wipe_and_format and clear_readonly can be exercised without real hardware
+or Windows. Each disk is a sparse image file with a size, serial number,
+drive letter, a read-only attribute (clearable, like diskpart's), an
+optional write-protect switch (not clearable), injected I/O errors, bad
+ranges or a mid-operation disconnect, and a bandwidth/latency budget that
+mimics a slow USB 2.0 stick or a USB 3.x one. Disks may also share a hub
+whose bandwidth they split.
+
+Emulator.installed(module) swaps the formatter's enumeration and command
+helpers (list_removable_drives, run_proc, run_powershell_file,
+run_diskpart_script) for an interpreter of the exact commands it issues
+(diskpart clean/create/format/assign, Format-Volume, Get-Disk, Set-Disk,
+format.exe, fsutil), and answers its dialogs, so its own functions run
+unchanged against the images. run_batch drives one action over many disks
+in parallel, slowest first, and reports throughput and failures.
+
+Usage:
+    python usb_device_emulator.py --list --disks 4
+    python usb_device_emulator.py --action wipe --disks 8 --profile mixed --read-only 1 --faulty 1
+    python usb_device_emulator.py --action format --disks 8 --hub usb2 --workers 1,4,8
+"""
+import argparse
+import errno
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+MiB = 1 << 20
+PART_OFFSET = MiB   # diskpart aligns the first partition at 1 MiB
+
+# Sustained rates of typical sticks, bytes/s, and per-command latency in seconds
+PROFILES = {
+    'usb2': {'read_bps': 35e6, 'write_bps': 12e6, 'latency': 0.002},
+    'usb3': {'read_bps': 180e6, 'write_bps': 70e6, 'latency': 0.0004},
+}
+# Effective bandwidth a hub shares between everything plugged into it
+HUBS = {'usb2': 40e6, 'usb3': 400e6}
+
+OEM_IDS = {'NTFS': b'NTFS    ', 'FAT32': b'MSDOS5.0', 'EXFAT': b'EXFAT   '}
+
+DISKPART_ERRORS = {
+    errno.EROFS: 'The media is write protected.',
+    errno.EIO: 'The request could not be performed because of an I/O device error.',
+    errno.ENODEV: 'The device is not ready.',
+}
+
+
+def parse_size(text):
+    """Bytes from 512M / 4G / 1.5T / a plain number."""
+    text = str(text).strip().upper().rstrip('B').rstrip('I')
+    scale = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+
+def metadata_bytes(fs, size):
+    """Roughly what a quick format writes: FAT copies for FAT32/exFAT, $MFT plus $LogFile for NTFS."""
+    fs = fs.upper()
+    if fs == 'NTFS':
+        return min(64 * MiB, max(2 * MiB, size // 100)) + MiB
+    cluster = 4096 if size <= 8 << 30 else 8192 if size <= 16 << 30 else 16384 if size <= 32 << 30 else 32768
+    fat = size // cluster * 4
+    return (2 * fat if fs == 'FAT32' else fat) + 64 * 1024
+
+
+class Link:
+    """A bandwidth/latency budget for everything behind it: one disk, or a hub shared by several."""
+
+    def __init__(self, read_bps, write_bps, latency=0.0, time_scale=1.0):
+        self.read_bps = read_bps
+        self.write_bps = write_bps
+        self.latency = latency
+        self.time_scale = time_scale
+        self.free_at = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self, nbytes, write):
+        """Book a transfer; returns the monotonic time at which it completes."""
+        cost = (self.latency + nbytes / (self.write_bps if write else self.read_bps)) / self.time_scale
+        with self.lock:
+            start = max(time.monotonic(), self.free_at)
+            self.free_at = start + cost
+            return self.free_at
+
+
+class EmulatedDisk:
+    """A removable disk backed by a sparse image file."""
+
+    def __init__(self, path, size, index, serial=None, letter=None, model='Emulated USB Flash Disk',
+                 profile='usb3', read_only=False, write_protect=False, error_rate=0.0, bad_ranges=(),
+                 disconnect_after=None, hub=None, time_scale=1.0, seed=None, fs='FAT32', **rates):
+        self.path = path
+        self.size = size
+        self.index = index
+        self.serial = serial or f'EMU{index:04d}{random.Random(seed or index).getrandbits(32):08X}'
+        self.letter = self.home_letter = letter
+        self.model = f'{model} ({profile.upper()})'
+        self.profile = profile
+        self.read_only = read_only
+        self.write_protect = write_protect
+        self.error_rate = error_rate
+        self.bad_ranges = list(bad_ranges)
+        self.disconnect_after = disconnect_after
+        self.connected = True
+        self.hub = hub
+        params = dict(PROFILES[profile], **rates)
+        self.link = Link(params['read_bps'], params['write_bps'], params['latency'], time_scale)
+        self.rng = random.Random(seed if seed is not None else index)
+        self.partitioned = False
+        self.fs = ''
+        self.label = ''
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.io_errors = 0
+        self.lock = threading.Lock()
+        with open(path, 'ab') as f:
+            f.truncate(size)   # sparse: no blocks are allocated until written
+        self.fd = os.open(path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+        if fs:
+            # Sticks ship formatted: lay down the partition table and boot sector directly, unthrottled;
+            # the rest of the metadata is zeros, which the sparse image already reads back as
+            os.pwrite(self.fd, self._mbr(), 0)
+            os.pwrite(self.fd, self._boot_sector(fs), PART_OFFSET)
+            self.partitioned = True
+            self.fs = fs.upper()
+
+    def __repr__(self):
+        return f'<EmulatedDisk {self.index} {self.letter or "-"}: {self.size // MiB} MiB {self.profile}>'
+
+    @property
+    def health(self):
+        return 'Warning' if self.error_rate or self.bad_ranges or self.disconnect_after is not None else 'Healthy'
+
+    @property
+    def writable(self):
+        return not (self.read_only or self.write_protect)
+
+    def close(self):
+        os.close(self.fd)
+
+    def _check(self, offset, nbytes, write):
+        if self.disconnect_after is not None and self.bytes_written >= self.disconnect_after:
+            self.connected = False
+        if not self.connected:
+            raise OSError(errno.ENODEV, 'The device is not ready', self.path)
+        if write and not self.writable:
+            raise OSError(errno.EROFS, 'The media is write protected', self.path)
+        if offset < 0 or offset + nbytes > self.size:
+            raise OSError(errno.EINVAL, f'Access beyond the end of the disk at {offset}', self.path)
+        for start, length in self.bad_ranges:
+            if offset < start + length and start < offset + nbytes:
+                raise OSError(errno.EIO, f'Bad sector at {max(start, offset)}', self.path)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            raise OSError(errno.EIO, f'Injected I/O error at {offset}', self.path)
+
+    def _transfer(self, nbytes, write):
+        end = self.link.reserve(nbytes, write)
+        if self.hub is not None:
+            end = max(end, self.hub.reserve(nbytes, write))
+        delay = end - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def read(self, offset, nbytes):
+        with self.lock:
+            try:
+                self._check(offset, nbytes, False)
+            except OSError:
+                self.io_errors += 1
+                raise
+            self._transfer(nbytes, False)
+            data = os.pread(self.fd, nbytes, offset)
+            self.bytes_read += len(data)
+            return data
+
+    def write(self, offset, data):
+        with self.lock:
+            try:
+                self._check(offset, len(data), True)
+            except OSError:
+                self.io_errors += 1
+                raise
+            self._transfer(len(data), True)
+            os.pwrite(self.fd, data, offset)
+            self.bytes_written += len(data)
+
+    def zero(self, offset, length, block=MiB):
+        zeros = bytes(block)
+        end = offset + length
+        while offset < end:
+            n = min(block, end - offset)
+            self.write(offset, zeros[:n])
+            offset += n
+
+    # Disk-level operations, in the order diskpart applies them
+
+    def clean(self, everything=False):
+        """diskpart clean zeroes the first and last MiB; clean all zeroes the whole disk."""
+        if everything:
+            self.zero(0, self.size)
+        else:
+            self.zero(0, min(MiB, self.size))
+            self.zero(max(0, self.size - MiB), min(MiB, self.size))
+        self.partitioned = False
+        self.fs = self.label = ''
+        self.letter = None
+
+    def _mbr(self):
+        mbr = bytearray(512)
+        sectors = (self.size - PART_OFFSET) // 512
+        mbr[446:462] = (bytes([0x00, 0, 0, 0, 0x07, 0, 0, 0]) + (PART_OFFSET // 512).to_bytes(4, 'little') +
+                        min(sectors, 0xFFFFFFFF).to_bytes(4, 'little'))
+        mbr[510:512] = b'\x55\xaa'
+        return bytes(mbr)
+
+    @staticmethod
+    def _boot_sector(fs):
+        boot = bytearray(512)
+        boot[0:3] = b'\xeb\x52\x90'
+        boot[3:11] = OEM_IDS[fs.upper()]
+        boot[510:512] = b'\x55\xaa'
+        return bytes(boot)
+
+    def create_partition(self):
+        self.write(0, self._mbr())
+        self.partitioned = True
+
+    def format(self, fs, quick=True, label=''):
+        """Boot sector plus file-system metadata; a full format also zeroes the rest of the volume."""
+        fs = fs.upper()
+        if fs not in OEM_IDS:
+            raise ValueError(f'The file system {fs} is not supported')
+        if not self.partitioned:
+            raise OSError(errno.ENOENT, 'There is no volume selected', self.path)
+        self.write(PART_OFFSET, self._boot_sector(fs))
+        volume = self.size - PART_OFFSET
+        meta = min(metadata_bytes(fs, volume), volume - 512)
+        self.zero(PART_OFFSET + 512, meta)
+        if not quick:
+            self.zero(PART_OFFSET + 512 + meta, volume - 512 - meta)
+        self.fs = fs
+        self.label = label
+
+    def filesystem(self):
+        """File system named by the boot sector on the image, '' if there is none."""
+        oem = self.read(PART_OFFSET + 3, 8)
+        return next((fs for fs, tag in OEM_IDS.items() if tag == oem), '')
+
+    def clear_readonly(self):
+        """The read-only attribute can be cleared; the write-protect switch cannot."""
+        if self.write_protect:
+            return False
+        self.read_only = False
+        return True
+
+    def create_file(self, nbytes):
+        """fsutil file createnew: a zero-filled file in the volume's data area."""
+        if not self.fs:
+            raise OSError(errno.ENOENT, 'The system cannot find the path specified', self.path)
+        start = PART_OFFSET + 512 + metadata_bytes(self.fs, self.size - PART_OFFSET)
+        if start + nbytes > self.size:
+            raise OSError(errno.ENOSPC, 'There is not enough space on the disk', self.path)
+        self.zero(start, nbytes)
+
+
+class _Dialogs:
+    """Stands in for tkinter's messagebox and simpledialog: logs the message and gives the configured answer."""
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+
+    def _note(self, kind, title, message):
+        self.emulator.log(f'[{kind}] {title}: {message}')
+
+    def showinfo(self, title, message):
+        self._note('info', title, message)
+
+    def showwarning(self, title, message):
+        self._note('warning', title, message)
+
+    def showerror(self, title, message):
+        self._note('error', title, message)
+
+    def askyesno(self, title, message):
+        self._note('ask', title, message)
+        return self.emulator.confirm
+
+    def askstring(self, title, prompt):
+        # confirm_drive asks for the selected drive letter to be typed back
+        self._note('ask', title, prompt)
+        return self.emulator.selected() if self.emulator.confirm else ''
+
+
+class Emulator:
+    """Answers usb_formatter_909's enumeration and command helpers from a set of EmulatedDisks."""
+
+    PATCHED = ('list_removable_drives', 'run_proc', 'run_powershell_file', 'run_diskpart_script',
+               'is_admin', 'get_selected', 'log', 'messagebox', 'simpledialog')
+
+    def __init__(self, disks, confirm=True, admin=True, verbose=False):
+        self.disks = {d.index: d for d in disks}
+        self.confirm = confirm
+        self.admin = admin
+        self.verbose = verbose
+        self.commands = 0
+        self.letters = threading.Lock()
+        self.local = threading.local()
+
+    # Per-thread state, so one action per disk can run concurrently
+
+    def selected(self):
+        return getattr(self.local, 'token', None)
+
+    def log(self, text):
+        lines = getattr(self.local, 'lines', None)
+        if lines is not None:
+            lines.append(text)
+        if self.verbose or lines is None:
+            print(text)
+
+    def _fail(self, message):
+        failures = getattr(self.local, 'failures', None)
+        if failures is not None:
+            failures.append(message)
+        return message
+
+    def by_letter(self, letter):
+        letter = letter.upper()
+        return next((d for d in self.disks.values() if d.letter == letter), None)
+
+    def _assign(self, disk):
+        with self.letters:
+            used = {d.letter for d in self.disks.values() if d.letter}
+            if disk.home_letter and disk.home_letter not in used:
+                disk.letter = disk.home_letter
+            else:
+                disk.letter = next(chr(c) for c in range(ord('D'), ord('Z') + 1) if chr(c) not in used)
+            disk.home_letter = disk.letter
+
+    # The helpers the formatter calls
+
+    def list_removable_drives(self):
+        drives = []
+        for d in sorted(self.disks.values(), key=lambda d: d.index):
+            if not d.connected:
+                continue
+            if d.letter:
+                drives.append((d.letter, d.label, d.fs, d.size, str(d.index), d.model, d.health))
+            else:
+                drives.append((f'DISK{d.index}', '', '', d.size, str(d.index), d.model, d.health))
+        return drives
+
+    def get_selected(self):
+        return self.selected()
+
+    def is_admin(self):
+        return self.admin
+
+    def run_proc(self, cmd):
+        self.commands += 1
+        m = re.search(r'-DriveLetter (\w) \| Get-Disk\)\.Number', cmd)
+        if m:
+            disk = self.by_letter(m.group(1))
+            return (0, f'{disk.index}\n') if disk else (1, self._fail(f'No MSFT_Partition objects found with DriveLetter {m.group(1)}'))
+        m = re.match(r'echo Y\| format (\w): /FS:(\w+)( /Q)?', cmd, re.I)
+        if m:
+            return self._format_exe(m.group(1), m.group(2), bool(m.group(3)))
+        m = re.match(r'fsutil file createnew "(\w):\\[^"]*" (\d+)', cmd, re.I)
+        if m:
+            disk = self.by_letter(m.group(1))
+            if disk is None:
+                return 1, self._fail('The system cannot find the path specified.')
+            try:
+                disk.create_file(int(m.group(2)))
+            except OSError as e:
+                return 1, self._fail(f'Error:  {e.strerror}.')
+            return 0, 'File is created\n'
+        if re.match(r'(takeown|icacls|attrib)\b', cmd, re.I):
+            # Ownership, ACLs and attributes live inside the file system, which is not emulated
+            return 0, 'Successfully processed 0 files; Failed processing 0 files\n'
+        return 1, self._fail(f'Not emulated: {cmd}')
+
+    def run_powershell_file(self, script_text):
+        self.commands += 1
+        if 'Win32_DiskDrive' in script_text:
+            # Same drive|label|fs|size|index|model|health lines the WMI script prints
+            out = []
+            for d in self.list_removable_drives():
+                drive = f'{d[0]}:' if len(d[0]) == 1 else ''
+                out.append('|'.join([drive] + [str(f) for f in d[1:]]))
+            return 0, ''.join(line + '\n' for line in out)
+        m = re.search(r'Format-Volume -DriveLetter (\w) -FileSystem (\w+)', script_text)
+        if m:
+            disk = self.by_letter(m.group(1))
+            if disk is None:
+                return 1, self._fail(f'Format-Volume : No MSFT_Volume objects found with DriveLetter {m.group(1)}')
+            try:
+                disk.format(m.group(2), quick=' -Full' not in script_text, label=disk.label)
+            except (OSError, ValueError) as e:
+                return 1, self._fail(f'Format-Volume : {getattr(e, "strerror", None) or e}')
+            return 0, f'DriveLetter FileSystemType\n{disk.letter} {disk.fs}\n'
+        m = re.search(r'-DriveLetter (\w) \| Get-Disk \| Set-Disk -IsReadOnly \$false', script_text)
+        if m:
+            disk = self.by_letter(m.group(1))
+            if disk is not None:
+                disk.clear_readonly()
+            return 0, ''   # -ErrorAction SilentlyContinue: failures are silent
+        return 1, self._fail('Not emulated: ' + script_text.strip().splitlines()[0])
+
+    def run_diskpart_script(self, lines):
+        """Interpret a DiskPart script the way diskpart /s does: stop at the first error."""
+        self.commands += 1
+        out = []
+        disk = None
+        for line in lines:
+            words = line.strip().lower().split()
+            if not words:
+                continue
+            try:
+                if words[:2] == ['select', 'disk']:
+                    disk = self.disks.get(int(words[2])) if words[2].isdigit() else None
+                    if disk is None or not disk.connected:
+                        raise LookupError('The disk you specified is not valid.')
+                    out.append(f'Disk {disk.index} is now the selected disk.')
+                    continue
+                if words[0] == 'exit':
+                    break
+                if disk is None:
+                    raise LookupError('There is no disk selected.')
+                if words[:4] == ['attributes', 'disk', 'clear', 'readonly']:
+                    if not disk.clear_readonly():
+                        raise LookupError('DiskPart failed to clear disk attributes.')
+                    out.append('Disk attributes cleared successfully.')
+                elif words[:2] == ['online', 'disk']:
+                    out.append('This disk is already online.')
+                elif words[0] == 'clean':
+                    disk.clean(everything=words[1:2] == ['all'])
+                    out.append('DiskPart succeeded in cleaning the disk.')
+                elif words[:3] == ['create', 'partition', 'primary']:
+                    disk.create_partition()
+                    out.append('DiskPart succeeded in creating the specified partition.')
+                elif words[0] == 'format':
+                    opts = dict(w.split('=', 1) for w in words[1:] if '=' in w)
+                    disk.format(opts.get('fs', 'ntfs'), quick='quick' in words[1:], label=opts.get('label', ''))
+                    out.append('  100 percent completed\n\nDiskPart successfully formatted the volume.')
+                elif words[0] == 'assign':
+                    if not disk.partitioned:
+                        raise LookupError('There is no volume selected.')
+                    self._assign(disk)
+                    out.append('DiskPart successfully assigned the drive letter or mount point.')
+                else:
+                    raise LookupError(f'The command "{line.strip()}" is not emulated.')
+            except LookupError as e:
+                out.append(self._fail(str(e)))
+                return 1, '\n'.join(out) + '\n'
+            except OSError as e:
+                out.append(self._fail('DiskPart has encountered an error: ' +
+                                      DISKPART_ERRORS.get(e.errno, e.strerror)))
+                return 1, '\n'.join(out) + '\n'
+            except ValueError as e:
+                out.append(self._fail(f'DiskPart has encountered an error: {e}.'))
+                return 1, '\n'.join(out) + '\n'
+        return 0, '\n'.join(out) + '\n'
+
+    def _format_exe(self, letter, fs, quick):
+        disk = self.by_letter(letter)
+        if disk is None:
+            return 4, self._fail('Cannot open volume for direct access.')
+        try:
+            disk.format(fs, quick=quick, label=disk.label)
+        except OSError as e:
+            return 4, self._fail(f'{e.strerror}.\nFormat failed.')
+        except ValueError as e:
+            return 4, self._fail(f'{e}.')
+        return 0, 'Format complete.\n'
+
+    @contextmanager
+    def installed(self, module):
+        """Point the formatter module's helpers at this emulator for the duration of the block."""
+        saved = {name: getattr(module, name) for name in self.PATCHED if hasattr(module, name)}
+        dialogs = _Dialogs(self)
+        for name in self.PATCHED:
+            setattr(module, name, dialogs if name in ('messagebox', 'simpledialog') else getattr(self, name))
+        try:
+            yield self
+        finally:
+            for name in self.PATCHED:
+                if name in saved:
+                    setattr(module, name, saved[name])
+                else:
+                    delattr(module, name)
+
+    def run(self, token, action, *args):
+        """Call one of the formatter's actions with `token` selected; returns (log lines, failures)."""
+        self.local.token = token
+        self.local.lines = []
+        self.local.failures = []
+        try:
+            action(*args)
+        except Exception as e:
+            self.local.failures.append(f'{type(e).__name__}: {e}')
+        finally:
+            lines, failures = self.local.lines, self.local.failures
+            self.local.token = self.local.lines = self.local.failures = None
+        return lines, failures
+
+
+def make_disks(directory, count, size, profile='usb3', read_only=0, locked=0, faulty=0, flaky=0,
+               hub=None, time_scale=1.0, seed=9):
+    """`count` disks lettered from E:, the last ones read-only, write-protected, error-prone or flaky."""
+    rng = random.Random(seed)
+    shared = Link(HUBS[hub], HUBS[hub], 0.0, time_scale) if hub else None
+    disks = []
+    for i in range(count):
+        kind = profile if profile != 'mixed' else ('usb2', 'usb3')[i % 2]
+        disk = EmulatedDisk(os.path.join(directory, f'disk{i + 1}.img'), size, i + 1,
+                            letter=chr(ord('E') + i) if i < 22 else None, profile=kind,
+                            hub=shared, time_scale=time_scale, seed=rng.getrandbits(32))
+        disks.append(disk)
+    special = list(reversed(disks))
+    for disk in special[:read_only]:
+        disk.read_only = True
+    for disk in special[read_only:read_only + locked]:
+        disk.write_protect = True
+    for disk in special[read_only + locked:read_only + locked + faulty]:
+        disk.error_rate = 0.02
+    for disk in special[read_only + locked + faulty:read_only + locked + faulty + flaky]:
+        disk.disconnect_after = rng.randrange(MiB, 3 * MiB)
+    return disks
+
+
+ACTIONS = {
+    'wipe': ('wipe_and_format', (), 'NTFS'),
+    'format': ('format_drive', ('NTFS', True), 'NTFS'),
+    'format-fat32': ('format_drive', ('FAT32', True), 'FAT32'),
+    'clear-readonly': ('clear_readonly', (), None),
+}
+
+
+def expected_seconds(disk, fs='NTFS'):
+    """Rough time a wipe/format of this disk takes, for ordering the batch."""
+    nbytes = 2 * MiB + metadata_bytes(fs, disk.size - PART_OFFSET)
+    rate = disk.link.write_bps if disk.hub is None else min(disk.link.write_bps, disk.hub.write_bps)
+    return nbytes / rate
+
+
+def run_batch(emulator, module, action, disks=None, workers=4):
+    """Run one formatter action over many disks in parallel, slowest first; returns a result per disk."""
+    name, args, fs = ACTIONS[action]
+    func = getattr(module, name)
+    disks = sorted(disks or emulator.disks.values(), key=lambda d: expected_seconds(d, fs or 'NTFS'), reverse=True)
+
+    def one(disk):
+        token = disk.letter or f'DISK{disk.index}'
+        before = disk.bytes_written
+        t0 = time.perf_counter()
+        lines, failures = emulator.run(token, func, *args)
+        seconds = time.perf_counter() - t0
+        if fs:
+            # Check the image directly, not through read(): the check isn't the formatter's I/O, so it
+            # shouldn't count towards the disk's stats or draw one of its injected errors
+            oem = os.pread(disk.fd, 8, PART_OFFSET + 3)
+            ok = disk.fs == fs and disk.letter is not None and oem == OEM_IDS[fs]
+        else:
+            ok = disk.writable
+        return {'disk': disk, 'token': token, 'ok': ok, 'seconds': seconds,
+                'bytes': disk.bytes_written - before, 'failures': failures, 'log': lines}
+
+    with emulator.installed(module), ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(one, disks))
+
+
+def report(results, wall, time_scale=1.0):
+    """Per-disk and aggregate throughput, in emulated time."""
+    wall *= time_scale
+    total = sum(r['bytes'] for r in results)
+    for r in sorted(results, key=lambda r: r['disk'].index):
+        d = r['disk']
+        seconds = r['seconds'] * time_scale
+        rate = r['bytes'] / seconds / 1e6 if seconds else 0
+        status = 'ok' if r['ok'] else 'FAILED: ' + (r['failures'][-1] if r['failures'] else 'unexpected end state')
+        print(f'  {r["token"]:<6} {d.serial:<16} {d.profile:<5} {r["bytes"] / MiB:7.1f} MiB '
+              f'{seconds:6.2f}s {rate:7.1f} MB/s  {status}')
+    failed = sum(not r['ok'] for r in results)
+    print(f'  {len(results)} disks, {failed} failed, {total / MiB:.1f} MiB written in {wall:.2f}s '
+          f'({total / wall / 1e6 if wall else 0:.1f} MB/s aggregate)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run usb_formatter_909 actions against emulated USB disks')
+    parser.add_argument('--disks', type=int, default=4)
+    parser.add_argument('--size', default='2G', help='size of each disk (sparse image)')
+    parser.add_argument('--profile', default='mixed', choices=sorted(PROFILES) + ['mixed'])
+    parser.add_argument('--hub', choices=sorted(HUBS), help='put every disk behind one shared hub')
+    parser.add_argument('--read-only', type=int, default=0, help='disks with the read-only attribute set')
+    parser.add_argument('--locked', type=int, default=0, help='disks with the write-protect switch on')
+    parser.add_argument('--faulty', type=int, default=0, help='disks that fail 2%% of their I/O')
+    parser.add_argument('--flaky', type=int, default=0, help='disks that disconnect part-way through')
+    parser.add_argument('--action', choices=sorted(ACTIONS), default='wipe')
+    parser.add_argument('--workers', default='4', help='comma-separated list to compare batch widths')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='run the emulated clock this much faster')
+    parser.add_argument('--list', action='store_true', help='only show what the formatter would enumerate')
+    parser.add_argument('--dir', help='keep the disk images here instead of a temporary folder')
+    parser.add_argument('--verbose', action='store_true', help='print the formatter log as it runs')
+    args = parser.parse_args()
+
+    import usb_formatter_909 as formatter
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.dir or tmp
+        os.makedirs(directory, exist_ok=True)
+        for width in [int(w) for w in args.workers.split(',')]:
+            disks = make_disks(directory, args.disks, parse_size(args.size), args.profile, args.read_only,
+                               args.locked, args.faulty, args.flaky, args.hub, args.time_scale)
+            emulator = Emulator(disks, verbose=args.verbose)
+            if args.list:
+                with emulator.installed(formatter):
+                    for drive in formatter.list_removable_drives():
+                        print(drive)
+                for disk in disks:
+                    disk.close()
+                return
+            print(f'{args.action} on {len(disks)} disks, {width} at a time'
+                  + (f', behind one {args.hub} hub' if args.hub else ''))
+            t0 = time.perf_counter()
+            results = run_batch(emulator, formatter, args.action, workers=width)
+            report(results, time.perf_counter() - t0, args.time_scale)
+            for disk in disks:
+                disk.close()
+
+
+if __name__ == '__main__':
+    main()
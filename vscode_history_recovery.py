@@ -0,0 +1,352 @@
+"""
+vscode_history_recovery.py
+
+Batch file recovery from VS Code's local file history (README utility #1).
+
+VS Code keeps a snapshot of a file every time it is saved under
+User/History/<folder>/, with an entries.json naming the original file
+(`resource`) and one {id, timestamp} entry per snapshot file. This scans
+every folder in parallel, indexes original path -> newest snapshot (or the
+newest at or before --as-of), and restores whole trees in one batched pass:
+directories are created once up front, then the files are copied by a
+thread pool. Snapshots with identical content (a save without changes, the
+same file reached through two history folders) are recognised by content
+hash, and a file already restored with the same content is left alone, so
+re-running a restore only copies what changed.
+
+Usage:
+    python vscode_history_recovery.py --list --under C:/Users/me/project
+    python vscode_history_recovery.py --restore out/ --under C:/Users/me/project --as-of 2024-05-01T12:00
+    python vscode_history_recovery.py --synthetic /tmp/History --files 20000     # test data
+    python vscode_history_recovery.py --bench 20000
+"""
+import argparse
+import hashlib
+import json
+import os
+import posixpath
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import unquote, urlsplit
+
+
+def default_history_dir():
+    if sys.platform == 'win32':
+        base = os.environ.get('APPDATA', os.path.expanduser('~\\AppData\\Roaming'))
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Application Support')
+    else:
+        base = os.environ.get('XDG_CONFIG_HOME', os.path.expanduser('~/.config'))
+    return os.path.join(base, 'Code', 'User', 'History')
+
+
+def resource_path(uri):
+    """Original file path of an entries.json resource URI (file:///c%3A/x/y.py -> c:/x/y.py)."""
+    parts = urlsplit(uri)
+    path = unquote(parts.path)
+    if len(path) > 2 and path[0] == '/' and path[2] == ':':
+        # Windows drive path; VS Code writes the drive letter in lower case
+        path = path[1].lower() + path[2:]
+    elif parts.scheme not in ('', 'file') or parts.netloc:
+        # Remote / UNC resources keep their authority so they cannot collide with local paths
+        path = '//' + parts.netloc + path if parts.netloc else path
+    return path
+
+
+def local_path(path):
+    """A path typed by the user in the same form as resource_path gives (None stays None).
+
+    Only a URI is URL-decoded; a plain path is taken literally, so C#, ? and %
+    in folder names survive.
+    """
+    if path is None:
+        return None
+    if '://' in path:
+        return resource_path(path).rstrip('/')
+    path = path.replace('\\', '/')
+    if path[:1] == '/' and path[2:3] == ':':
+        path = path[1:]
+    if path[1:2] == ':':
+        # VS Code writes the drive letter in lower case
+        path = path[0].lower() + path[1:]
+    elif not path.startswith('/'):
+        path = os.path.abspath(path).replace('\\', '/')
+    # posixpath keeps a leading // (UNC and remote authorities)
+    return posixpath.normpath(path).rstrip('/')
+
+
+def parse_as_of(text):
+    """Epoch milliseconds from an ISO date/time or a number of epoch (milli)seconds (an argparse type)."""
+    try:
+        value = float(text)
+    except ValueError:
+        try:
+            return int(datetime.fromisoformat(text).timestamp() * 1000)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'not an ISO date/time or epoch time: {text!r}') from None
+    return int(value if value > 1e11 else value * 1000)
+
+
+class Entry:
+    __slots__ = ('path', 'timestamp', 'snapshot', 'source')
+
+    def __init__(self, path, timestamp, snapshot, source):
+        self.path = path
+        self.timestamp = timestamp
+        self.snapshot = snapshot
+        self.source = source
+
+
+def scan_folder(folder):
+    """Entries of one History/<folder>; returns (entries, errors).
+
+    A malformed entry (not an object, bad timestamp) is reported and skipped
+    so the rest of the folder is still recovered.
+    """
+    try:
+        with open(os.path.join(folder, 'entries.json'), encoding='utf-8') as f:
+            doc = json.load(f)
+        path = resource_path(doc['resource'])
+        raw = list(doc.get('entries') or [])
+    except FileNotFoundError:
+        return [], []
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        return [], [f'unreadable history folder {folder}: {e}']
+    present = set(os.listdir(folder))
+    entries, errors = [], []
+    for i, item in enumerate(raw):
+        try:
+            snap = item.get('id')
+            if snap in present:
+                entries.append(Entry(path, int(item.get('timestamp') or 0), os.path.join(folder, snap),
+                                     item.get('source')))
+        except (ValueError, TypeError, AttributeError, OverflowError) as e:
+            errors.append(f'malformed entry #{i} in {folder}: {e}')
+    return entries, errors
+
+
+def scan(history, workers=16):
+    """Every entry of every history folder, read in parallel; returns (entries, errors)."""
+    with os.scandir(history) as it:
+        folders = [e.path for e in it if e.is_dir()]
+    entries, errors = [], []
+    with ThreadPoolExecutor(workers) as pool:
+        for found, problems in pool.map(scan_folder, folders, chunksize=64):
+            entries += found
+            errors += problems
+    return entries, errors
+
+
+def fold(path):
+    """Windows drive paths compare case-insensitively."""
+    return path.lower() if path[1:2] == ':' else path
+
+
+def under_prefix(path, under):
+    if under is None:
+        return True
+    norm = fold(path.replace('\\', '/').rstrip('/'))
+    under = fold(under)
+    return norm == under or norm.startswith(under + '/')
+
+
+def build_index(entries, as_of=None, under=None):
+    """Original path -> newest entry (at or before as_of, epoch ms), limited to paths below `under`."""
+    under = local_path(under)
+    index = {}
+    for entry in entries:
+        if as_of is not None and entry.timestamp > as_of:
+            continue
+        if not under_prefix(entry.path, under):
+            continue
+        best = index.get(entry.path)
+        if best is None or entry.timestamp > best.timestamp:
+            index[entry.path] = entry
+    return index
+
+
+def copy_hashed(src, dest, block=1 << 20):
+    """Copy src to dest and return the content hash, reading src once."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(src, 'rb') as f, open(dest, 'wb') as out:
+        while True:
+            chunk = f.read(block)
+            if not chunk:
+                break
+            h.update(chunk)
+            out.write(chunk)
+    return h.hexdigest()
+
+
+def file_hash(path, block=1 << 20):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(block)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def versions(entries, path):
+    """History of one file, newest first, with identical snapshots collapsed into the newest of them."""
+    seen = set()
+    out = []
+    for entry in sorted((e for e in entries if e.path == path), key=lambda e: e.timestamp, reverse=True):
+        digest = file_hash(entry.snapshot)
+        if digest not in seen:
+            seen.add(digest)
+            out.append((entry, digest))
+    return out
+
+
+def destination(path, out_root, under=None):
+    """Where a restored file goes: its path below `under`, or its full path made relative."""
+    norm = path.replace('\\', '/')
+    if under is not None:
+        rel = norm[len(under):].lstrip('/')
+    else:
+        rel = norm.replace(':', '').lstrip('/')
+    return os.path.join(out_root, *[p for p in rel.split('/') if p not in ('', '.', '..')])
+
+
+def restore(index, out_root, under=None, workers=16, dry_run=False):
+    """Copy every indexed snapshot into out_root; returns counts of what was done."""
+    under = local_path(under)
+    plan = [(entry, destination(path, out_root, under)) for path, entry in sorted(index.items())]
+    stats = {'files': len(plan), 'copied': 0, 'unchanged': 0, 'duplicates': 0, 'failed': 0, 'bytes': 0}
+    if dry_run:
+        for entry, dest in plan:
+            print(f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry.timestamp / 1000))}  {dest}')
+        return stats
+
+    # One pass over the directory tree instead of a makedirs per file
+    for folder in sorted({os.path.dirname(dest) for _, dest in plan}):
+        os.makedirs(folder, exist_ok=True)
+
+    def copy(item):
+        entry, dest = item
+        try:
+            # Hash the snapshot up front only when there is a same-sized file to compare it with
+            if os.path.exists(dest) and os.path.getsize(dest) == os.path.getsize(entry.snapshot):
+                digest = file_hash(entry.snapshot)
+                if file_hash(dest) == digest:
+                    return 'unchanged', digest, 0
+            digest = copy_hashed(entry.snapshot, dest)
+            ts = entry.timestamp / 1000
+            os.utime(dest, (ts, ts))
+            return 'copied', digest, os.path.getsize(dest)
+        except OSError as e:
+            print(f'Failed to restore {dest}: {e}')
+            return 'failed', None, 0
+
+    digests = set()
+    with ThreadPoolExecutor(workers) as pool:
+        for result, digest, size in pool.map(copy, plan, chunksize=32):
+            stats[result] += 1
+            stats['bytes'] += size
+            if digest is not None:
+                if digest in digests:
+                    stats['duplicates'] += 1
+                digests.add(digest)
+    return stats
+
+
+def make_synthetic(history, files=1000, versions_per_file=4, seed=1, start=1700000000000):
+    """A History folder like VS Code's, for files under c:/work/project; returns the entry count."""
+    rng = random.Random(seed)
+    count = 0
+    for i in range(files):
+        folder = os.path.join(history, f'{rng.getrandbits(32):08x}{i:x}')
+        os.makedirs(folder, exist_ok=True)
+        name = f'c:/work/project/pkg{i % 50}/mod{i // 50}/file{i}.py'
+        entries = []
+        text = f'# file {i}\n'
+        for v in range(rng.randint(1, versions_per_file * 2 - 1)):
+            if rng.random() < 0.7 or v == 0:
+                text += f'value_{v} = {rng.random()}\n'
+            # The other saves repeat the previous content, as saving unchanged files does
+            snap = f'{rng.getrandbits(16):04x}{v}.py'
+            with open(os.path.join(folder, snap), 'w', encoding='utf-8') as f:
+                f.write(text)
+            entries.append({'id': snap, 'source': 'workspaceEdit' if v % 3 else 'undoRedo.source',
+                            'timestamp': start + i * 1000 + v * 60000})
+            count += 1
+        uri = 'file:///' + name.replace(':', '%3A')
+        with open(os.path.join(folder, 'entries.json'), 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'resource': uri, 'entries': entries}, f)
+    return count
+
+
+def bench(files, workers=16):
+    with tempfile.TemporaryDirectory() as tmp:
+        history = os.path.join(tmp, 'History')
+        t0 = time.perf_counter()
+        count = make_synthetic(history, files)
+        print(f'synthetic history: {files} files, {count} entries in {time.perf_counter() - t0:.1f}s')
+        for n in sorted({1, workers}):
+            t0 = time.perf_counter()
+            entries, errors = scan(history, n)
+            print(f'  scan with {n:>2} threads: {time.perf_counter() - t0:6.2f}s  ({len(entries)} entries)')
+        t0 = time.perf_counter()
+        index = build_index(entries)
+        print(f'  index: {time.perf_counter() - t0:6.2f}s  ({len(index)} paths)')
+        out = os.path.join(tmp, 'restored')
+        t0 = time.perf_counter()
+        stats = restore(index, out, 'c:/work/project', workers)
+        print(f'  restore: {time.perf_counter() - t0:6.2f}s  {stats}')
+        t0 = time.perf_counter()
+        stats = restore(index, out, 'c:/work/project', workers)
+        print(f'  re-run:  {time.perf_counter() - t0:6.2f}s  {stats}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recover files from VS Code local history')
+    parser.add_argument('--history', default=default_history_dir(), help='VS Code User/History folder')
+    parser.add_argument('--under', help='only files below this path (also the root of the restored tree)')
+    parser.add_argument('--as-of', type=parse_as_of, help='newest version at or before this time (ISO date/time or epoch)')
+    parser.add_argument('--list', action='store_true', help='list what would be restored')
+    parser.add_argument('--versions', metavar='PATH', help='list the distinct saved versions of one file')
+    parser.add_argument('--restore', metavar='OUT', help='restore the indexed files into this folder')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--synthetic', metavar='DIR', help='write a synthetic History folder here and exit')
+    parser.add_argument('--files', type=int, default=1000, help='files in the synthetic History')
+    parser.add_argument('--bench', type=int, metavar='FILES', help='time scan/index/restore on synthetic history')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        print(f'{make_synthetic(args.synthetic, args.files)} entries written to {args.synthetic}')
+        return
+    if args.bench:
+        bench(args.bench, args.workers)
+        return
+    if not os.path.isdir(args.history):
+        parser.error(f'no history folder at {args.history}')
+
+    t0 = time.perf_counter()
+    entries, errors = scan(args.history, args.workers)
+    for error in errors:
+        print(f'Skipped {error}')
+    print(f'{len(entries)} history entries scanned in {time.perf_counter() - t0:.2f}s')
+    if args.versions:
+        for entry, digest in versions(entries, local_path(args.versions)):
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry.timestamp / 1000))
+            print(f'{stamp}  {digest[:12]}  {entry.source or "":<20}  {entry.snapshot}')
+        return
+    index = build_index(entries, args.as_of, args.under)
+    print(f'{len(index)} files to recover')
+    if args.list or not args.restore:
+        restore(index, '.', args.under, dry_run=True)
+        return
+    t0 = time.perf_counter()
+    stats = restore(index, args.restore, args.under, args.workers)
+    print(f'Restored into {args.restore} in {time.perf_counter() - t0:.2f}s: {stats}')
+
+
+if __name__ == '__main__':
+    main()